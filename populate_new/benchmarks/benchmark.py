@@ -0,0 +1,358 @@
+"""Stage level benchmarks of the detection migration.
+
+Each stage is measured on its own over a seeded dataset, and then the whole pipeline is run
+end to end, against the in-process stand-in of ``populate_new.memory_db`` or against a local
+mongod when ``--mongo-uri`` is given. Throughput is measured in a first run and the peak
+memory traced by ``tracemalloc`` in a second one, so the tracing does not slow down the
+timed run. The memory of the transform worker processes is not traced.
+
+Run from the ``populate_new`` directory::
+
+    python -m benchmarks.benchmark --sizes 10000 1000000 --output results.json
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import platform
+import random
+import subprocess
+import time
+import tracemalloc
+from functools import partial
+from typing import Callable, Dict, List
+import bson
+import pykka
+from bson.raw_bson import RawBSONDocument
+from pymongo import InsertOne, MongoClient
+from populate_new.backpressure import InflightLimiter
+from populate_new.group_detection import GroupDetectionActor
+from populate_new.memory_db import UNIQUE_KEYS, MemoryDatabase
+from populate_new.metrics import MetricsRegistry
+from populate_new.migrate_detection import start_actors
+from populate_new.mongo_writer import MongoWriterActor
+from populate_new.sorting_hat import SortingHatActor
+from populate_new.source_reader import get_batch_from_db, start_readers
+from populate_new.spatial_index import ConeSearchIndex
+from populate_new.synthetic import generate_detections, generate_objects
+from populate_new.transform_actor import transform_batch
+from populate_new.transform_detection import transform_detection
+
+STAGES = ["read", "transform", "group", "sort", "write", "end_to_end"]
+
+
+class CountingActor(pykka.ThreadingActor):
+    """Sink that counts the documents it receives, in lists or dictionaries of lists"""
+
+    def __init__(self):
+        super().__init__()
+        self.documents = 0
+
+    def on_receive(self, message) -> None:
+        if isinstance(message, dict):
+            self.documents += sum(
+                len(v) if isinstance(v, list) else 1 for v in message.values()
+            )
+        else:
+            self.documents += len(message)
+
+
+def generate_dataset(size: int, seed: int) -> List[bytes]:
+    """Generates ``size`` encoded detections, the same ones for the same seed"""
+    random.seed(seed)
+    detections = generate_detections(generate_objects(size))
+    return [bson.encode(d) for d in itertools.islice(detections, size)]
+
+
+def batches(documents: list, batch_size: int) -> List[list]:
+    return [documents[i : i + batch_size] for i in range(0, len(documents), batch_size)]
+
+
+def group(detections: List[dict], batch_size: int) -> List[Dict[str, list]]:
+    """Builds the messages the grouper sends to the sorting hat"""
+    messages = []
+    for batch in batches(detections, batch_size):
+        groups = {}
+        for detection in batch:
+            groups.setdefault(detection["oid"], []).append(detection)
+        messages.append(groups)
+    return messages
+
+
+def operations(detections: List[dict]) -> Dict[tuple, InsertOne]:
+    return {(d["candid"], d["oid"]): InsertOne(dict(d)) for d in detections}
+
+
+def run_actors(actors: List[pykka.ActorRef]) -> None:
+    """Stops the actors in pipeline order, waiting for each one to drain its inbox"""
+    for actor in actors:
+        actor.stop()
+
+
+def bench_read(dataset, config) -> Callable[[], int]:
+    source = config["source"]()
+    source["detection"].insert_many(RawBSONDocument(raw) for raw in dataset)
+
+    def run():
+        cursor = source["detection"].find(
+            {}, batch_size=config["read_batch_size"], sort=[("_id", 1)]
+        )
+        return sum(
+            len(batch) for batch in get_batch_from_db(cursor, config["read_batch_size"])
+        )
+
+    return run
+
+
+def transformed(dataset: List[bytes]) -> List[dict]:
+    """Transforms the detections like a worker and decodes them like the transform actor"""
+    return bson.decode_all(transform_batch(transform_detection, dataset))
+
+
+def bench_transform(dataset, config) -> Callable[[], int]:
+    return lambda: sum(
+        len(transformed(batch)) for batch in batches(dataset, config["read_batch_size"])
+    )
+
+
+def bench_group(dataset, config) -> Callable[[], int]:
+    messages = batches(transformed(dataset), config["read_batch_size"])
+
+    def run():
+        sink = CountingActor.start()
+        grouper = GroupDetectionActor.start(sink, config["write_batch_size"])
+        for message in messages:
+            grouper.tell(message)
+        run_actors([grouper])
+        documents = sink.proxy().documents.get()
+        sink.stop()
+        return documents
+
+    return run
+
+
+def bench_sort(dataset, config) -> Callable[[], int]:
+    messages = group(transformed(dataset), config["write_batch_size"])
+
+    def run():
+        detections_sink = CountingActor.start()
+        objects_sink = CountingActor.start()
+        sorting_hat = SortingHatActor.start(
+            detections_sink, objects_sink, config["target"](), ConeSearchIndex()
+        )
+        for message in messages:
+            sorting_hat.tell(message)
+        run_actors([sorting_hat, objects_sink])
+        documents = detections_sink.proxy().documents.get()
+        detections_sink.stop()
+        return documents
+
+    return run
+
+
+def bench_write(dataset, config) -> Callable[[], int]:
+    messages = batches(transformed(dataset), config["write_batch_size"])
+
+    def run():
+        target = config["target"]()
+        writer = MongoWriterActor.start(
+            target,
+            config["write_batch_size"],
+            max_concurrent_writes=config["write_concurrency"],
+        )
+        for message in messages:
+            writer.tell(operations(message))
+        run_actors([writer])
+        return target["detection"].count_documents({})
+
+    return run
+
+
+def bench_end_to_end(dataset, config) -> Callable[[], int]:
+    source = config["source"]()
+    source["detection"].insert_many(RawBSONDocument(raw) for raw in dataset)
+
+    def run():
+        target = config["target"]()
+        metrics = MetricsRegistry()
+        actors = start_actors(
+            target,
+            config["write_batch_size"],
+            False,
+            True,
+            None,
+            InflightLimiter(config["max_inflight"]),
+            config["transformers"],
+            config["write_concurrency"],
+            spatial_index=ConeSearchIndex(),
+            metrics=metrics,
+        )
+        readers = start_readers(
+            source["detection"],
+            actors["transform"],
+            config["read_batch_size"],
+            [],
+            None,
+            None,
+            metrics,
+        )
+        pykka.get_all([reader.ask({"type": "read"}, block=False) for reader in readers])
+        run_actors(readers + list(actors.values()))
+        config["stage_metrics"] = metrics.snapshot()["stages"]
+        return target["detection"].count_documents({})
+
+    return run
+
+
+BENCHMARKS = {
+    "read": bench_read,
+    "transform": bench_transform,
+    "group": bench_group,
+    "sort": bench_sort,
+    "write": bench_write,
+    "end_to_end": bench_end_to_end,
+}
+
+
+def measure(name: str, size: int, dataset, config, trace_memory: bool) -> dict:
+    logging.info(f"Running {name} with {size} detections")
+    run = BENCHMARKS[name](dataset, config)
+    t0 = time.perf_counter()
+    documents = run()
+    elapsed = time.perf_counter() - t0
+    result = {
+        "stage": name,
+        "size": size,
+        "documents": documents,
+        "seconds": elapsed,
+        "documents_per_second": documents / elapsed if elapsed > 0 else 0.0,
+        "peak_memory_bytes": None,
+    }
+    if name == "end_to_end":
+        result["stage_metrics"] = config.pop("stage_metrics")
+    if trace_memory:
+        run = BENCHMARKS[name](dataset, config)
+        tracemalloc.start()
+        run()
+        result["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        config.pop("stage_metrics", None)
+    logging.info(
+        f"{name}: {result['documents_per_second']:.1f} documents/s, "
+        f"peak memory {result['peak_memory_bytes']} bytes"
+    )
+    return result
+
+
+def mongo_databases(uri: str):
+    """Returns factories of empty source and target databases in a local mongod"""
+    client = MongoClient(uri, document_class=RawBSONDocument)
+
+    def database(name: str, unique_keys: dict):
+        def create():
+            client.drop_database(name)
+            db = client[name]
+            for collection, keys in unique_keys.items():
+                db[collection].create_index([(key, 1) for key in keys], unique=True)
+            return db
+
+        return create
+
+    return database("benchmark_source", {}), database("benchmark_target", UNIQUE_KEYS)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(
+    sizes: List[int],
+    stages: List[str] = STAGES,
+    seed: int = 0,
+    read_batch_size: int = 2000,
+    write_batch_size: int = 1000,
+    transformers: int = 2,
+    write_concurrency: int = 4,
+    max_inflight: int = 100000,
+    mongo_uri: str = None,
+    trace_memory: bool = True,
+) -> dict:
+    """Runs the benchmarks of each stage for each dataset size and returns the results"""
+    if mongo_uri is None:
+        source, target = MemoryDatabase, partial(MemoryDatabase, UNIQUE_KEYS)
+    else:
+        source, target = mongo_databases(mongo_uri)
+    config = {
+        "source": source,
+        "target": target,
+        "read_batch_size": read_batch_size,
+        "write_batch_size": write_batch_size,
+        "transformers": transformers,
+        "write_concurrency": write_concurrency,
+        "max_inflight": max_inflight,
+    }
+    results = []
+    for size in sizes:
+        dataset = generate_dataset(size, seed)
+        for name in stages:
+            results.append(measure(name, size, dataset, config, trace_memory))
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "database": "mongod" if mongo_uri else "memory",
+        "seed": seed,
+        "config": {k: v for k, v in config.items() if isinstance(v, int)},
+        "results": results,
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the migration stages")
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[10000],
+        help="Number of detections of each dataset, e.g. 10000 1000000 10000000",
+    )
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--read-batch-size", type=int, default=2000)
+    parser.add_argument("--write-batch-size", type=int, default=1000)
+    parser.add_argument("--transformers", type=int, default=2)
+    parser.add_argument("--write-concurrency", type=int, default=4)
+    parser.add_argument(
+        "--mongo-uri",
+        default=None,
+        help="Local mongod to run against instead of the in-process stand-in. The "
+        "benchmark_source and benchmark_target databases are dropped",
+    )
+    parser.add_argument(
+        "--no-memory", action="store_true", help="Skip the peak memory runs"
+    )
+    parser.add_argument("--output", default="benchmark_results.json")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    results = run_benchmarks(
+        args.sizes,
+        args.stages,
+        args.seed,
+        args.read_batch_size,
+        args.write_batch_size,
+        args.transformers,
+        args.write_concurrency,
+        mongo_uri=args.mongo_uri,
+        trace_memory=not args.no_memory,
+    )
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
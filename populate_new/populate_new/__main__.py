@@ -0,0 +1,3 @@
+from populate_new.populate_db import main
+
+main()
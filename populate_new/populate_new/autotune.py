@@ -0,0 +1,166 @@
+import logging
+import threading
+import time
+from typing import Dict, List, Tuple
+
+
+class BatchSizeTuner:
+    """Adjusts a batch size at runtime from the latency and throughput of its stage.
+
+    The stage reports the documents and seconds of each batch. Every ``window`` batches the
+    throughput of the window is compared with the previous one. The size keeps moving by
+    ``factor`` in the same direction while the throughput improves, and turns around when it
+    drops by more than ``tolerance``. The size shrinks while the average batch latency is
+    above ``max_latency``. It always stays within ``[minimum, maximum]``.
+
+    Every change is logged and kept in ``history`` with its time and throughput.
+
+    Parameters
+    ----------
+    name : str
+        Name of the batch size, used in logs
+    initial : int
+        Starting batch size
+    minimum : int
+        Smallest batch size
+    maximum : int
+        Largest batch size
+    window : int
+        Number of batches measured before each adjustment
+    factor : float
+        Ratio between consecutive batch sizes
+    max_latency : float
+        Seconds above which the batches are made smaller
+    tolerance : float
+        Relative throughput drop that turns the search around
+
+    Examples
+    --------
+    >>> tuner = BatchSizeTuner("write", 1000, 100, 10000, window=1)
+    >>> tuner.observe(1000, 0.5)
+    >>> tuner.value
+    1250
+    """
+
+    def __init__(
+        self,
+        name: str,
+        initial: int,
+        minimum: int,
+        maximum: int,
+        window: int = 10,
+        factor: float = 1.25,
+        max_latency: float = 5,
+        tolerance: float = 0.05,
+    ):
+        if not minimum <= maximum:
+            raise ValueError(f"Invalid bounds [{minimum}, {maximum}] for {name}")
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.value = self.clamp(initial)
+        self.window = window
+        self.factor = factor
+        self.max_latency = max_latency
+        self.tolerance = tolerance
+        self.direction = 1
+        self.last_throughput = None
+        self.batches = 0
+        self.documents = 0
+        self.seconds = 0.0
+        self.history: List[Tuple[float, int, float]] = [(time.time(), self.value, 0.0)]
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger("BatchSizeTuner")
+
+    def clamp(self, value: float) -> int:
+        return int(min(self.maximum, max(self.minimum, round(value))))
+
+    def observe(self, documents: int, seconds: float) -> None:
+        """Records a batch of the stage, adjusting the size at the end of each window"""
+        with self.lock:
+            self.batches += 1
+            self.documents += documents
+            self.seconds += seconds
+            if self.batches >= self.window:
+                self.adjust()
+
+    def adjust(self) -> None:
+        throughput = self.documents / self.seconds if self.seconds > 0 else float("inf")
+        latency = self.seconds / self.batches
+        dropped = (
+            self.last_throughput is not None
+            and throughput < self.last_throughput * (1 - self.tolerance)
+        )
+        if latency > self.max_latency:
+            self.direction = -1
+        elif dropped:
+            self.direction = -self.direction
+        self.last_throughput = throughput
+        self.batches, self.documents, self.seconds = 0, 0, 0.0
+        value = self.clamp(self.value * self.factor**self.direction)
+        if value == self.value:
+            # at a bound, search from there in the other direction
+            self.direction = -self.direction
+            return
+        self.logger.info(
+            f"{self.name} batch size {self.value} -> {value} "
+            f"({throughput:.1f} documents/s, {latency:.3f} s per batch)"
+        )
+        self.value = value
+        self.history.append((time.time(), value, throughput))
+
+
+class Autotuner:
+    """Batch sizes of a migration tuned at runtime.
+
+    ``cursor`` is the batch size of the source cursors, tuned by the time the readers wait for
+    them. ``pipeline`` is the number of documents the readers send in each message, tuned by
+    the transform latency. ``write`` is the number of operations of each bulk write, tuned by
+    the writer and used by the actors that build the operations.
+
+    Parameters
+    ----------
+    read_batch_size : int
+        Starting cursor and pipeline batch size
+    write_batch_size : int
+        Starting bulk write size
+    bounds : Dict[str, Tuple[int, int]], optional
+        ``(minimum, maximum)`` of each batch size by name, a tenth and ten times the
+        starting size if not given
+    window : int
+        Number of batches measured before each adjustment
+    """
+
+    def __init__(
+        self,
+        read_batch_size: int,
+        write_batch_size: int,
+        bounds: Dict[str, Tuple[int, int]] = None,
+        window: int = 10,
+    ):
+        bounds = bounds or {}
+        initial = {
+            "cursor": read_batch_size,
+            "pipeline": read_batch_size,
+            "write": write_batch_size,
+        }
+        self.tuners = {
+            name: BatchSizeTuner(
+                name,
+                size,
+                *bounds.get(name, (max(1, size // 10), size * 10)),
+                window=window,
+            )
+            for name, size in initial.items()
+        }
+        self.cursor = self.tuners["cursor"]
+        self.pipeline = self.tuners["pipeline"]
+        self.write = self.tuners["write"]
+
+    def values(self) -> Dict[str, int]:
+        return {name: tuner.value for name, tuner in self.tuners.items()}
+
+    def log_summary(self, logger: logging.Logger) -> None:
+        for name, tuner in self.tuners.items():
+            sizes = " -> ".join(str(value) for _, value, _ in tuner.history)
+            logger.info(f"Batch size {name}: {sizes}")
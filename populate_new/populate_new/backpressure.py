@@ -0,0 +1,125 @@
+import logging
+import threading
+import time
+from typing import Dict
+import pykka
+
+
+class InflightLimiter:
+    """Credit-based limit on the number of detections inside the pipeline.
+
+    Readers acquire one credit per detection before sending a batch and the writer releases
+    them once the detections are written, so the readers block when the pipeline holds
+    ``max_inflight`` detections.
+
+    A single batch larger than the limit is let through when the pipeline is empty. Otherwise
+    the readers block for as long as the credits are exhausted, however slow the target is.
+    The stages that buffer detections send them on by age, so their credits come back
+    without more reads.
+
+    Detections held by a stage until more input arrives, like the complete groups of the
+    grouper, are taken out of the count with ``hold`` and put back with ``unhold`` when they
+    are sent on, so holding them cannot block the reads they wait for.
+
+    With a ``stall_timeout``, a waiting batch is let through after that many seconds without
+    releases. The wait starts over after each batch let through, so the pipeline never holds
+    more than one extra batch per timeout. The first escape is logged as a warning.
+
+    Parameters
+    ----------
+    max_inflight : int
+        Maximum number of detections read but not yet written
+    stall_timeout : float, optional
+        Seconds without releases before a waiting batch is let through, never if not given
+    """
+
+    def __init__(self, max_inflight: int, stall_timeout: float = None):
+        self.max_inflight = max_inflight
+        self.stall_timeout = stall_timeout
+        self.inflight = 0
+        self.condition = threading.Condition()
+        self.last_release = time.time()
+        self.escapes = 0
+        self.logger = logging.getLogger("InflightLimiter")
+
+    def acquire(self, n: int) -> None:
+        with self.condition:
+            while self.inflight > 0 and self.inflight + n > self.max_inflight:
+                self.condition.wait(timeout=1)
+                if self.stall_timeout is None:
+                    continue
+                stalled = time.time() - self.last_release
+                if stalled > self.stall_timeout:
+                    if self.escapes == 0:
+                        self.logger.warning(
+                            f"No detections written in {stalled:.0f} seconds with "
+                            f"{self.inflight} in flight, letting {n} more through"
+                        )
+                    self.escapes += 1
+                    self.last_release = time.time()
+                    break
+            self.inflight += n
+
+    def release(self, n: int) -> None:
+        with self.condition:
+            self.inflight -= n
+            self.last_release = time.time()
+            self.condition.notify_all()
+
+    def hold(self, n: int) -> None:
+        """Returns the credits of detections held until more input is read"""
+        self.release(n)
+
+    def unhold(self, n: int) -> None:
+        """Takes back the credits of held detections without waiting, as they are sent on"""
+        with self.condition:
+            self.inflight += n
+
+
+def inbox_depth(actor_ref: pykka.ActorRef) -> int:
+    """Returns the number of messages waiting in the inbox of an actor"""
+    return actor_ref.actor_inbox.qsize()
+
+
+class QueueDepthMonitor(threading.Thread):
+    """Thread that periodically logs the inbox depth of each actor of the pipeline.
+
+    Parameters
+    ----------
+    actors : Dict[str, pykka.ActorRef]
+        Actors to watch by name
+    limiter : InflightLimiter, optional
+        Limiter whose in-flight detections are logged too
+    interval : float
+        Seconds between logs
+    """
+
+    def __init__(
+        self,
+        actors: Dict[str, pykka.ActorRef],
+        limiter: InflightLimiter = None,
+        interval: float = 10,
+    ):
+        super().__init__(daemon=True)
+        self.actors = actors
+        self.limiter = limiter
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.logger = logging.getLogger("QueueDepthMonitor")
+
+    def depths(self) -> Dict[str, int]:
+        return {
+            name: inbox_depth(actor_ref)
+            for name, actor_ref in self.actors.items()
+            if actor_ref.is_alive()
+        }
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            depths = ", ".join(f"{k}={v}" for k, v in self.depths().items())
+            if self.limiter is not None:
+                depths += f", inflight={self.limiter.inflight}"
+            self.logger.info(f"Queue depths: {depths}")
+
+    def stop(self):
+        self.stopped.set()
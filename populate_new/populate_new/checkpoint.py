@@ -0,0 +1,108 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Iterable, List
+from bson import json_util
+
+
+class CheckpointTracker:
+    """Tracks which source documents were written and persists the progress of each range.
+
+    Readers register every batch before sending it to the pipeline and the writer acknowledges
+    the ``_id`` of each document after its bulk write. A range checkpoint only moves forward
+    when every batch up to that point was acknowledged, so the stored value is the highest
+    ``_id`` of the range such that every document up to it has been written.
+
+    The state is saved as a JSON file with the split points of the ranges, so a resumed run
+    reads the same ranges and starts each of them after its checkpoint. When the ranges are
+    read in ``oid`` order, the ranges are split by ``oid`` and the checkpoint of a range is
+    the highest ``oid`` such that every document with a lower ``oid`` has been written.
+
+    Parameters
+    ----------
+    path : str
+        Path of the state file
+    split_points : List[Any]
+        Split points of the source ranges
+    checkpoints : dict, optional
+        Last fully written ``_id`` by range number
+    key : str
+        Field the ranges are split and read by, ``_id`` or ``oid``
+    """
+
+    def __init__(
+        self,
+        path: str,
+        split_points: List[Any],
+        checkpoints: dict = None,
+        key: str = "_id",
+    ):
+        self.path = path
+        self.key = key
+        self.split_points = list(split_points)
+        self.checkpoints = dict(checkpoints or {})
+        self.pending = {}
+        self.batches = {}
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger("CheckpointTracker")
+
+    @classmethod
+    def load(cls, path: str) -> "CheckpointTracker":
+        """Creates a tracker from an existing state file"""
+        with open(path) as f:
+            state = json_util.loads(f.read())
+        checkpoints = {int(k): v for k, v in state["checkpoints"].items()}
+        return cls(path, state["split_points"], checkpoints, state.get("key", "_id"))
+
+    def checkpoint(self, partition: int) -> Any:
+        """Returns the last fully written ``_id`` of a range, None if nothing was written"""
+        return self.checkpoints.get(partition)
+
+    def register_batch(
+        self, partition: int, seq: int, ids: List[Any], position: Any = None
+    ) -> None:
+        """Registers a batch read from a range with the ``_id`` of its documents.
+
+        ``position`` is the checkpoint of the range once the batch is written, the last
+        ``_id`` of the batch if not given.
+        """
+        if not ids:
+            return
+        with self.lock:
+            batches = self.batches.setdefault(partition, OrderedDict())
+            batches[seq] = [len(ids), ids[-1] if position is None else position]
+            for _id in ids:
+                self.pending[_id] = (partition, seq)
+
+    def acknowledge(self, ids: Iterable[Any]) -> None:
+        """Marks documents as written and saves the state if any checkpoint moved"""
+        with self.lock:
+            touched = set()
+            for _id in ids:
+                location = self.pending.pop(_id, None)
+                if location is None:
+                    continue
+                partition, seq = location
+                self.batches[partition][seq][0] -= 1
+                touched.add(partition)
+            advanced = False
+            for partition in touched:
+                batches = self.batches[partition]
+                while batches and next(iter(batches.values()))[0] == 0:
+                    _, (_, last_id) = batches.popitem(last=False)
+                    self.checkpoints[partition] = last_id
+                    advanced = True
+            if advanced:
+                self.save()
+
+    def save(self) -> None:
+        state = {
+            "key": self.key,
+            "split_points": self.split_points,
+            "checkpoints": self.checkpoints,
+        }
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(json_util.dumps(state))
+        os.replace(tmp_path, self.path)
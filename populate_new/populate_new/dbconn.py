@@ -1,25 +1,20 @@
+from functools import lru_cache
+from typing import Tuple
 from pymongo import MongoClient
-from db_plugins.db.mongo._connection import MongoConnection
+from pymongo.database import Database
 from bson.raw_bson import RawBSONDocument
+from populate_new.indexes import create_collection_indexes, model_indexes, split_indexes
 import os
 
 
-# import models so that they can be created by MongoConnection
-from db_plugins.db.mongo.models import Object, Detection, NonDetection, ForcedPhotometry
+def create_indexes(db: Database, deferred_indexes: Tuple[str, ...] = ()):
+    """Creates the indexes of the db_plugins models in the target database.
 
-
-def create_indexes():
-    db = MongoConnection(
-        {
-            "host": "localhost",
-            "serverSelectionTimeoutMS": 3000,  # 3 second timeout
-            "port": 27018,
-            "database": "new_db",
-            "username": "",
-            "password": "",
-        }
-    )
-    db.create_db()
+    The collections in ``deferred_indexes`` only get the indexes needed while they are
+    loaded, the rest are built afterwards by ``populate_new.indexes.build_deferred_indexes``.
+    """
+    before, _ = split_indexes(model_indexes(), deferred_indexes)
+    create_collection_indexes(db, before)
 
 
 def read_env_variables(which="SOURCE"):
@@ -32,7 +27,9 @@ def read_env_variables(which="SOURCE"):
     return host, port, database, username, password, auth_source
 
 
-def create_mongo_connections():
+@lru_cache(maxsize=None)
+def create_source_connection():
+    # cached so every migration run in the same process shares the connection pools
     print("connecting to source database")
     host, port, database, username, password, auth_source = read_env_variables("SOURCE")
     source_client = MongoClient(
@@ -41,15 +38,22 @@ def create_mongo_connections():
         authSource=auth_source,
         document_class=RawBSONDocument,
     )
-    source_db = source_client[database]
+    return source_client[database]
+
+
+@lru_cache(maxsize=None)
+def create_target_connection(deferred_indexes: Tuple[str, ...] = ()):
     print("connecting to target database")
     host, port, database, username, password, auth_source = read_env_variables("TARGET")
-    create_indexes()
     target_client = MongoClient(
         host=host,
         port=port,
         authSource=auth_source,
         document_class=RawBSONDocument,
     )
-    target_db = target_client[database]
-    return source_db, target_db
+    create_indexes(target_client[database], deferred_indexes)
+    return target_client[database]
+
+
+def create_mongo_connections(deferred_indexes: Tuple[str, ...] = ()):
+    return create_source_connection(), create_target_connection(deferred_indexes)
@@ -0,0 +1,349 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, List, Tuple
+import bson
+from bson import json_util
+from bson.raw_bson import RawBSONDocument
+from pymongo import InsertOne, UpdateOne
+from populate_new.memory_db import MemoryClient, MemoryCursor
+
+EXPORT_FORMATS = ["bson", "parquet"]
+
+
+def operation_document(operation) -> dict:
+    """Returns the document an insert or an upsert leaves in a new collection"""
+    if isinstance(operation, InsertOne):
+        return operation._doc
+    if isinstance(operation, UpdateOne):
+        document = dict(operation._filter)
+        document.update(operation._doc.get("$setOnInsert", {}))
+        document.update(operation._doc.get("$set", {}))
+        for field, values in operation._doc.get("$addToSet", {}).items():
+            document[field] = list(values["$each"])
+        return document
+    raise TypeError(f"Unsupported operation {operation}")
+
+
+class HashingFile:
+    """Binary file that keeps the size and sha256 of the bytes written to it"""
+
+    def __init__(self, path: str):
+        self.file = open(path, "wb")
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self.sha256.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+    def flush(self) -> None:
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class FileStream(ABC):
+    """Sequence of rotated files of one collection written by a single writer thread.
+
+    A new file is started every ``max_documents`` documents and each closed file is added to
+    the manifest entries with its number of documents, size and sha256. Subclasses write a
+    file format by opening ``path``, adding each document and closing the file.
+
+    Parameters
+    ----------
+    directory : str
+        Directory of the export
+    database : str
+        Name of the target database
+    collection : str
+        Name of the collection
+    writer : int
+        Number of the writer thread
+    max_documents : int
+        Number of documents of each file
+    """
+
+    extension = ""
+
+    def __init__(
+        self,
+        directory: str,
+        database: str,
+        collection: str,
+        writer: int,
+        max_documents: int,
+    ):
+        self.directory = directory
+        self.database = database
+        self.collection = collection
+        self.writer = writer
+        self.max_documents = max_documents
+        self.seq = 0
+        self.documents = 0
+        self.path = None
+        self.files = []
+
+    def write(self, documents: Iterable) -> None:
+        for document in documents:
+            if self.path is None:
+                self.seq += 1
+                self.path = self.file_path()
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self.open()
+            self.add(document)
+            self.documents += 1
+            if self.documents >= self.max_documents:
+                self.rotate()
+
+    def file_path(self) -> str:
+        return os.path.join(
+            self.directory,
+            f"part-{self.writer:03d}-{self.seq:05d}",
+            self.database,
+            f"{self.collection}{self.extension}",
+        )
+
+    def rotate(self) -> None:
+        if self.path is None:
+            return
+        size, sha256 = self.close_file()
+        self.files.append(
+            {
+                "path": os.path.relpath(self.path, self.directory),
+                "collection": self.collection,
+                "documents": self.documents,
+                "bytes": size,
+                "sha256": sha256,
+            }
+        )
+        self.path = None
+        self.documents = 0
+
+    @abstractmethod
+    def open(self) -> None:
+        """Starts a new file at ``path``"""
+
+    @abstractmethod
+    def add(self, document) -> None:
+        """Adds a document to the current file"""
+
+    @abstractmethod
+    def close_file(self) -> Tuple[int, str]:
+        """Closes the current file and returns its size and sha256"""
+
+
+class BSONFileStream(FileStream):
+    """Gzip compressed BSON files, laid out like a ``mongodump --gzip`` of each part.
+
+    Each part directory can be loaded with ``mongorestore --gzip --dir <part>``.
+    """
+
+    extension = ".bson.gz"
+
+    def open(self) -> None:
+        self.file = HashingFile(self.path)
+        self.gzip = gzip.GzipFile(fileobj=self.file, mode="wb", compresslevel=6)
+
+    def add(self, document) -> None:
+        if isinstance(document, RawBSONDocument):
+            self.gzip.write(document.raw)
+        else:
+            self.gzip.write(bson.encode(document))
+
+    def close_file(self):
+        self.gzip.close()
+        self.file.close()
+        return self.file.size, self.file.sha256.hexdigest()
+
+
+def parquet_value(value):
+    """Converts values with no Arrow type to strings, nested values to Extended JSON"""
+    if isinstance(value, (dict, list)):
+        return json_util.dumps(value)
+    if isinstance(value, (bool, int, float, str)) or value is None:
+        return value
+    return str(value)
+
+
+class ParquetFileStream(FileStream):
+    """Parquet files of the documents of each part, one row per document.
+
+    Nested documents and arrays are stored as Extended JSON strings, so documents with
+    different nested fields share the same columns. The rows of a file are kept in memory
+    until it is rotated.
+    """
+
+    extension = ".parquet"
+
+    def __init__(self, *args, **kwargs):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError(
+                "Exporting to Parquet requires pyarrow, install the parquet extra"
+            )
+        super().__init__(*args, **kwargs)
+        self.pyarrow = pyarrow
+
+    def open(self) -> None:
+        self.rows = []
+
+    def add(self, document) -> None:
+        if isinstance(document, RawBSONDocument):
+            document = bson.decode(document.raw)
+        self.rows.append({k: parquet_value(v) for k, v in document.items()})
+
+    def close_file(self):
+        table = self.pyarrow.Table.from_pylist(self.rows)
+        self.rows = []
+        sink = self.pyarrow.BufferOutputStream()
+        self.pyarrow.parquet.write_table(table, sink)
+        data = sink.getvalue().to_pybytes()
+        with open(self.path, "wb") as f:
+            f.write(data)
+        return len(data), hashlib.sha256(data).hexdigest()
+
+
+STREAMS = {"bson": BSONFileStream, "parquet": ParquetFileStream}
+
+
+class ExportCollection:
+    """Collection whose bulk writes are appended to files instead of sent to a server.
+
+    Every thread that writes gets its own file stream, so the writer actor threads write to
+    their files in parallel. The aid of each oid of the exported objects is kept in memory, so
+    the sorting hat finds the objects it missed in its cache with ``find`` by ``oid``.
+
+    Parameters
+    ----------
+    database : ExportDatabase
+        Database of the collection
+    name : str
+        Name of the collection
+    """
+
+    def __init__(self, database: "ExportDatabase", name: str):
+        self.database = database
+        self.name = name
+        self.streams: Dict[int, FileStream] = {}
+        self.aids = {}
+        self.lock = threading.Lock()
+
+    def stream(self) -> FileStream:
+        thread = threading.get_ident()
+        stream = self.streams.get(thread)
+        if stream is None:
+            with self.lock:
+                stream = self.database.create_stream(self.name)
+                self.streams[thread] = stream
+        return stream
+
+    def bulk_write(self, operations: list, ordered: bool = True) -> None:
+        documents = [operation_document(operation) for operation in operations]
+        if self.name == "object":
+            with self.lock:
+                for document in documents:
+                    for oid in document.get("oid", []):
+                        self.aids[oid] = document["_id"]
+        self.stream().write(documents)
+
+    def find(self, filter: dict = None, projection=None, **kwargs) -> MemoryCursor:
+        """Supports only the ``$in`` of ``oid`` of the sorting hat lookups"""
+        oids = (filter or {}).get("oid", {}).get("$in", [])
+        with self.lock:
+            found = [(oid, self.aids[oid]) for oid in oids if oid in self.aids]
+        return MemoryCursor([{"_id": aid, "oid": [oid]} for oid, aid in found])
+
+    def close(self) -> List[dict]:
+        files = []
+        for stream in self.streams.values():
+            stream.rotate()
+            files.extend(stream.files)
+        return files
+
+
+class ExportDatabase:
+    """Target database that writes the migrated documents to files for an offline load.
+
+    Parts are written under ``directory`` as ``part-<writer>-<seq>/<database>/<collection>``
+    files, a new part every ``max_documents`` documents of a writer. ``close`` writes a
+    ``manifest.json`` with the documents, size and sha256 of every file and the document
+    count of each collection.
+
+    Parameters
+    ----------
+    directory : str
+        Directory of the export, created if it does not exist
+    database : str
+        Name of the target database the parts are restored to
+    format : str
+        ``bson`` for gzip compressed BSON, ``parquet`` for Parquet files
+    max_documents : int
+        Number of documents of each file
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        database: str,
+        format: str = "bson",
+        max_documents: int = 1000000,
+    ):
+        if not database:
+            raise ValueError("The export needs the name of the target database")
+        if format not in STREAMS:
+            raise ValueError(
+                f"Unknown format {format}, expected one of {EXPORT_FORMATS}"
+            )
+        self.directory = directory
+        self.database = database
+        self.format = format
+        self.max_documents = max_documents
+        self.client = MemoryClient()
+        self.collections: Dict[str, ExportCollection] = {}
+        self.writers = 0
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger("ExportDatabase")
+
+    def __getitem__(self, name: str) -> ExportCollection:
+        with self.lock:
+            if name not in self.collections:
+                self.collections[name] = ExportCollection(self, name)
+            return self.collections[name]
+
+    def create_stream(self, collection: str) -> FileStream:
+        with self.lock:
+            writer = self.writers
+            self.writers += 1
+        return STREAMS[self.format](
+            self.directory, self.database, collection, writer, self.max_documents
+        )
+
+    def close(self) -> dict:
+        """Closes every file and writes the manifest, which is returned"""
+        files = []
+        for collection in self.collections.values():
+            files.extend(collection.close())
+        files.sort(key=lambda f: f["path"])
+        counts = {}
+        for f in files:
+            counts[f["collection"]] = counts.get(f["collection"], 0) + f["documents"]
+        manifest = {
+            "database": self.database,
+            "format": self.format,
+            "collections": counts,
+            "files": files,
+        }
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, "manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=2)
+        self.logger.info(f"Exported {counts} to {self.directory}")
+        return manifest
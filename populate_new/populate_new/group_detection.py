@@ -1,37 +1,181 @@
 import logging
-from typing import List
+import threading
+import time
+from bisect import bisect_right
+from collections import OrderedDict
+from typing import List, Union
 import pykka
+from populate_new.metrics import MetricsRegistry, stage_metrics
+from populate_new.sorting_hat import shard_of
 
 
 class GroupDetectionActor(pykka.ThreadingActor):
     """Actor to group detections before sending them to the sorting hat actor.
     
     This actor groups detections by their object id and sends them to the sorting hat actor
-    when the group size reaches the max size.
+    when the groups hold ``max_size`` detections or when the oldest buffered detection has
+    waited ``flush_interval`` seconds. When there are several sorting hat shards, the groups
+    are split by a hash of the oid, so every oid is always handled by the same shard.
+
+    In complete groups mode the detections are held until every reader has sent its
+    ``{"type": "complete"}`` message, so each oid is sent to the sorting hat once with all its
+    detections. Since the detections of an oid are spread over every ``_id`` range, the whole
+    collection is held in memory before the first group is sent, unless the readers read
+    ``oid`` ranges in ``oid`` order. Then the ``oid`` split points of the ranges are given and
+    each ``{"type": "watermark"}`` message of a reader releases the groups of its range with
+    a lower oid, so only the last oid of each range is held. The held detections are taken out
+    of the in-flight count of the ``limiter`` until they are released, since the readers must
+    keep reading for their watermark to pass them.
+
+    Parameters
+    ----------
+    sorting_hat_actor : Union[pykka.ActorRef, List[pykka.ActorRef]]
+        Actor that receives the groups, or one actor per shard
+    max_size : int
+        Number of detections sent in each message. Groups are never split, so a message can
+        have more detections
+    metrics : MetricsRegistry, optional
+        Registry where the "group" stage is recorded
+    flush_interval : float
+        Maximum number of seconds a detection waits in the groups
+    complete_groups : bool
+        If True, hold the detections until the input of every reader is exhausted
+    partitions : int
+        Number of readers sending a complete message, used in complete groups mode
+    split_points : List[str], optional
+        Split points of the ``oid`` ranges read in ``oid`` order, used in complete groups mode
+    limiter : InflightLimiter, optional
+        Limiter of the readers, whose credits the held detections do not use
     """
-    def __init__(self, sorting_hat_actor: pykka.ActorRef, max_size: int):
+    def __init__(
+        self,
+        sorting_hat_actor: Union[pykka.ActorRef, List[pykka.ActorRef]],
+        max_size: int,
+        metrics: MetricsRegistry = None,
+        flush_interval: float = 5,
+        complete_groups: bool = False,
+        partitions: int = 1,
+        split_points: List[str] = None,
+        limiter=None,
+    ):
         super().__init__()
-        self.sorting_hat_actor = sorting_hat_actor
+        if isinstance(sorting_hat_actor, list):
+            self.sorting_hat_actors = sorting_hat_actor
+        else:
+            self.sorting_hat_actors = [sorting_hat_actor]
         self.logger = logging.getLogger("GroupDetectionActor")
         self.groups = {}
         self.size = 0
         self.max_size = max_size
+        self.metrics = stage_metrics(metrics, "group")
+        self.flush_interval = flush_interval
+        self.first_buffered = None
+        self.complete_groups = complete_groups
+        self.split_points = split_points
+        self.limiter = limiter
+        if split_points is not None:
+            partitions = len(split_points) + 1
+        self.pending_partitions = set(range(partitions))
+        # held groups of each oid range in arrival order, a single one without split points
+        self.held = [OrderedDict() for _ in range(partitions)]
+        self.stopped = threading.Event()
+
+    def on_start(self) -> None:
+        threading.Thread(target=self.tick, daemon=True).start()
 
-    def on_receive(self, message: List[dict]) -> None:
+    def tick(self):
+        while not self.stopped.wait(self.flush_interval):
+            self.actor_ref.tell({"type": "flush"})
+
+    def on_receive(self, message: Union[List[dict], dict]) -> None:
+        if isinstance(message, dict):
+            self.on_control(message)
+            return
         self.logger.debug(f"Grouping {len(message)} detections")
-        self.size += len(message)
-        for detection in message:
-            if detection["oid"] in self.groups:
-                self.groups[detection["oid"]].append(detection)
-            else:
-                self.groups[detection["oid"]] = [detection]
-            if self.size == self.max_size:
-                self.sorting_hat_actor.tell(self.groups)
-                self.groups = {}
-                self.size = 0
+        t0 = time.time()
+        if self.complete_groups:
+            for detection in message:
+                held = self.held[self.partition_of(detection["oid"])]
+                held.setdefault(detection["oid"], []).append(detection)
+            if self.limiter is not None:
+                self.limiter.hold(len(message))
+        else:
+            for detection in message:
+                self.add(detection["oid"], [detection])
+        self.metrics.record(len(message), time.time() - t0)
+
+    def on_control(self, message: dict) -> None:
+        if message["type"] == "flush":
+            if (
+                self.first_buffered is not None
+                and time.time() - self.first_buffered >= self.flush_interval
+            ):
+                self.send_groups()
+        elif message["type"] == "watermark":
+            if self.complete_groups and self.split_points is not None:
+                self.release(message["partition"], message["oid"])
+        elif message["type"] == "complete":
+            self.pending_partitions.discard(message["partition"])
+            if not self.complete_groups:
+                return
+            if self.split_points is not None:
+                self.release(message["partition"])
+            elif not self.pending_partitions:
+                self.release(0)
+            if not self.pending_partitions:
+                self.send_groups()
+        else:
+            raise ValueError(f"Unknown message {message}")
+
+    def partition_of(self, oid: str) -> int:
+        if self.split_points is None:
+            return 0
+        return bisect_right(self.split_points, oid)
+
+    def add(self, oid: str, detections: List[dict]) -> None:
+        if self.first_buffered is None:
+            self.first_buffered = time.time()
+        if oid in self.groups:
+            self.groups[oid].extend(detections)
+        else:
+            self.groups[oid] = detections
+        self.size += len(detections)
+        if self.size >= self.max_size:
+            self.send_groups()
+
+    def release(self, partition: int, below: str = None) -> None:
+        """Groups the held detections of a range, only of the oids lower than ``below`` if
+        given"""
+        held = self.held[partition]
+        while held:
+            oid = next(iter(held))
+            if below is not None and oid >= below:
+                break
+            detections = held.pop(oid)
+            if self.limiter is not None:
+                self.limiter.unhold(len(detections))
+            self.add(oid, detections)
 
     def on_stop(self) -> None:
+        self.stopped.set()
         self.logger.debug("Grouping last detection")
-        self.sorting_hat_actor.tell(self.groups)
+        for partition in range(len(self.held)):
+            self.release(partition)
+        self.send_groups()
+
+    def send_groups(self) -> None:
+        self.first_buffered = None
+        if not self.groups:
+            return
+        shards = len(self.sorting_hat_actors)
+        if shards == 1:
+            self.sorting_hat_actors[0].tell(self.groups)
+        else:
+            messages = [{} for _ in range(shards)]
+            for oid, detections in self.groups.items():
+                messages[shard_of(oid, shards)][oid] = detections
+            for actor, message in zip(self.sorting_hat_actors, messages):
+                if message:
+                    actor.tell(message)
         self.groups = {}
         self.size = 0
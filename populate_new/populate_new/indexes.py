@@ -0,0 +1,164 @@
+import logging
+import threading
+import time
+from typing import Dict, Iterable, List, Tuple
+from pymongo import ASCENDING, GEOSPHERE, IndexModel
+from pymongo.database import Database
+from pymongo.errors import OperationFailure
+
+# import models so that their indexes are registered in the metadata
+from db_plugins.db.mongo.models import Object, Detection, NonDetection, ForcedPhotometry
+from db_plugins.db.mongo.orm import ModelMetaClass
+
+# objects are looked up by any of their oids, which the db_plugins models do not index
+OID_INDEX = IndexModel([("oid", ASCENDING)], name="oid")
+
+
+def model_indexes() -> Dict[str, List[IndexModel]]:
+    """Returns the indexes of the db_plugins models by collection, with the oid index"""
+    indexes = {
+        name: list(collection["indexes"])
+        for name, collection in ModelMetaClass.metadata.collections.items()
+    }
+    indexes["object"] = indexes.get("object", []) + [OID_INDEX]
+    return indexes
+
+
+INDEXED_COLLECTIONS = list(model_indexes())
+
+
+def needed_during_load(index: IndexModel) -> bool:
+    """Whether an index has to exist while the collection is loaded.
+
+    Unique indexes reject the duplicates a resumed or retried write would insert, and the
+    oid and geospatial indexes answer the lookups and cone searches of the sorting hat. The
+    ``_id`` index always exists.
+    """
+    document = index.document
+    return (
+        document.get("unique", False)
+        or GEOSPHERE in document["key"].values()
+        or document["name"] == OID_INDEX.document["name"]
+    )
+
+
+def split_indexes(
+    indexes: Dict[str, List[IndexModel]], deferred: Iterable[str]
+) -> Tuple[Dict[str, List[IndexModel]], Dict[str, List[IndexModel]]]:
+    """Splits the indexes in the ones created before and after the load.
+
+    Every index of a collection that is not ``deferred`` is created before the load. The
+    deferred collections get only the indexes needed during the load before it.
+    """
+    deferred = set(deferred)
+    before, after = {}, {}
+    for name, models in indexes.items():
+        if name in deferred:
+            before[name] = [index for index in models if needed_during_load(index)]
+            after[name] = [index for index in models if not needed_during_load(index)]
+        else:
+            before[name] = models
+    return before, after
+
+
+def create_collection_indexes(
+    db: Database, indexes: Dict[str, List[IndexModel]]
+) -> None:
+    for name, models in indexes.items():
+        if models:
+            db[name].create_indexes(models)
+
+
+class IndexBuildMonitor(threading.Thread):
+    """Thread that periodically logs the progress of the index builds of a collection.
+
+    The progress is read from the ``createIndexes`` operations reported by ``$currentOp``.
+
+    Parameters
+    ----------
+    db : Database
+        Database where the indexes are built
+    collection : str
+        Name of the collection
+    interval : float
+        Seconds between logs
+    """
+
+    def __init__(self, db: Database, collection: str, interval: float = 10):
+        super().__init__(daemon=True)
+        self.db = db
+        self.collection = collection
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.logger = logging.getLogger("IndexBuildMonitor")
+
+    def operations(self) -> List[dict]:
+        return list(
+            self.db.client.admin.aggregate(
+                [
+                    {"$currentOp": {"allUsers": True}},
+                    {
+                        "$match": {
+                            "ns": f"{self.db.name}.{self.collection}",
+                            "command.createIndexes": self.collection,
+                        }
+                    },
+                ]
+            )
+        )
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                operations = self.operations()
+            except OperationFailure as e:
+                self.logger.warning(f"Cannot read the index build progress: {e}")
+                return
+            for operation in operations:
+                progress = operation.get("progress", {})
+                message = operation.get("msg", "building")
+                if progress.get("total"):
+                    percent = 100 * progress["done"] / progress["total"]
+                    message += (
+                        f" {progress['done']}/{progress['total']} ({percent:.1f}%)"
+                    )
+                self.logger.info(f"Indexes of {self.collection}: {message}")
+
+    def stop(self):
+        self.stopped.set()
+
+
+def build_deferred_indexes(
+    db: Database,
+    deferred: Iterable[str],
+    interval: float = 10,
+) -> Dict[str, float]:
+    """Builds the indexes of the ``deferred`` collections left out before the load.
+
+    All the indexes of a collection are built by a single ``createIndexes`` command, so the
+    server scans the collection once for all of them. The progress of each build is logged
+    every ``interval`` seconds.
+
+    Returns
+    -------
+    Dict[str, float]
+        Seconds spent on the indexes of each collection
+    """
+    logger = logging.getLogger("build_deferred_indexes")
+    _, after = split_indexes(model_indexes(), deferred)
+    seconds = {}
+    for name, models in after.items():
+        if not models:
+            continue
+        names = ", ".join(index.document["name"] for index in models)
+        logger.info(f"Building indexes {names} of {name}")
+        monitor = IndexBuildMonitor(db, name, interval)
+        monitor.start()
+        t0 = time.time()
+        try:
+            db[name].create_indexes(models)
+        finally:
+            monitor.stop()
+        seconds[name] = time.time() - t0
+        logger.info(f"Built indexes of {name} in {seconds[name]:.1f} s")
+    return seconds
@@ -0,0 +1,199 @@
+import random
+import threading
+from contextlib import nullcontext
+from typing import Any, Dict, Iterable, List, Tuple
+import bson
+from bson.raw_bson import RawBSONDocument
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+# Unique indexes of the target collections, as created by db_plugins
+UNIQUE_KEYS = {"detection": ("oid", "candid")}
+
+
+class MemoryCursor:
+    """Iterator over the documents returned by :meth:`MemoryCollection.find`"""
+
+    def __init__(self, documents: List[RawBSONDocument]):
+        self.documents = documents
+
+    def hint(self, index) -> "MemoryCursor":
+        return self
+
+    def close(self) -> None:
+        pass
+
+    def __iter__(self):
+        return iter(self.documents)
+
+
+class MemoryCollection:
+    """In-process stand-in for the parts of a pymongo collection used by the migration.
+
+    Documents are stored encoded and returned as :class:`RawBSONDocument`, like the clients
+    created by ``create_mongo_connections``. It supports unordered bulk writes of
+    ``InsertOne`` and ``UpdateOne`` operations with a unique key, which fail with the same
+    duplicate key errors as the server, and finds by range or ``$in`` of a single field, which
+    like the server matches an array field when any of its elements is in the ``$in``.
+
+    Parameters
+    ----------
+    database : MemoryDatabase
+        Database of the collection
+    name : str
+        Name of the collection
+    unique_key : Tuple[str, ...]
+        Fields of the unique index
+    """
+
+    def __init__(
+        self, database: "MemoryDatabase", name: str, unique_key: Tuple[str, ...]
+    ):
+        self.database = database
+        self.name = name
+        self.unique_key = unique_key
+        self.documents: Dict[Any, RawBSONDocument] = {}
+        self.lock = threading.Lock()
+
+    def key(self, document) -> Any:
+        return tuple(document.get(field) for field in self.unique_key)
+
+    def insert_many(self, documents: Iterable[dict]) -> None:
+        with self.lock:
+            for document in documents:
+                self.insert(document)
+
+    def insert(self, document) -> None:
+        if not isinstance(document, RawBSONDocument):
+            if "_id" not in document:
+                document = {"_id": bson.ObjectId(), **document}
+            document = RawBSONDocument(bson.encode(document))
+        key = self.key(document)
+        if key in self.documents:
+            raise KeyError(key)
+        self.documents[key] = document
+
+    def bulk_write(self, operations: list, ordered: bool = True) -> None:
+        errors, inserted, upserted = [], 0, 0
+        with self.lock:
+            for index, operation in enumerate(operations):
+                try:
+                    if isinstance(operation, InsertOne):
+                        self.insert(operation._doc)
+                        inserted += 1
+                    elif isinstance(operation, UpdateOne):
+                        upserted += self.update(operation)
+                    else:
+                        raise TypeError(f"Unsupported operation {operation}")
+                except KeyError:
+                    errors.append({"index": index, "code": 11000, "op": operation})
+                    if ordered:
+                        break
+        if errors:
+            raise BulkWriteError(
+                {
+                    "writeErrors": errors,
+                    "nInserted": inserted,
+                    "nUpserted": upserted,
+                }
+            )
+
+    def update(self, operation: UpdateOne) -> int:
+        """Applies an update and returns 1 if it upserted.
+
+        Supports ``$set``, ``$setOnInsert`` and ``$addToSet`` with ``$each``.
+        """
+        key = self.key(operation._filter)
+        current = self.documents.get(key)
+        if current is None and not operation._upsert:
+            return 0
+        document = (
+            dict(operation._filter) if current is None else bson.decode(current.raw)
+        )
+        document.update(operation._doc.get("$set", {}))
+        if current is None:
+            document.update(operation._doc.get("$setOnInsert", {}))
+        for field, values in operation._doc.get("$addToSet", {}).items():
+            elements = document.setdefault(field, [])
+            elements.extend(v for v in values["$each"] if v not in elements)
+        self.documents[key] = RawBSONDocument(bson.encode(document))
+        return 1 if current is None else 0
+
+    def find(self, filter: dict = None, projection=None, sort=None, **kwargs):
+        field, condition = next(iter((filter or {"_id": {}}).items()))
+        if "$in" in condition and field == "_id" and self.unique_key == ("_id",):
+            with self.lock:
+                found = [self.documents.get((value,)) for value in condition["$in"]]
+            return MemoryCursor([d for d in found if d is not None])
+        with self.lock:
+            documents = list(self.documents.values())
+        if "$in" in condition:
+            values = set(condition["$in"])
+            documents = [d for d in documents if is_in(d.get(field), values)]
+        else:
+            documents = [d for d in documents if in_range(d.get(field), condition)]
+        if sort is not None:
+            documents.sort(key=lambda d: d[sort[0][0]])
+        return MemoryCursor(documents)
+
+    def aggregate(self, pipeline: list) -> List[dict]:
+        """Supports only the ``$sample`` of one field used to split the collection"""
+        size = pipeline[0]["$sample"]["size"]
+        field = next(iter(pipeline[1]["$project"]))
+        with self.lock:
+            values = [{field: d[field]} for d in self.documents.values()]
+        return random.sample(values, min(size, len(values)))
+
+    def count_documents(self, filter: dict) -> int:
+        return len(self.documents)
+
+
+def is_in(value: Any, values: set) -> bool:
+    if isinstance(value, list):
+        return any(element in values for element in value)
+    return value in values
+
+
+def in_range(value: Any, condition: dict) -> bool:
+    if "$gte" in condition and value < condition["$gte"]:
+        return False
+    if "$gt" in condition and value <= condition["$gt"]:
+        return False
+    if "$lt" in condition and value >= condition["$lt"]:
+        return False
+    return True
+
+
+class MemoryClient:
+    def start_session(self):
+        return nullcontext()
+
+
+class MemoryDatabase:
+    """In-process stand-in for a pymongo database, used by the benchmarks
+
+    Parameters
+    ----------
+    unique_keys : Dict[str, Tuple[str, ...]], optional
+        Unique key of each collection, ``_id`` for the ones not given. Target databases use
+        ``UNIQUE_KEYS``, source databases only have the ``_id`` index
+
+    Examples
+    --------
+    >>> db = MemoryDatabase()
+    >>> db["object"].insert_many([{"_id": "aid1"}])
+    >>> [document["_id"] for document in db["object"].find({"_id": {"$in": ["aid1"]}})]
+    ['aid1']
+    """
+
+    def __init__(self, unique_keys: Dict[str, Tuple[str, ...]] = None):
+        self.client = MemoryClient()
+        self.collections: Dict[str, MemoryCollection] = {}
+        self.unique_keys = unique_keys or {}
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        if name not in self.collections:
+            self.collections[name] = MemoryCollection(
+                self, name, self.unique_keys.get(name, ("_id",))
+            )
+        return self.collections[name]
@@ -0,0 +1,259 @@
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Iterable
+import pykka
+from populate_new.backpressure import inbox_depth
+
+# Upper bounds in seconds of the batch latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30)
+
+
+class Histogram:
+    """Cumulative histogram with fixed buckets, as exported by Prometheus.
+
+    Parameters
+    ----------
+    buckets : Iterable[float]
+        Sorted upper bounds of the buckets. Values above the last bound only count in the
+        implicit ``+Inf`` bucket
+    """
+
+    def __init__(self, buckets: Iterable[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> Dict[str, int]:
+        """Returns the number of observations less than or equal to each bound"""
+        result, total = {}, 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            result["+Inf" if bound == float("inf") else str(bound)] = total
+        return result
+
+
+class StageMetrics:
+    """Counters of a single stage of the pipeline.
+
+    The methods can be called from several threads, as the writer records its bulk writes
+    from its pool of write threads.
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.documents = 0
+        self.batches = 0
+        self.errors = 0
+        self.latency = Histogram()
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    def record(self, documents: int, seconds: float) -> None:
+        """Records a batch of ``documents`` processed in ``seconds``"""
+        with self.lock:
+            self.documents += documents
+            self.batches += 1
+            self.latency.observe(seconds)
+
+    def error(self, count: int = 1) -> None:
+        with self.lock:
+            self.errors += count
+
+    def rate(self) -> float:
+        """Documents processed per second since the stage was created"""
+        elapsed = time.time() - self.started
+        return self.documents / elapsed if elapsed > 0 else 0.0
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            average = self.latency.sum / self.batches if self.batches else 0.0
+            return {
+                "documents": self.documents,
+                "batches": self.batches,
+                "errors": self.errors,
+                "documents_per_second": self.rate(),
+                "average_latency": average,
+                "latency_buckets": self.latency.cumulative(),
+                "latency_sum": self.latency.sum,
+            }
+
+
+class MetricsRegistry:
+    """Metrics of every stage of a pipeline, created on first use.
+
+    Examples
+    --------
+    >>> metrics = MetricsRegistry()
+    >>> metrics.stage("write").record(1000, 0.2)
+    >>> metrics.snapshot()["stages"]["write"]["documents"]
+    1000
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, StageMetrics] = {}
+        self.inbox_depths: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def stage(self, name: str) -> StageMetrics:
+        with self.lock:
+            if name not in self.stages:
+                self.stages[name] = StageMetrics(name)
+            return self.stages[name]
+
+    def set_inbox_depths(self, depths: Dict[str, int]) -> None:
+        with self.lock:
+            self.inbox_depths = dict(depths)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            stages = dict(self.stages)
+            depths = dict(self.inbox_depths)
+        return {
+            "time": time.time(),
+            "stages": {name: stage.snapshot() for name, stage in stages.items()},
+            "inbox_depth": depths,
+        }
+
+    def to_prometheus(self, prefix: str = "migration") -> str:
+        """Renders the metrics in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        stages = snapshot["stages"]
+        lines = [
+            f"# TYPE {prefix}_documents_total counter",
+            *(
+                f'{prefix}_documents_total{{stage="{name}"}} {s["documents"]}'
+                for name, s in stages.items()
+            ),
+            f"# TYPE {prefix}_errors_total counter",
+            *(
+                f'{prefix}_errors_total{{stage="{name}"}} {s["errors"]}'
+                for name, s in stages.items()
+            ),
+            f"# TYPE {prefix}_batch_latency_seconds histogram",
+        ]
+        for name, s in stages.items():
+            for bound, count in s["latency_buckets"].items():
+                lines.append(
+                    f'{prefix}_batch_latency_seconds_bucket{{stage="{name}",le="{bound}"}} '
+                    f"{count}"
+                )
+            lines.append(
+                f'{prefix}_batch_latency_seconds_sum{{stage="{name}"}} {s["latency_sum"]}'
+            )
+            lines.append(
+                f'{prefix}_batch_latency_seconds_count{{stage="{name}"}} {s["batches"]}'
+            )
+        lines.append(f"# TYPE {prefix}_inbox_depth gauge")
+        lines.extend(
+            f'{prefix}_inbox_depth{{actor="{name}"}} {depth}'
+            for name, depth in snapshot["inbox_depth"].items()
+        )
+        return "\n".join(lines) + "\n"
+
+    def log_summary(self, logger: logging.Logger) -> None:
+        for name, s in self.snapshot()["stages"].items():
+            logger.info(
+                f"Stage {name}: {s['documents']} documents in {s['batches']} batches, "
+                f"{s['documents_per_second']:.1f} documents/s, "
+                f"average batch latency {s['average_latency']:.4f} s, {s['errors']} errors"
+            )
+
+
+class MetricsExporter(threading.Thread):
+    """Thread that periodically samples the inbox depths and exports the metrics.
+
+    Each export appends a snapshot to a JSON lines file and replaces a Prometheus text file,
+    which can be read by the node exporter textfile collector. A last export is made on
+    ``stop``.
+
+    Parameters
+    ----------
+    metrics : MetricsRegistry
+        Metrics to export
+    actors : Dict[str, pykka.ActorRef]
+        Actors whose inbox depth is sampled, by name
+    jsonl_path : str, optional
+        File where the snapshots are appended
+    prometheus_path : str, optional
+        File replaced with the latest metrics
+    interval : float
+        Seconds between exports
+    """
+
+    def __init__(
+        self,
+        metrics: MetricsRegistry,
+        actors: Dict[str, pykka.ActorRef],
+        jsonl_path: str = None,
+        prometheus_path: str = None,
+        interval: float = 10,
+    ):
+        super().__init__(daemon=True)
+        self.metrics = metrics
+        self.actors = actors
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.logger = logging.getLogger("MetricsExporter")
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.export()
+
+    def export(self) -> None:
+        self.metrics.set_inbox_depths(
+            {
+                name: inbox_depth(actor_ref)
+                for name, actor_ref in self.actors.items()
+                if actor_ref.is_alive()
+            }
+        )
+        try:
+            if self.jsonl_path is not None:
+                with open(self.jsonl_path, "a") as f:
+                    f.write(json.dumps(self.metrics.snapshot()) + "\n")
+            if self.prometheus_path is not None:
+                tmp = self.prometheus_path + ".tmp"
+                with open(tmp, "w") as f:
+                    f.write(self.metrics.to_prometheus())
+                os.replace(tmp, self.prometheus_path)
+        except OSError as e:
+            self.logger.error(f"Could not export metrics: {e}")
+
+    def stop(self):
+        self.stopped.set()
+        self.export()
+        self.metrics.log_summary(self.logger)
+
+
+def create_exporter(
+    metrics: MetricsRegistry, actors: Dict[str, pykka.ActorRef], prefix: str = None
+) -> MetricsExporter:
+    """Creates the exporter of a pipeline, writing ``<prefix>.metrics.jsonl`` and
+    ``<prefix>.prom`` when a prefix is given"""
+    if prefix is None:
+        return MetricsExporter(metrics, actors)
+    return MetricsExporter(metrics, actors, f"{prefix}.metrics.jsonl", f"{prefix}.prom")
+
+
+def stage_metrics(metrics: MetricsRegistry, name: str) -> StageMetrics:
+    """Returns the metrics of a stage, recorded in a private registry when none is given"""
+    if metrics is None:
+        metrics = MetricsRegistry()
+    return metrics.stage(name)
@@ -1,62 +1,208 @@
 import pykka
 import pykka.debug
-from group_detection import GroupDetectionActor
-from mongo_detection import MongoDetectionWriterActor
-from mongo_writer import MongoWriterActor
-from mongo_object import MongoObjectWriterActor
-from sorting_hat import SortingHatActor
-from transform_detection import TransformDetectionActor
-from dbconn import create_mongo_connections
-import bson
+from typing import Tuple
+from populate_new.group_detection import GroupDetectionActor
+from populate_new.mongo_detection import MongoDetectionWriterActor
+from populate_new.mongo_writer import MongoWriterActor
+from populate_new.mongo_object import MongoObjectWriterActor
+from populate_new.pipeline import run_pipeline
+from populate_new.sorting_hat import SortingHatActor
+from populate_new.spatial_index import ConeSearchIndex
+from populate_new.transform_detection import TransformDetectionActor
 import logging
 import signal
 
-
 logging.basicConfig(level=logging.INFO)
 signal.signal(signal.SIGUSR1, pykka.debug.log_thread_tracebacks)
 
 
-def get_detections_cursor(session, db, batch_size):
-    cursor = db["detection"].find(
-        batch_size=batch_size,
-        session=session,
-        no_cursor_timeout=True,
+def start_actors(
+    target_db,
+    write_batch_size,
+    dry_run,
+    use_spatial_index,
+    checkpoint,
+    limiter,
+    num_transformers,
+    write_concurrency,
+    cache=None,
+    spatial_index=None,
+    metrics=None,
+    sorting_hat_shards=1,
+    group_flush_interval=5,
+    complete_groups=False,
+    partitions=1,
+    oid_split_points=None,
+    autotuner=None,
+):
+    if sorting_hat_shards > 1 and not use_spatial_index:
+        # the shards only see the objects created by the others through the spatial index,
+        # the new objects are not in the target database until they are flushed
+        raise ValueError("Several sorting hat shards require the spatial index")
+    writer_actor = MongoWriterActor.start(
+        target_db,
+        write_batch_size,
+        dry_run,
+        checkpoint,
+        limiter,
+        max_concurrent_writes=write_concurrency,
+        metrics=metrics,
+        autotuner=autotuner,
+    )
+    detection_operation_actor = MongoDetectionWriterActor.start(
+        writer_actor, write_batch_size, autotuner
+    )
+    object_operation_actor = MongoObjectWriterActor.start(
+        target_db, write_batch_size, dry_run
+    )
+    if not use_spatial_index:
+        spatial_index = None
+    elif spatial_index is None:
+        spatial_index = ConeSearchIndex.from_collection(target_db["object"])
+    if sorting_hat_shards == 1:
+        caches = [cache]
+    elif cache is None:
+        caches = [None] * sorting_hat_shards
+    else:
+        caches = cache.split(sorting_hat_shards)
+    sorting_hat_actors = [
+        SortingHatActor.start(
+            detection_operation_actor,
+            object_operation_actor,
+            target_db,
+            spatial_index,
+            cache=shard_cache,
+            metrics=metrics,
+            shard=None if sorting_hat_shards == 1 else shard,
+        )
+        for shard, shard_cache in enumerate(caches)
+    ]
+    grouper_actor = GroupDetectionActor.start(
+        sorting_hat_actors,
+        write_batch_size,
+        metrics,
+        flush_interval=group_flush_interval,
+        complete_groups=complete_groups,
+        partitions=partitions,
+        split_points=oid_split_points,
+        limiter=limiter,
+    )
+    transform_actor = TransformDetectionActor.start(
+        grouper_actor,
+        num_transformers=num_transformers,
+        metrics=metrics,
+        autotuner=autotuner,
+        limiter=limiter,
     )
-    return cursor
+    return {
+        "transform": transform_actor,
+        "group": grouper_actor,
+        **(
+            {"sort": sorting_hat_actors[0]}
+            if sorting_hat_shards == 1
+            else {f"sort_{i}": actor for i, actor in enumerate(sorting_hat_actors)}
+        ),
+        "detection_operations": detection_operation_actor,
+        "object_operations": object_operation_actor,
+        "write": writer_actor,
+    }
 
 
-def get_batch_from_db(cursor):
-    batch = []
-    for document in cursor:
-        decoded_document = bson.decode(document.raw)
-        batch.append(decoded_document)
-        if len(batch) == 2000:
-            yield batch
-            batch = []
-    if len(batch) > 0:
-        yield batch
+def migrate_detection(
+    read_batch_size: int,
+    write_batch_size: int,
+    dry_run=True,
+    use_spatial_index=True,
+    partitions: int = 1,
+    checkpoint_file: str = "migrate_detection.checkpoint.json",
+    resume: bool = False,
+    max_inflight: int = 100000,
+    num_transformers: int = 5,
+    write_concurrency: int = 4,
+    cache=None,
+    spatial_index=None,
+    metrics_prefix: str = None,
+    sorting_hat_shards: int = 1,
+    group_flush_interval: float = 5,
+    complete_groups: bool = False,
+    oid_order: bool = False,
+    sink: str = "mongo",
+    export=None,
+    autotune: bool = False,
+    autotune_bounds: dict = None,
+    deferred_indexes: Tuple[str, ...] = (),
+):
+    """Migrates the detection collection.
 
+    The oid to aid cache and the spatial index returned by ``migrate_object`` can be given to
+    start the sorting hat with the migrated objects already in memory. With more than one
+    sorting hat shard, the oids are split between shards by hash and each shard gets the part
+    of the cache with its oids. The shards find the new objects of the others in the shared
+    spatial index, so they can't be used without ``use_spatial_index``.
 
-def start_actors(target_db, write_batch_size, dry_run):
-    writer_actor = MongoWriterActor.start(target_db, write_batch_size, dry_run)
-    detection_operation_actor = MongoDetectionWriterActor.start(
-        writer_actor, write_batch_size
-    )
-    object_operation_actor = MongoObjectWriterActor.start()
-    sorting_hat_actor = SortingHatActor.start(
-        detection_operation_actor, object_operation_actor, target_db
-    )
-    grouper_actor = GroupDetectionActor.start(sorting_hat_actor, write_batch_size)
-    transform_actor = TransformDetectionActor.start(grouper_actor, num_transformers=5)
-    return transform_actor
+    With ``oid_order`` the collection is split in ``oid`` ranges that are read in ``oid``
+    order over the ``oid`` index of the source. The grouper then sends each oid once, as soon
+    as its range has been read past it, so the sorting hat does one lookup per distinct oid
+    while only the last oid of each range is held. ``complete_groups`` implies ``oid_order``,
+    since holding the complete groups of ``_id`` ranges would hold the whole collection.
 
+    With the memory sink every object is new unless the objects were migrated to the memory
+    sink first. The export sink writes the new objects along with the detections. The sinks,
+    checkpoints, autotuning and deferred indexes are described in
+    ``populate_new.pipeline.run_pipeline``.
+    """
+    oid_order = oid_order or complete_groups
 
-def migrate_detection(read_batch_size: int, write_batch_size: int, dry_run=True):
-    source_db, target_db = create_mongo_connections()
-    with source_db.client.start_session() as session:
-        detections_cursor = get_detections_cursor(session, source_db, read_batch_size)
-        transform_actor = start_actors(target_db, write_batch_size, dry_run)
-        for batch in get_batch_from_db(detections_cursor):
-            transform_actor.tell(batch)
+    def start_transform(next_actor, metrics, autotuner, limiter):
+        return TransformDetectionActor.start(
+            next_actor,
+            num_transformers=num_transformers,
+            metrics=metrics,
+            autotuner=autotuner,
+            limiter=limiter,
+        )
 
-    pykka.ActorRegistry.stop_all()
+    def start_pipeline(
+        target_db, checkpoint, limiter, metrics, autotuner, split_points
+    ):
+        return start_actors(
+            target_db,
+            write_batch_size,
+            dry_run,
+            # only the target database has a geospatial index to search
+            use_spatial_index or sink != "mongo",
+            checkpoint,
+            limiter,
+            num_transformers,
+            write_concurrency,
+            cache,
+            spatial_index,
+            metrics,
+            sorting_hat_shards,
+            group_flush_interval,
+            oid_order,
+            len(split_points) + 1,
+            split_points if oid_order else None,
+            autotuner,
+        )
+
+    run_pipeline(
+        "detection",
+        start_transform,
+        start_pipeline,
+        read_batch_size,
+        write_batch_size,
+        dry_run,
+        partitions,
+        checkpoint_file,
+        resume,
+        max_inflight,
+        metrics_prefix,
+        sink,
+        export,
+        autotune,
+        autotune_bounds,
+        deferred_indexes,
+        key="oid" if oid_order else "_id",
+        send_complete=oid_order,
+    )
@@ -0,0 +1,112 @@
+from typing import Tuple
+from populate_new.mongo_non_detection import MongoNonDetectionWriterActor
+from populate_new.mongo_writer import MongoWriterActor
+from populate_new.pipeline import run_pipeline
+from populate_new.transform_non_detection import TransformNonDetectionActor
+import logging
+
+logging.basicConfig(level=logging.INFO)
+
+
+def start_actors(
+    target_db,
+    write_batch_size,
+    dry_run,
+    checkpoint,
+    limiter,
+    num_transformers,
+    write_concurrency,
+    metrics,
+    autotuner=None,
+):
+    writer_actor = MongoWriterActor.start(
+        target_db,
+        write_batch_size,
+        dry_run,
+        checkpoint,
+        limiter,
+        max_concurrent_writes=write_concurrency,
+        collection="non_detection",
+        metrics=metrics,
+        autotuner=autotuner,
+    )
+    operation_actor = MongoNonDetectionWriterActor.start(
+        writer_actor, write_batch_size, autotuner
+    )
+    transform_actor = TransformNonDetectionActor.start(
+        operation_actor,
+        num_transformers=num_transformers,
+        metrics=metrics,
+        autotuner=autotuner,
+        limiter=limiter,
+    )
+    return {
+        "transform": transform_actor,
+        "non_detection_operations": operation_actor,
+        "write": writer_actor,
+    }
+
+
+def migrate_non_detection(
+    read_batch_size: int,
+    write_batch_size: int,
+    dry_run=True,
+    partitions: int = 1,
+    checkpoint_file: str = "migrate_non_detection.checkpoint.json",
+    resume: bool = False,
+    max_inflight: int = 100000,
+    num_transformers: int = 5,
+    write_concurrency: int = 4,
+    metrics_prefix: str = None,
+    sink: str = "mongo",
+    export=None,
+    autotune: bool = False,
+    autotune_bounds: dict = None,
+    deferred_indexes: Tuple[str, ...] = (),
+):
+    """Migrates the non detection collection.
+
+    The sinks, checkpoints, autotuning and deferred indexes are described in
+    ``populate_new.pipeline.run_pipeline``.
+    """
+
+    def start_transform(next_actor, metrics, autotuner, limiter):
+        return TransformNonDetectionActor.start(
+            next_actor,
+            num_transformers=num_transformers,
+            metrics=metrics,
+            autotuner=autotuner,
+            limiter=limiter,
+        )
+
+    def start_pipeline(target_db, checkpoint, limiter, metrics, autotuner, _):
+        return start_actors(
+            target_db,
+            write_batch_size,
+            dry_run,
+            checkpoint,
+            limiter,
+            num_transformers,
+            write_concurrency,
+            metrics,
+            autotuner,
+        )
+
+    run_pipeline(
+        "non_detection",
+        start_transform,
+        start_pipeline,
+        read_batch_size,
+        write_batch_size,
+        dry_run,
+        partitions,
+        checkpoint_file,
+        resume,
+        max_inflight,
+        metrics_prefix,
+        sink,
+        export,
+        autotune,
+        autotune_bounds,
+        deferred_indexes,
+    )
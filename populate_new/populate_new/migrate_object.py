@@ -0,0 +1,134 @@
+from typing import Tuple
+from populate_new.mongo_object import MongoObjectMigrationActor
+from populate_new.mongo_writer import MongoWriterActor
+from populate_new.pipeline import run_pipeline
+from populate_new.sorting_hat import OidCache
+from populate_new.spatial_index import ConeSearchIndex
+from populate_new.transform_object import TransformObjectActor
+import logging
+
+logging.basicConfig(level=logging.INFO)
+
+
+def start_actors(
+    target_db,
+    write_batch_size,
+    dry_run,
+    checkpoint,
+    limiter,
+    num_transformers,
+    write_concurrency,
+    cache,
+    spatial_index,
+    metrics,
+    autotuner=None,
+):
+    writer_actor = MongoWriterActor.start(
+        target_db,
+        write_batch_size,
+        dry_run,
+        checkpoint,
+        limiter,
+        max_concurrent_writes=write_concurrency,
+        collection="object",
+        metrics=metrics,
+        autotuner=autotuner,
+    )
+    operation_actor = MongoObjectMigrationActor.start(
+        writer_actor, write_batch_size, cache, spatial_index, autotuner
+    )
+    transform_actor = TransformObjectActor.start(
+        operation_actor,
+        num_transformers=num_transformers,
+        metrics=metrics,
+        autotuner=autotuner,
+        limiter=limiter,
+    )
+    return {
+        "transform": transform_actor,
+        "object_operations": operation_actor,
+        "write": writer_actor,
+    }
+
+
+def migrate_object(
+    read_batch_size: int,
+    write_batch_size: int,
+    dry_run=True,
+    partitions: int = 1,
+    checkpoint_file: str = "migrate_object.checkpoint.json",
+    resume: bool = False,
+    max_inflight: int = 100000,
+    num_transformers: int = 5,
+    write_concurrency: int = 4,
+    cache_size: int = 100000,
+    metrics_prefix: str = None,
+    sink: str = "mongo",
+    export=None,
+    autotune: bool = False,
+    autotune_bounds: dict = None,
+    deferred_indexes: Tuple[str, ...] = (),
+) -> Tuple[OidCache, ConeSearchIndex]:
+    """Migrates the object collection.
+
+    Every oid of the migrated objects is kept in the returned cache, which then has room for
+    ``cache_size`` more oids found or created by the detection migration. With the transform
+    and read sinks the cache and index are left empty.
+
+    The sinks, checkpoints, autotuning and deferred indexes are described in
+    ``populate_new.pipeline.run_pipeline``.
+
+    Returns
+    -------
+    Tuple[OidCache, ConeSearchIndex]
+        The oid to aid cache and the spatial index filled with the migrated objects, to be
+        used by the detection migration
+    """
+    # the cache is sized once every migrated oid is in it
+    cache = OidCache(None)
+    spatial_index = ConeSearchIndex()
+
+    def start_transform(next_actor, metrics, autotuner, limiter):
+        return TransformObjectActor.start(
+            next_actor,
+            num_transformers=num_transformers,
+            metrics=metrics,
+            autotuner=autotuner,
+            limiter=limiter,
+        )
+
+    def start_pipeline(target_db, checkpoint, limiter, metrics, autotuner, _):
+        return start_actors(
+            target_db,
+            write_batch_size,
+            dry_run,
+            checkpoint,
+            limiter,
+            num_transformers,
+            write_concurrency,
+            cache,
+            spatial_index,
+            metrics,
+            autotuner,
+        )
+
+    run_pipeline(
+        "object",
+        start_transform,
+        start_pipeline,
+        read_batch_size,
+        write_batch_size,
+        dry_run,
+        partitions,
+        checkpoint_file,
+        resume,
+        max_inflight,
+        metrics_prefix,
+        sink,
+        export,
+        autotune,
+        autotune_bounds,
+        deferred_indexes,
+    )
+    cache.max_size = len(cache) + cache_size
+    return cache, spatial_index
@@ -1,14 +1,15 @@
 import logging
-import pykka
 from typing import List
 
 from pymongo import InsertOne
+from populate_new.mongo_writer import OperationBufferActor
 
 
-class MongoDetectionWriterActor(pykka.ThreadingActor):
+class MongoDetectionWriterActor(OperationBufferActor):
     """Actor to write detections to the database.
 
-    This actor receives a list of detections and writes them to the database.
+    This actor receives a list of detections and writes them to the database. Detections can
+    be dictionaries or encoded detections, which are inserted without encoding them again.
 
     Parameters
     ----------
@@ -16,26 +17,16 @@ class MongoDetectionWriterActor(pykka.ThreadingActor):
         Generic writer actor
     write_batch_size : int
         Number of detections to write in a batch
+    autotuner : Autotuner, optional
+        Tuner whose bulk write size replaces ``write_batch_size``
+    flush_interval : float
+        Maximum number of seconds a detection waits for its batch
     """
-    def __init__(self, mongo_writer_actor: pykka.ActorRef, write_batch_size: int):
-        super().__init__()
-        self.mongo_writer_actor = mongo_writer_actor
-        self.operations = {}
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
         self.logger = logging.getLogger("MongoDetectionOperationActor")
-        self.write_batch_size = write_batch_size
 
-    def on_receive(self, message: List[dict]) -> None:
+    def operations_of(self, message: List[dict]):
         self.logger.debug(f"Creating operations for {len(message)} detections")
         for detection in message:
-            operation = InsertOne(detection)
-            self.operations[(detection["candid"], detection["oid"])] = operation
-            if len(self.operations.keys()) == self.write_batch_size:
-                self.send_operations()
-
-    def send_operations(self):
-        self.mongo_writer_actor.tell(self.operations)
-        self.operations = {}
-
-    def on_stop(self) -> None:
-        self.logger.debug("Sending last operations")
-        self.send_operations()
+            yield (detection["candid"], detection["oid"]), InsertOne(detection)
@@ -0,0 +1,32 @@
+import logging
+from typing import List
+
+from pymongo import InsertOne
+from populate_new.mongo_writer import OperationBufferActor
+
+
+class MongoNonDetectionWriterActor(OperationBufferActor):
+    """Actor to write non detections to the database.
+
+    This actor receives a list of non detections and sends them to the writer actor in batches.
+
+    Parameters
+    ----------
+    mongo_writer_actor : pykka.ActorRef
+        Generic writer actor
+    write_batch_size : int
+        Number of non detections to write in a batch
+    autotuner : Autotuner, optional
+        Tuner whose bulk write size replaces ``write_batch_size``
+    flush_interval : float
+        Maximum number of seconds a non detection waits for its batch
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.logger = logging.getLogger("MongoNonDetectionOperationActor")
+
+    def operations_of(self, message: List[dict]):
+        self.logger.debug(f"Creating operations for {len(message)} non detections")
+        for non_detection in message:
+            yield (non_detection["_id"], non_detection["oid"]), InsertOne(non_detection)
@@ -1,8 +1,200 @@
 import pykka
 import logging
+import threading
+import time
+from typing import List, Union
+from pymongo import UpdateOne
+from pymongo.database import Database
+from pymongo.errors import BulkWriteError
+from populate_new.mongo_writer import DUPLICATE_KEY_ERROR, OperationBufferActor
 
 
 class MongoObjectWriterActor(pykka.ThreadingActor):
-    def __init__(self):
+    """Actor to write the objects created by the sorting hat to the database.
+
+    This actor buffers the new objects and writes them with unordered bulk upserts when the
+    buffer reaches ``batch_size`` objects or when the oldest buffered object has waited
+    ``flush_interval`` seconds. New objects have the schema of the migrated ones, the aid as
+    ``_id`` and a list of ``oid``, so the oids of new objects that got the same aid are added
+    to the same object. The position of the first detection is written when the object is
+    created, so later runs find it by cone search.
+
+    An upsert that loses a concurrent insert of the same aid fails with a duplicate key error
+    without adding its oids, so it is retried as an update of the inserted object.
+
+    Parameters
+    ----------
+    db : Database
+        The database to write to
+    batch_size : int
+        Number of objects to write in a batch
+    dry_run : bool
+        If True, the actor will not write to the database
+    flush_interval : float
+        Maximum number of seconds an object waits in the buffer
+    max_retries : int
+        Number of times the upserts that failed with a duplicate key error are retried
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        batch_size: int,
+        dry_run: bool = False,
+        flush_interval: float = 5,
+        max_retries: int = 5,
+    ):
         super().__init__()
+        self.db = db
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
         self.logger = logging.getLogger("MongoObjectOperationActor")
+        self.objects = []
+        self.first_buffered = None
+        self.written = 0
+        self.stopped = threading.Event()
+
+    def on_start(self) -> None:
+        threading.Thread(target=self.tick, daemon=True).start()
+
+    def tick(self):
+        while not self.stopped.wait(self.flush_interval):
+            self.actor_ref.tell({"type": "flush"})
+
+    def on_receive(self, message: Union[List[dict], dict]) -> None:
+        if isinstance(message, dict):
+            if message["type"] != "flush":
+                raise ValueError(f"Unknown message {message}")
+            if (
+                self.first_buffered is not None
+                and time.time() - self.first_buffered >= self.flush_interval
+            ):
+                self.flush()
+            return
+        self.logger.debug(f"Buffering {len(message)} objects")
+        if self.first_buffered is None:
+            self.first_buffered = time.time()
+        self.objects.extend(message)
+        if len(self.objects) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        objects, self.objects = self.objects, []
+        self.first_buffered = None
+        if not objects:
+            return
+        if self.dry_run:
+            self.logger.debug(f"Writing {len(objects)} objects")
+            return
+        merged = {}
+        for obj in objects:
+            if obj["_id"] in merged:
+                merged[obj["_id"]]["oid"].extend(obj["oid"])
+            else:
+                merged[obj["_id"]] = {**obj, "oid": list(obj["oid"])}
+        operations = [
+            UpdateOne(
+                {"_id": aid},
+                {
+                    "$setOnInsert": {
+                        k: v for k, v in obj.items() if k not in ("_id", "oid")
+                    },
+                    "$addToSet": {"oid": {"$each": obj["oid"]}},
+                },
+                upsert=True,
+            )
+            for aid, obj in merged.items()
+        ]
+        self.write(operations)
+        self.written += len(objects)
+
+    def write(self, operations: List[UpdateOne]) -> None:
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.db["object"].bulk_write(operations, ordered=False)
+                return
+            except BulkWriteError as bwe:
+                errors = bwe.details["writeErrors"]
+                retry = [
+                    operations[e["index"]]
+                    for e in errors
+                    if e["code"] == DUPLICATE_KEY_ERROR
+                ]
+                failed = [e for e in errors if e["code"] != DUPLICATE_KEY_ERROR]
+                if failed:
+                    self.logger.error(
+                        f"Failed to write {len(failed)} objects: {failed[0]}"
+                    )
+                if not retry:
+                    return
+                operations = retry
+        self.logger.error(
+            f"Failed to write {len(operations)} objects after {self.max_retries} "
+            "retries of duplicate key errors"
+        )
+
+    def on_stop(self) -> None:
+        self.stopped.set()
+        self.logger.debug("Writing last objects")
+        self.flush()
+        self.logger.info(f"Wrote {self.written} new objects")
+
+
+class MongoObjectMigrationActor(OperationBufferActor):
+    """Actor to create the upserts of the migrated objects.
+
+    This actor receives transformed objects and sends upserts to the writer actor in batches.
+    Each object is also added to the oid to aid cache and the spatial index given, so the
+    detection migration that runs afterwards finds these objects in memory.
+
+    Parameters
+    ----------
+    mongo_writer_actor : pykka.ActorRef
+        Generic writer actor
+    write_batch_size : int
+        Number of objects to write in a batch
+    cache : OidCache, optional
+        Cache filled with each oid of the object and its aid
+    spatial_index : ConeSearchIndex, optional
+        Index filled with the position of each object
+    autotuner : Autotuner, optional
+        Tuner whose bulk write size replaces ``write_batch_size``
+    flush_interval : float
+        Maximum number of seconds an object waits for its batch
+    """
+
+    def __init__(
+        self,
+        mongo_writer_actor: pykka.ActorRef,
+        write_batch_size: int,
+        cache=None,
+        spatial_index=None,
+        autotuner=None,
+        flush_interval: float = 5,
+    ):
+        super().__init__(
+            mongo_writer_actor, write_batch_size, autotuner, flush_interval
+        )
+        self.cache = cache
+        self.spatial_index = spatial_index
+        self.logger = logging.getLogger("MongoObjectMigrationActor")
+
+    def operations_of(self, message: List[dict]):
+        self.logger.debug(f"Creating operations for {len(message)} objects")
+        for obj in message:
+            self.warm(obj)
+            operation = UpdateOne(
+                {"_id": obj["_id"]},
+                {"$set": {k: v for k, v in obj.items() if k != "_id"}},
+                upsert=True,
+            )
+            yield (obj["_id"],), operation
+
+    def warm(self, obj: dict) -> None:
+        if self.cache is not None:
+            for oid in obj["oid"]:
+                self.cache.put(oid, obj["_id"])
+        if self.spatial_index is not None:
+            self.spatial_index.add_object(obj)
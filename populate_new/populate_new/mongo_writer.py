@@ -1,17 +1,49 @@
 import logging
-from typing import Dict
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, Tuple
 import pykka
+from populate_new.metrics import MetricsRegistry, stage_metrics
 from pymongo import InsertOne
 from pymongo.database import Database
-from pymongo.errors import BulkWriteError
+from pymongo.errors import (
+    BulkWriteError,
+    ConnectionFailure,
+    OperationFailure,
+    PyMongoError,
+)
 import time
 
+DUPLICATE_KEY_ERROR = 11000
+# Server error codes that may succeed when the operation is sent again
+TRANSIENT_ERRORS = {
+    6,  # HostUnreachable
+    7,  # HostNotFound
+    89,  # NetworkTimeout
+    91,  # ShutdownInProgress
+    112,  # WriteConflict
+    189,  # PrimarySteppedDown
+    262,  # ExceededTimeLimit
+    9001,  # SocketException
+    10107,  # NotWritablePrimary
+    11600,  # InterruptedAtShutdown
+    11602,  # InterruptedDueToReplStateChange
+    13435,  # NotPrimaryNoSecondaryOk
+    13436,  # NotPrimaryOrSecondary
+}
+
 
 class MongoWriterActor(pykka.ThreadingActor):
     """Actor to write documents to the database.
 
     This actor receives a dictionary of operations and writes them to the database.
 
+    Up to ``max_concurrent_writes`` bulk writes are kept in flight at the same time over the
+    client connection pool. When the window is full the actor waits for a write to finish
+    before taking the next message. Each bulk write is unordered, so there is no ordering
+    guarantee between or within batches.
+
     Parameters
     ----------
     db : Database
@@ -20,89 +52,244 @@ class MongoWriterActor(pykka.ThreadingActor):
         Number of documents to write in a batch
     dry_run : bool
         If True, the actor will not write to the database
+    checkpoint : CheckpointTracker, optional
+        Tracker acknowledged with the source ``_id`` of each written document. The first
+        element of each operation key must be that ``_id``
+    limiter : InflightLimiter, optional
+        Credits released for every operation received, once it was written or discarded
+    max_concurrent_writes : int
+        Number of bulk writes in flight at the same time
+    max_retries : int
+        Number of times operations with transient errors are sent again
+    retry_backoff : float
+        Seconds to wait before the first retry, doubled on each retry
+    collection : str
+        Name of the collection to write to
+    metrics : MetricsRegistry, optional
+        Registry where the "write" stage is recorded
+    autotuner : Autotuner, optional
+        Tuner whose bulk write size is adjusted by the latency of each bulk write
     """
     def __init__(
         self,
         db: Database,
         batch_size: int,
         dry_run: bool = False,
+        checkpoint=None,
+        limiter=None,
+        max_concurrent_writes: int = 1,
+        max_retries: int = 5,
+        retry_backoff: float = 0.5,
+        collection: str = "detection",
+        metrics: MetricsRegistry = None,
+        autotuner=None,
     ):
         super().__init__()
         self.db = db
+        self.collection = collection
         self.dry_run = dry_run
+        self.checkpoint = checkpoint
+        self.limiter = limiter
         self.logger = logging.getLogger("MongoWriterActor")
-        self.time_logger = TimeLogger(batch_size, batch_size * 10)
+        self.metrics = stage_metrics(metrics, "write")
+        self.autotuner = autotuner
+        self.counts_lock = threading.Lock()
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.write_counts = {"inserted": 0, "duplicates": 0, "retried": 0, "failed": 0}
+        self.window = threading.Semaphore(max_concurrent_writes)
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent_writes)
 
     def on_receive(self, operations: Dict[str, InsertOne]) -> None:
         self.logger.debug(f"Writing {len(operations)} objects")
         if self.dry_run:
             self.logger.debug(f"Writing {len(operations)} objects")
+            self.metrics.record(len(operations), 0)
+            self.release(len(operations))
             return
+        self.window.acquire()
+        future = self.executor.submit(self.write, operations)
+        future.add_done_callback(lambda _: self.window.release())
+
+    def write(self, operations: Dict[str, InsertOne]) -> None:
+        """Writes a batch, classifying the errors of each failed operation.
+
+        Duplicate key errors mean the document was already migrated, so they are counted and
+        acknowledged without retrying. Operations that failed with a transient error are retried
+        with exponential backoff up to ``max_retries`` times. Any other error is counted as
+        failed and is not acknowledged.
+        """
+        received = len(operations)
+        keys = list(operations.keys())
+        pending = list(operations.values())
+        attempt = 0
         try:
-            # TODO: handle different collections
-            operation_values = list(operations.values()) 
-            self.db["detection"].bulk_write(operation_values, ordered=False)
-            self.time_logger.tell(
-                {"type": "increase_counter", "counter": len(operations)}
-            )
+            while pending:
+                t0 = time.time()
+                written, retry, failed = self.bulk_write(keys, pending)
+                self.metrics.record(len(written), time.time() - t0)
+                if self.autotuner is not None:
+                    self.autotuner.write.observe(len(pending), time.time() - t0)
+                self.acknowledge([key[0] for key in written])
+                if retry and attempt < self.max_retries:
+                    self.count("retried", len(retry))
+                    time.sleep(self.retry_backoff * 2**attempt)
+                    attempt += 1
+                else:
+                    failed += retry
+                    retry = []
+                if failed:
+                    self.count("failed", len(failed))
+                    self.metrics.error(len(failed))
+                    self.logger.error(f"Failed to write {len(failed)} documents")
+                keys = [key for key, _ in retry]
+                pending = [operation for _, operation in retry]
+        finally:
             operations.clear()
+            self.release(received)
+
+    def bulk_write(self, keys: list, operations: list) -> Tuple[list, list, list]:
+        """Runs one unordered bulk write
+
+        Returns
+        -------
+        Tuple[list, list, list]
+            Keys of the documents now in the database, (key, operation) pairs to retry and keys
+            of the operations that failed
+        """
+        try:
+            self.db[self.collection].bulk_write(operations, ordered=False)
+            self.count("inserted", len(operations))
+            return keys, [], []
         except BulkWriteError as bwe:
-            for err in bwe.details["writeErrors"]:
-                repeated_op = operation_values[err["index"]]
-                repeated_key = (repeated_op.document["candid"], repeated_op.document["oid"])
-                operations.pop(repeated_key)
-            self.db["detection"].bulk_write(list(operations.values()), ordered=False)
-            operations.clear()
-        finally:
-            self.time_logger.tell({"type": "log_times"})
-            return
+            details = bwe.details
+        except (ConnectionFailure, OperationFailure) as error:
+            if not self.is_transient(error):
+                self.logger.error(f"Error writing batch: {error}")
+                return [], [], keys
+            self.logger.warning(f"Transient error writing batch: {error}")
+            return [], list(zip(keys, operations)), []
+        errors = {err["index"]: err["code"] for err in details["writeErrors"]}
+        written, retry, failed = [], [], []
+        for index, key in enumerate(keys):
+            code = errors.get(index)
+            if code is None:
+                written.append(key)
+            elif code == DUPLICATE_KEY_ERROR:
+                written.append(key)
+                self.count("duplicates", 1)
+            elif code in TRANSIENT_ERRORS:
+                retry.append((key, operations[index]))
+            else:
+                failed.append(key)
+        self.count("inserted", details["nInserted"])
+        return written, retry, failed
+
+    @staticmethod
+    def is_transient(error: PyMongoError) -> bool:
+        if isinstance(error, ConnectionFailure):
+            return True
+        return error.has_error_label("RetryableWriteError") or (
+            getattr(error, "code", None) in TRANSIENT_ERRORS
+        )
+
+    def count(self, counter: str, value: int) -> None:
+        with self.counts_lock:
+            self.write_counts[counter] += value
+
+    def release(self, count: int) -> None:
+        if self.limiter is not None:
+            self.limiter.release(count)
+
+    def acknowledge(self, source_ids: list) -> None:
+        if self.checkpoint is not None:
+            self.checkpoint.acknowledge(source_ids)
 
     def on_stop(self) -> None:
-        self.time_logger.tell({"type": "summary"})
+        self.executor.shutdown(wait=True)
+        self.logger.info(
+            "Inserted {inserted}, already migrated {duplicates}, "
+            "retried {retried}, failed {failed}".format(**self.write_counts)
+        )
 
 
-class TimeLogger:
-    """Class to log the time it takes to write to the database.
+class OperationBufferActor(pykka.ThreadingActor, ABC):
+    """Base of the actors that buffer the operations of a collection for the writer actor.
 
-    This class logs the time it takes to write to the database and the average time it takes to write
-    to the database.
+    The buffered operations are sent when they reach the bulk write size or when the oldest
+    of them has waited ``flush_interval`` seconds, so the in-flight credits of a partial batch
+    come back even when no more documents arrive. Subclasses implement ``operations`` to turn
+    a message into the operations to buffer by key.
 
     Parameters
     ----------
+    mongo_writer_actor : pykka.ActorRef
+        Generic writer actor
     write_batch_size : int
-        Number of documents to write
-    eval_every : int
-        Number of documents to write before logging the average time
+        Number of operations to write in a batch
+    autotuner : Autotuner, optional
+        Tuner whose bulk write size replaces ``write_batch_size``
+    flush_interval : float
+        Maximum number of seconds an operation waits in the buffer
     """
-    def __init__(self, write_batch_size: int, eval_every: int):
+
+    def __init__(
+        self,
+        mongo_writer_actor: pykka.ActorRef,
+        write_batch_size: int,
+        autotuner=None,
+        flush_interval: float = 5,
+    ):
         super().__init__()
-        self.t0 = time.time()
-        self.times = []
-        self.counter = 0
+        self.mongo_writer_actor = mongo_writer_actor
         self.write_batch_size = write_batch_size
-        self.eval_every = eval_every
-        self.logger = logging.getLogger("TimeLogger")
-
-    def on_receive(self, message: dict) -> None:
-        if message["type"] == "log_times":
-            self.times.append(time.time() - self.t0)
-            self.t0 = time.time()
-            if self.counter % self.eval_every == 0:
-                self.logger.info(f"Processed {self.counter} detections")
-                self.logger.info(f"Average time: {sum(self.times)/len(self.times)}")
-                self.logger.info(f"Elapsed time: {sum(self.times)}")
-        elif message["type"] == "increase_counter":
-            self.counter += message["counter"]
-        elif message["type"] == "summary":
-            average = sum(self.times) / len(self.times)
-            total = sum(self.times)
-            persec = self.write_batch_size / average
-            self.logger.info("")
-            self.logger.info(f"Average time per batch: {average} seconds")
-            self.logger.info(f"Total time for detection: {total} seconds")
-            self.logger.info(f"Detections per second: {persec}")
-        else:
-            raise ValueError(f"Unknown message {message}")
-
-    def tell(self, what: dict):
-        self.on_receive(what)
+        self.autotuner = autotuner
+        self.flush_interval = flush_interval
+        self.operations = {}
+        self.first_buffered = None
+        self.stopped = threading.Event()
+
+    def on_start(self) -> None:
+        threading.Thread(target=self.tick, daemon=True).start()
+
+    def tick(self):
+        while not self.stopped.wait(self.flush_interval):
+            self.actor_ref.tell({"type": "flush"})
+
+    def on_receive(self, message) -> None:
+        if isinstance(message, dict):
+            if message["type"] != "flush":
+                raise ValueError(f"Unknown message {message}")
+            if (
+                self.first_buffered is not None
+                and time.time() - self.first_buffered >= self.flush_interval
+            ):
+                self.send_operations()
+            return
+        if self.first_buffered is None:
+            self.first_buffered = time.time()
+        for key, operation in self.operations_of(message):
+            self.operations[key] = operation
+            if len(self.operations) >= self.batch_size():
+                self.send_operations()
+
+    @abstractmethod
+    def operations_of(self, message: list) -> Iterator[Tuple[tuple, Any]]:
+        """Yields the key and operation of each document of a message"""
+
+    def batch_size(self) -> int:
+        if self.autotuner is None:
+            return self.write_batch_size
+        return self.autotuner.write.value
+
+    def send_operations(self):
+        self.first_buffered = None
+        if not self.operations:
+            return
+        self.mongo_writer_actor.tell(self.operations)
+        self.operations = {}
+
+    def on_stop(self) -> None:
+        self.stopped.set()
+        self.logger.debug("Sending last operations")
+        self.send_operations()
@@ -0,0 +1,116 @@
+import logging
+from typing import Callable, Dict, Tuple
+import pykka
+from populate_new.autotune import Autotuner
+from populate_new.backpressure import InflightLimiter, QueueDepthMonitor
+from populate_new.metrics import MetricsRegistry, create_exporter
+from populate_new.sinks import DISCARD_SINKS, connect, start_discard_actors
+from populate_new.source_reader import create_checkpoint, start_readers
+
+
+def run_pipeline(
+    collection: str,
+    start_transform: Callable[..., pykka.ActorRef],
+    start_actors: Callable[..., Dict[str, pykka.ActorRef]],
+    read_batch_size: int,
+    write_batch_size: int,
+    dry_run: bool = True,
+    partitions: int = 1,
+    checkpoint_file: str = None,
+    resume: bool = False,
+    max_inflight: int = 100000,
+    metrics_prefix: str = None,
+    sink: str = "mongo",
+    export=None,
+    autotune: bool = False,
+    autotune_bounds: dict = None,
+    deferred_indexes: Tuple[str, ...] = (),
+    key: str = "_id",
+    send_complete: bool = False,
+) -> None:
+    """Migrates a collection through the actors of its pipeline and waits for them.
+
+    The collection is split in ``partitions`` ranges of ``key``, each one read by its own
+    reader, and the readers block while ``max_inflight`` documents are read but not written.
+    The progress of each range is saved to ``checkpoint_file`` and a run with ``resume``
+    continues after it.
+
+    The ``sink`` is one of ``populate_new.sinks.SINKS``. The export sink writes to the files
+    of ``export``. The transform and read sinks discard the documents after that stage, so
+    only the transform actor of the collection is started.
+
+    With ``autotune`` the cursor, pipeline and bulk write batch sizes start at the given
+    sizes and are adjusted at runtime within ``autotune_bounds``, see
+    ``populate_new.autotune.Autotuner``.
+
+    The secondary indexes of the ``deferred_indexes`` collections are not created in the
+    target database, see ``populate_new.indexes.build_deferred_indexes``.
+
+    Parameters
+    ----------
+    collection : str
+        Name of the source collection
+    start_transform : Callable[..., pykka.ActorRef]
+        ``start_transform(next_actor, metrics, autotuner, limiter)`` starts the transform
+        actor of the collection in front of ``next_actor``, used by the discard sinks
+    start_actors : Callable[..., Dict[str, pykka.ActorRef]]
+        ``start_actors(target_db, checkpoint, limiter, metrics, autotuner, split_points)``
+        starts the actors of the collection and returns them by name, the first one as
+        ``"transform"``
+    key : str
+        Field the ranges are split and read by
+    send_complete : bool
+        If True, the readers send a complete message when their range is read
+    """
+    source_db, target_db = connect(sink, export, deferred_indexes)
+    checkpoint = create_checkpoint(
+        source_db[collection], partitions, checkpoint_file, resume, key
+    )
+    split_points = checkpoint.split_points
+    if dry_run or sink != "mongo":
+        # nothing is written, so there is no progress to record
+        checkpoint = None
+    else:
+        checkpoint.save()
+    limiter = InflightLimiter(max_inflight)
+    metrics = MetricsRegistry()
+    autotuner = (
+        Autotuner(read_batch_size, write_batch_size, autotune_bounds)
+        if autotune
+        else None
+    )
+    if sink in DISCARD_SINKS:
+        actors, first_actor = start_discard_actors(
+            sink,
+            lambda next_actor: start_transform(next_actor, metrics, autotuner, limiter),
+            limiter,
+            metrics,
+        )
+    else:
+        actors = start_actors(
+            target_db, checkpoint, limiter, metrics, autotuner, split_points
+        )
+        first_actor = actors["transform"]
+    monitor = QueueDepthMonitor(actors, limiter)
+    monitor.start()
+    exporter = create_exporter(metrics, actors, metrics_prefix)
+    exporter.start()
+    readers = start_readers(
+        source_db[collection],
+        first_actor,
+        read_batch_size,
+        split_points,
+        checkpoint,
+        limiter,
+        metrics,
+        send_complete=send_complete,
+        key=key,
+        autotuner=autotuner,
+    )
+    pykka.get_all([reader.ask({"type": "read"}, block=False) for reader in readers])
+
+    pykka.ActorRegistry.stop_all()
+    monitor.stop()
+    exporter.stop()
+    if autotuner is not None:
+        autotuner.log_summary(logging.getLogger("Autotuner"))
@@ -1,13 +1,273 @@
-from migrate_detection import migrate_detection
-import sys
+from populate_new.migrate_detection import migrate_detection
+from populate_new.migrate_non_detection import migrate_non_detection
+from populate_new.migrate_object import migrate_object
+from populate_new.dbconn import create_target_connection, read_env_variables
+from populate_new.export import EXPORT_FORMATS, ExportDatabase
+from populate_new.indexes import INDEXED_COLLECTIONS, build_deferred_indexes
+from populate_new.sinks import SINKS
+import argparse
+import os
 
-if __name__ == "__main__":
-    if len(sys.argv) == 4:
-        dry_run = sys.argv[3] == "--dry-run"
-    else:
-        dry_run = False
+# objects go first so the detection migration finds them in memory
+COLLECTIONS = ["object", "detection", "non_detection"]
+AUTOTUNED = ["cursor", "pipeline", "write"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        prog="populate-new", description="Migrate the database to the new schema"
+    )
+    parser.add_argument(
+        "read_batch_size",
+        type=int,
+        help="Source cursor batch size and documents per pipeline message",
+    )
+    parser.add_argument("write_batch_size", type=int, help="Documents per bulk write")
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Do not write to the target database"
+    )
+    parser.add_argument(
+        "--collections",
+        nargs="+",
+        choices=COLLECTIONS,
+        default=["detection"],
+        help="Collections to migrate. Objects are always migrated first",
+    )
+    parser.add_argument(
+        "--partitions",
+        type=int,
+        default=1,
+        help="Number of _id ranges read concurrently from the source",
+    )
+    parser.add_argument(
+        "--no-spatial-index",
+        action="store_true",
+        help="Run cone searches against the target database instead of in memory",
+    )
+    parser.add_argument(
+        "--checkpoint-dir",
+        default=".",
+        help="Directory of the state files where the progress of each partition is saved",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue each partition after the checkpoint saved in the state file",
+    )
+    parser.add_argument(
+        "--max-inflight",
+        type=int,
+        default=100000,
+        help="Maximum number of documents read but not yet written",
+    )
+    parser.add_argument(
+        "--transformers",
+        type=int,
+        default=5,
+        help="Number of worker processes transforming documents",
+    )
+    parser.add_argument(
+        "--write-concurrency",
+        type=int,
+        default=4,
+        help="Number of bulk writes in flight at the same time",
+    )
+    parser.add_argument(
+        "--oid-cache-size",
+        type=int,
+        default=100000,
+        help="Number of oid to aid pairs kept in memory besides the migrated objects",
+    )
+    parser.add_argument(
+        "--sorting-hat-shards",
+        type=int,
+        default=1,
+        help="Number of sorting hats assigning aids in parallel, each to a part of the oids, "
+        "requires the spatial index",
+    )
+    parser.add_argument(
+        "--group-flush-interval",
+        type=float,
+        default=5,
+        help="Maximum number of seconds a detection waits to be grouped by oid",
+    )
+    parser.add_argument(
+        "--complete-groups",
+        action="store_true",
+        help="Send each oid to the sorting hat once with all its detections, implies "
+        "--oid-order",
+    )
+    parser.add_argument(
+        "--oid-order",
+        action="store_true",
+        help="Split and read the detections by oid over the oid index of the source, so "
+        "each oid is looked up once without holding the whole collection",
+    )
+    parser.add_argument(
+        "--sink",
+        choices=SINKS,
+        default="mongo",
+        help="Where the documents go: the target database, an in-memory target, files for "
+        "an offline load, or nowhere after they are transformed or read. The per stage "
+        "throughput is logged at the end of each collection",
+    )
+    parser.add_argument(
+        "--export-dir",
+        default="export",
+        help="Directory of the files written by the export sink, with a manifest.json of "
+        "their counts and checksums",
+    )
+    parser.add_argument(
+        "--export-format",
+        choices=EXPORT_FORMATS,
+        default="bson",
+        help="Gzip compressed BSON parts to load with mongorestore, or Parquet files",
+    )
+    parser.add_argument(
+        "--export-file-documents",
+        type=int,
+        default=1000000,
+        help="Number of documents of each exported file",
+    )
+    parser.add_argument(
+        "--autotune",
+        action="store_true",
+        help="Adjust the batch sizes at runtime from the latency and throughput of each "
+        "stage, starting at the given sizes",
+    )
+    for name in AUTOTUNED:
+        parser.add_argument(
+            f"--{name}-batch-bounds",
+            type=int,
+            nargs=2,
+            metavar=("MIN", "MAX"),
+            default=None,
+            help=f"Bounds of the tuned {name} batch size, a tenth and ten times the "
+            "starting size by default",
+        )
+    parser.add_argument(
+        "--defer-indexes",
+        nargs="*",
+        choices=INDEXED_COLLECTIONS,
+        default=None,
+        help="Collections whose secondary indexes are built in one pass after the load, "
+        "every collection if none is given. Only the unique and geospatial indexes exist "
+        "during the load",
+    )
+    parser.add_argument(
+        "--metrics-dir",
+        default=None,
+        help="Directory where the metrics of each stage are exported as JSON lines and "
+        "Prometheus text files",
+    )
+    args = parser.parse_args()
+    if args.sorting_hat_shards > 1 and args.no_spatial_index:
+        parser.error("--sorting-hat-shards requires the spatial index")
+    return args
+
+
+def autotune_bounds(args) -> dict:
+    bounds = {name: getattr(args, f"{name}_batch_bounds") for name in AUTOTUNED}
+    return {name: tuple(value) for name, value in bounds.items() if value is not None}
+
+
+def deferred_indexes(args) -> tuple:
+    if args.defer_indexes is None:
+        return ()
+    return tuple(sorted(args.defer_indexes or INDEXED_COLLECTIONS))
 
-    read_batch_size = int(sys.argv[1])
-    write_batch_size = int(sys.argv[2])
 
-    migrate_detection(read_batch_size, write_batch_size, dry_run)
+def checkpoint_file(checkpoint_dir: str, collection: str) -> str:
+    return os.path.join(checkpoint_dir, f"migrate_{collection}.checkpoint.json")
+
+
+def metrics_prefix(metrics_dir: str, collection: str) -> str:
+    if metrics_dir is None:
+        return None
+    return os.path.join(metrics_dir, f"migrate_{collection}")
+
+
+def main():
+    """Entry point of the ``populate-new`` command and of ``python -m populate_new``"""
+    args = parse_args()
+    cache, spatial_index = None, None
+    deferred = deferred_indexes(args)
+    export = None
+    if args.sink == "export":
+        export = ExportDatabase(
+            args.export_dir,
+            read_env_variables("TARGET")[2],
+            args.export_format,
+            args.export_file_documents,
+        )
+    for collection in sorted(set(args.collections), key=COLLECTIONS.index):
+        if collection == "object":
+            cache, spatial_index = migrate_object(
+                args.read_batch_size,
+                args.write_batch_size,
+                args.dry_run,
+                partitions=args.partitions,
+                checkpoint_file=checkpoint_file(args.checkpoint_dir, collection),
+                resume=args.resume,
+                max_inflight=args.max_inflight,
+                num_transformers=args.transformers,
+                write_concurrency=args.write_concurrency,
+                metrics_prefix=metrics_prefix(args.metrics_dir, collection),
+                cache_size=args.oid_cache_size,
+                sink=args.sink,
+                export=export,
+                autotune=args.autotune,
+                autotune_bounds=autotune_bounds(args),
+                deferred_indexes=deferred,
+            )
+        elif collection == "detection":
+            migrate_detection(
+                args.read_batch_size,
+                args.write_batch_size,
+                args.dry_run,
+                use_spatial_index=not args.no_spatial_index,
+                partitions=args.partitions,
+                checkpoint_file=checkpoint_file(args.checkpoint_dir, collection),
+                resume=args.resume,
+                max_inflight=args.max_inflight,
+                num_transformers=args.transformers,
+                write_concurrency=args.write_concurrency,
+                metrics_prefix=metrics_prefix(args.metrics_dir, collection),
+                cache=cache,
+                spatial_index=spatial_index,
+                sorting_hat_shards=args.sorting_hat_shards,
+                group_flush_interval=args.group_flush_interval,
+                complete_groups=args.complete_groups,
+                oid_order=args.oid_order,
+                sink=args.sink,
+                export=export,
+                autotune=args.autotune,
+                autotune_bounds=autotune_bounds(args),
+                deferred_indexes=deferred,
+            )
+        elif collection == "non_detection":
+            migrate_non_detection(
+                args.read_batch_size,
+                args.write_batch_size,
+                args.dry_run,
+                partitions=args.partitions,
+                checkpoint_file=checkpoint_file(args.checkpoint_dir, collection),
+                resume=args.resume,
+                max_inflight=args.max_inflight,
+                num_transformers=args.transformers,
+                write_concurrency=args.write_concurrency,
+                metrics_prefix=metrics_prefix(args.metrics_dir, collection),
+                sink=args.sink,
+                export=export,
+                autotune=args.autotune,
+                autotune_bounds=autotune_bounds(args),
+                deferred_indexes=deferred,
+            )
+    if export is not None:
+        export.close()
+    if args.sink == "mongo" and not args.dry_run and deferred:
+        build_deferred_indexes(create_target_connection(deferred), deferred)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import struct
+from typing import Any, Dict, Iterable, Iterator, Tuple
+import bson
+
+_INT32 = struct.Struct("<i")
+
+# Size of the values with a fixed length by BSON element type
+_FIXED_SIZES = {
+    0x01: 8,  # double
+    0x06: 0,  # undefined
+    0x07: 12,  # ObjectId
+    0x08: 1,  # boolean
+    0x09: 8,  # UTC datetime
+    0x0A: 0,  # null
+    0x10: 4,  # int32
+    0x11: 8,  # timestamp
+    0x12: 8,  # int64
+    0x13: 16,  # decimal128
+    0x7F: 0,  # max key
+    0xFF: 0,  # min key
+}
+
+
+def _value_size(raw: bytes, element_type: int, start: int) -> int:
+    if element_type in _FIXED_SIZES:
+        return _FIXED_SIZES[element_type]
+    if element_type in (0x02, 0x0D, 0x0E):  # string, code, symbol
+        return 4 + _INT32.unpack_from(raw, start)[0]
+    if element_type in (0x03, 0x04, 0x0F):  # document, array, code with scope
+        return _INT32.unpack_from(raw, start)[0]
+    if element_type == 0x05:  # binary
+        return 5 + _INT32.unpack_from(raw, start)[0]
+    if element_type == 0x0B:  # regular expression
+        pattern_end = raw.index(b"\x00", start)
+        return raw.index(b"\x00", pattern_end + 1) + 1 - start
+    if element_type == 0x0C:  # DBPointer
+        return 4 + _INT32.unpack_from(raw, start)[0] + 12
+    raise bson.errors.InvalidBSON(f"Unknown element type {element_type}")
+
+
+def iter_elements(raw: bytes) -> Iterator[Tuple[str, int, bytes]]:
+    """Iterates over the top level elements of an encoded document without decoding them
+
+    Yields
+    ------
+    Tuple[str, int, bytes]
+        The key, the element type and the encoded value of each element
+    """
+    position, end = 4, _INT32.unpack_from(raw, 0)[0] - 1
+    while position < end:
+        element_type = raw[position]
+        key_end = raw.index(b"\x00", position + 1)
+        key = raw[position + 1 : key_end].decode("utf-8")
+        value_start = key_end + 1
+        value_end = value_start + _value_size(raw, element_type, value_start)
+        yield key, element_type, raw[value_start:value_end]
+        position = value_end
+
+
+def encode_element(key: str, element_type: int, value: bytes) -> bytes:
+    """Encodes an element from its key, type and encoded value"""
+    return bytes([element_type]) + key.encode("utf-8") + b"\x00" + value
+
+
+def encode_document(elements: Iterable[bytes]) -> bytes:
+    """Builds an encoded document from already encoded elements"""
+    body = b"".join(elements)
+    return _INT32.pack(len(body) + 5) + body + b"\x00"
+
+
+def decode_value(element_type: int, value: bytes) -> Any:
+    """Decodes a single encoded value"""
+    return bson.decode(encode_document([encode_element("v", element_type, value)]))["v"]
+
+
+def read_fields(raw: bytes, keys: Iterable[str]) -> Dict[str, Any]:
+    """Decodes only the requested top level fields of an encoded document"""
+    keys = set(keys)
+    fields = {}
+    for key, element_type, value in iter_elements(raw):
+        if key in keys:
+            fields[key] = decode_value(element_type, value)
+            if len(fields) == len(keys):
+                break
+    return fields
@@ -0,0 +1,102 @@
+import logging
+import time
+from typing import Callable, Dict, Tuple
+import pykka
+from populate_new.dbconn import create_mongo_connections, create_source_connection
+from populate_new.export import ExportDatabase
+from populate_new.memory_db import UNIQUE_KEYS, MemoryDatabase
+from populate_new.metrics import MetricsRegistry, stage_metrics
+
+# mongo writes to the target database, memory runs the whole pipeline against the in-process
+# stand-in, export writes files for an offline load, and transform and read discard the
+# documents after that stage
+SINKS = ["mongo", "memory", "export", "transform", "read"]
+DISCARD_SINKS = ["transform", "read"]
+
+
+class DiscardActor(pykka.ThreadingActor):
+    """Actor that counts and drops the documents it receives, in place of the writers.
+
+    The credits of the in-flight limiter are released as the documents arrive, like the writer
+    does once they are written. Control messages are ignored.
+
+    Parameters
+    ----------
+    limiter : InflightLimiter, optional
+        Limiter whose credits are released
+    metrics : MetricsRegistry, optional
+        Registry where the "discard" stage is recorded
+    """
+
+    def __init__(self, limiter=None, metrics: MetricsRegistry = None):
+        super().__init__()
+        self.limiter = limiter
+        self.metrics = stage_metrics(metrics, "discard")
+        self.logger = logging.getLogger("DiscardActor")
+        self.started = time.time()
+        self.documents = 0
+
+    def on_receive(self, message) -> None:
+        if isinstance(message, dict):
+            return
+        self.documents += len(message)
+        self.metrics.record(len(message), 0)
+        if self.limiter is not None:
+            self.limiter.release(len(message))
+
+    def on_stop(self) -> None:
+        elapsed = time.time() - self.started
+        rate = self.documents / elapsed if elapsed > 0 else 0
+        self.logger.info(
+            f"Discarded {self.documents} documents ({rate:.1f} documents/s)"
+        )
+
+
+def connect(
+    sink: str, export: ExportDatabase = None, deferred_indexes: Tuple[str, ...] = ()
+):
+    """Returns the source database and the target of a sink.
+
+    Only the mongo sink connects to the target database and creates its indexes, except the
+    indexes of the ``deferred_indexes`` collections that are not needed during the load. The
+    export sink writes to the given export, shared by the collections of a run so the
+    detections find the exported objects, and every other sink gets an empty in-process
+    stand-in.
+    """
+    if sink not in SINKS:
+        raise ValueError(f"Unknown sink {sink}, expected one of {SINKS}")
+    if sink == "mongo":
+        return create_mongo_connections(deferred_indexes)
+    if sink == "export":
+        if export is None:
+            raise ValueError("The export sink requires an ExportDatabase")
+        return create_source_connection(), export
+    return create_source_connection(), MemoryDatabase(UNIQUE_KEYS)
+
+
+def start_discard_actors(
+    sink: str,
+    start_transform: Callable[[pykka.ActorRef], pykka.ActorRef],
+    limiter=None,
+    metrics: MetricsRegistry = None,
+) -> Tuple[Dict[str, pykka.ActorRef], pykka.ActorRef]:
+    """Starts the actors of a sink that discards the documents.
+
+    Parameters
+    ----------
+    sink : str
+        ``transform`` to discard the transformed documents, ``read`` to discard the documents
+        as they are read
+    start_transform : Callable[[pykka.ActorRef], pykka.ActorRef]
+        Starts the transform actor of the collection with the given next actor
+
+    Returns
+    -------
+    Tuple[Dict[str, pykka.ActorRef], pykka.ActorRef]
+        The actors by name and the actor the readers send their batches to
+    """
+    discard_actor = DiscardActor.start(limiter, metrics)
+    if sink == "read":
+        return {"discard": discard_actor}, discard_actor
+    transform_actor = start_transform(discard_actor)
+    return {"transform": transform_actor, "discard": discard_actor}, transform_actor
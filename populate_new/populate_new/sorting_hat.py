@@ -1,9 +1,66 @@
 import logging
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import nullcontext
 from typing import List, Tuple, Union
 import pykka
 from functools import reduce
 from pymongo.database import Database
+from populate_new.metrics import MetricsRegistry, stage_metrics
 import math
+import numpy as np
+
+
+def shard_of(oid: str, shards: int) -> int:
+    """Returns the sorting hat shard that handles an oid, the same one in every process"""
+    return zlib.crc32(oid.encode("utf-8")) % shards
+
+
+class OidCache:
+    """Bounded LRU cache of oid to aid.
+
+    Keeps the most recently used oids in memory so oids that reappear across batches
+    do not need to be queried again. Hits and misses are counted to help size the cache.
+
+    Parameters
+    ----------
+    max_size : int, optional
+        Maximum number of oids kept in the cache, unbounded if None
+    """
+
+    def __init__(self, max_size: Union[int, None]):
+        self.max_size = max_size
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, oid: str) -> Union[int, None]:
+        if oid in self.data:
+            self.data.move_to_end(oid)
+            self.hits += 1
+            return self.data[oid]
+        self.misses += 1
+        return None
+
+    def put(self, oid: str, aid: int) -> None:
+        self.data[oid] = aid
+        self.data.move_to_end(oid)
+        if self.max_size is not None and len(self.data) > self.max_size:
+            self.data.popitem(last=False)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, oid: str):
+        return oid in self.data
+
+    def split(self, shards: int) -> List["OidCache"]:
+        """Splits the cache in one cache per sorting hat shard, each with the oids of its shard"""
+        caches = [OidCache(self.max_size) for _ in range(shards)]
+        for oid, aid in self.data.items():
+            caches[shard_of(oid, shards)].put(oid, aid)
+        return caches
 
 
 class SortingHatActor(pykka.ThreadingActor):
@@ -11,10 +68,11 @@ class SortingHatActor(pykka.ThreadingActor):
 
     This actor assigns aid to detections and sends them to the detection operation actor.
 
-    The actor first tries to get the aid from the database. If the aid is found, it is assigned to
-    each detection in the message. If the aid is not found, the actor tries to find the aid by
-    cone search. If the aid is found, it is assigned to each detection in the message. If the aid
-    is not found, the actor assigns a new aid to each detection in the message.
+    For each oid in the message, the actor first tries to get the aid from an in-memory cache
+    and then from the database, querying all missing oids at once. Oids that are not found are
+    searched by cone search. The remaining oids are assigned a new aid and sent to the object
+    writer actor. New aids are added to the cache right away, so later messages do not depend
+    on the object writer having written them.
 
     Parameters
     ----------
@@ -22,6 +80,25 @@ class SortingHatActor(pykka.ThreadingActor):
         Actor to send detections
     object_operation_actor : pykka.ActorRef
         Actor to send objects
+    db : Database
+        The target database
+    spatial_index : ConeSearchIndex, optional
+        In-memory index used for cone searches instead of querying the database
+    conesearch_radius : float
+        Cone search radius in arcseconds
+    cache_size : int
+        Maximum number of oid to aid pairs kept in memory
+    query_chunk_size : int
+        Maximum number of oids sent in a single ``$in`` query
+    log_every : int
+        Number of messages between cache statistics logs
+    cache : OidCache, optional
+        Cache already filled with known oids, used instead of an empty one of ``cache_size``
+    metrics : MetricsRegistry, optional
+        Registry where the "sort" stage is recorded
+    shard : int, optional
+        Number of the shard when the oids are split between several sorting hats. Each
+        shard records its own "sort_<shard>" stage
     """
 
     def __init__(
@@ -29,16 +106,53 @@ class SortingHatActor(pykka.ThreadingActor):
         detection_writer_actor: pykka.ActorRef,
         object_writer_actor: pykka.ActorRef,
         db: Database,
+        spatial_index=None,
+        conesearch_radius: float = 1,
+        cache_size: int = 100000,
+        query_chunk_size: int = 1000,
+        log_every: int = 10,
+        cache: OidCache = None,
+        metrics: MetricsRegistry = None,
+        shard: int = None,
     ):
         super().__init__()
         self.detection_writter_actor = detection_writer_actor
         self.object_writer_actor = object_writer_actor
-        self.logger = logging.getLogger("SortingHatActor")
+        self.logger = logging.getLogger(
+            "SortingHatActor" if shard is None else f"SortingHatActor-{shard}"
+        )
         self.db = db
+        self.spatial_index = spatial_index
+        self.conesearch_radius = conesearch_radius
+        self.cache = cache if cache is not None else OidCache(cache_size)
+        self.query_chunk_size = query_chunk_size
+        self.log_every = log_every
+        self.messages = 0
+        self.metrics = stage_metrics(
+            metrics, "sort" if shard is None else f"sort_{shard}"
+        )
 
     def on_receive(self, message: dict) -> None:
         self.logger.debug(f"Sorting {len(message)} detections")
+        t0 = time.time()
         self.assign_aid(message)
+        self.metrics.record(
+            sum(len(detections) for detections in message.values()), time.time() - t0
+        )
+        self.messages += 1
+        if self.messages % self.log_every == 0:
+            self.log_cache_stats()
+
+    def on_stop(self) -> None:
+        self.log_cache_stats()
+
+    def log_cache_stats(self):
+        lookups = self.cache.hits + self.cache.misses
+        hit_rate = self.cache.hits / lookups if lookups else 0
+        self.logger.info(
+            f"Oid cache: {self.cache.hits} hits, {self.cache.misses} misses, "
+            f"hit rate {hit_rate:.2%}, size {len(self.cache)}/{self.cache.max_size}"
+        )
 
     def assign_aid(self, detections):
         """Receives detections and assigns aid
@@ -52,30 +166,34 @@ class SortingHatActor(pykka.ThreadingActor):
         >>> message = {"oid1": [detection1, detection2], "oid2": [detection3, detection4]}
         >>> assign_aid(message)
         """
-        detections, found = self.get_aid_by_oid(detections)
-        if found:
-            self.detection_writter_actor.tell(
-                list(reduce(lambda x, y: x + y, detections.values(), []))
-            )
-            return
-        detections, found = self.get_aid_by_conesearch(detections)
-        if found:
-            self.detection_writter_actor.tell(
-                list(reduce(lambda x, y: x + y, detections.values(), []))
-            )
-            return
-        detections, objects = self.new_aid(detections)
+        found, missing = self.get_aid_by_oid(detections)
+        objects = []
+        # shards share the spatial index, so the cone search and the new objects it misses
+        # are done under its lock for another shard to find them
+        with self.spatial_lock():
+            if missing:
+                found_by_conesearch, missing = self.get_aid_by_conesearch(missing)
+                found.update(found_by_conesearch)
+            if missing:
+                new_detections, objects = self.new_aid(missing)
+                found.update(new_detections)
         self.detection_writter_actor.tell(
-            list(reduce(lambda x, y: x + y, detections.values(), []))
+            list(reduce(lambda x, y: x + y, found.values(), []))
         )
-        self.object_writer_actor.tell(objects)
+        if objects:
+            self.object_writer_actor.tell(objects)
 
-    def get_aid_by_oid(self, detections: dict) -> Tuple[dict, bool]:
-        """Gets alerce id from database and assigns each detection that id
+    def spatial_lock(self):
+        if self.spatial_index is None:
+            return nullcontext()
+        return self.spatial_index.lock
 
-        If an aid is found in the database, it is assigned to each detection in the message.
+    def get_aid_by_oid(self, detections: dict) -> Tuple[dict, dict]:
+        """Gets alerce id from cache or database and assigns each detection that id
 
-        Note: This method modifies the input dictionary in place.
+        Oids not present in the cache are looked up in the ``oid`` list of the objects, whose
+        ``_id`` is the aid, with a single ``$in`` query per chunk of ``query_chunk_size`` oids.
+        Every aid found in the database is added to the cache.
 
         Parameters
         ----------
@@ -84,32 +202,48 @@ class SortingHatActor(pykka.ThreadingActor):
 
         Returns
         -------
-        Tuple[dict, bool]
-            The modified dictionary and a boolean indicating if the aid was found
+        Tuple[dict, dict]
+            The detections with an aid assigned and the detections whose oid was not found
 
         Examples
         --------
         >>> detections = {"oid1": [detection1, detection2], "oid2": [detection3, detection4]}
 
         >>> get_aid_by_oid(detections)
-        ({"oid1": [detection1, detection2], "oid2": [detection3, detection4]}, True)
+        ({"oid1": [detection1, detection2]}, {"oid2": [detection3, detection4]})
         """
+        aids = {}
+        not_cached = []
         for oid in detections:
-            # TODO: improve this query
-            obj = self.db["object"].find_one({"_id": oid})
-            if not obj:
-                return detections, False
-            detections[oid] = list(
-                map(lambda x: {**x, "aid": obj["aid"]}, detections[oid])
-            )
-        return detections
-
-    def get_aid_by_conesearch(self, detections: dict) -> Tuple[List[dict], bool]:
+            aid = self.cache.get(oid)
+            if aid is None:
+                not_cached.append(oid)
+            else:
+                aids[oid] = aid
+        for start in range(0, len(not_cached), self.query_chunk_size):
+            chunk = not_cached[start : start + self.query_chunk_size]
+            wanted = set(chunk)
+            for obj in self.db["object"].find({"oid": {"$in": chunk}}, {"oid": 1}):
+                # other oids of the same object may not be in the message
+                for oid in wanted.intersection(obj["oid"]):
+                    aids[oid] = obj["_id"]
+                    self.cache.put(oid, obj["_id"])
+        found, missing = {}, {}
+        for oid in detections:
+            if oid in aids:
+                found[oid] = list(
+                    map(lambda x: {**x, "aid": aids[oid]}, detections[oid])
+                )
+            else:
+                missing[oid] = detections[oid]
+        return found, missing
+
+    def get_aid_by_conesearch(self, detections: dict) -> Tuple[dict, dict]:
         """Gets alerce id by cone search and assigns each detection that id.
 
-        If an aid is found by cone search, it is assigned to each detection in the message.
-
-        Note: This method modifies the input dictionary in place.
+        If an aid is found by cone search, it is assigned to each detection of that oid. When the
+        actor has a spatial index, all coordinates of the message are resolved in memory at once,
+        otherwise each oid is searched in the database.
 
         Parameters
         ----------
@@ -118,23 +252,34 @@ class SortingHatActor(pykka.ThreadingActor):
 
         Returns
         -------
-        Tuple[List[dict], bool]
-            The modified list and a boolean indicating if the aid was found
+        Tuple[dict, dict]
+            The detections with an aid assigned and the detections without a match
 
         Examples
         --------
         >>> detections = {"oid1": [detection1, detection2], "oid2": [detection3, detection4]}
         >>> get_aid_by_conesearch(detections)
-        ({"oid1": [detection1, detection2], "oid2": [detection3, detection4]}, True)
+        ({"oid1": [detection1, detection2]}, {"oid2": [detection3, detection4]})
         """
-        for oid in detections:
-            aid = self.conesearch_query(
-                self.db, detections[oid][0]["ra"], detections[oid][0]["dec"], 1
-            )
-            if not aid:
-                return detections, False
-            detections[oid] = list(map(lambda x: {**x, "aid": aid}, detections[oid]))
-        return detections, True
+        oids = list(detections)
+        coordinates = [
+            (detections[oid][0]["ra"], detections[oid][0]["dec"]) for oid in oids
+        ]
+        if self.spatial_index is not None:
+            aids = self.spatial_index.query_many(coordinates, self.conesearch_radius)
+        else:
+            aids = [
+                self.conesearch_query(self.db, ra, dec, self.conesearch_radius)
+                for ra, dec in coordinates
+            ]
+        found, missing = {}, {}
+        for oid, aid in zip(oids, aids):
+            if aid is None:
+                missing[oid] = detections[oid]
+                continue
+            self.cache.put(oid, aid)
+            found[oid] = list(map(lambda x: {**x, "aid": aid}, detections[oid]))
+        return found, missing
 
     def conesearch_query(
         self, db: Database, ra: float, dec: float, radius: float
@@ -177,10 +322,10 @@ class SortingHatActor(pykka.ThreadingActor):
                     },
                 },
             },
-            {"aid": 1},
+            {"_id": 1},
         )
         if found:
-            return found["aid"]
+            return found["_id"]
         return None
 
     def new_aid(self, detections: dict) -> Tuple[List[dict], List[dict]]:
@@ -200,16 +345,26 @@ class SortingHatActor(pykka.ThreadingActor):
         --------
         >>> detections = {"oid1": [detection1, detection2], "oid2": [detection3, detection4]}
         >>> new_aid(detections)
-        ({"oid1": [detection1, detection2], "oid2": [detection3, detection4]}, [{"_id": oid1, "aid": 1234567890123456789}, {"_id": oid2, "aid": 1234567890123456789}])
+        ({"oid1": [detection1, detection2], "oid2": [detection3, detection4]}, [{"_id": 1234567890123456789, "oid": [oid1], "meanra": 10.0, ...}, ...])
         """
         new_objects = []
-        for oid in detections:
-            aid = self.id_generator(detections[oid][0]["ra"], detections[oid][0]["dec"])
+        oids = list(detections)
+        ra = np.array([detections[oid][0]["ra"] for oid in oids], dtype=np.float64)
+        dec = np.array([detections[oid][0]["dec"] for oid in oids], dtype=np.float64)
+        aids = self.id_generator_batch(ra, dec).tolist()
+        for oid, aid, r, d in zip(oids, aids, ra.tolist(), dec.tolist()):
+            # new objects are written later, keep them so the next batches find them
+            self.cache.put(oid, aid)
+            if self.spatial_index is not None:
+                self.spatial_index.add(r, d, aid)
             detections[oid] = list(map(lambda x: {**x, "aid": aid}, detections[oid]))
             new_objects.append(
                 {
-                    "_id": oid,
-                    "aid": aid,
+                    "_id": aid,
+                    "oid": [oid],
+                    "meanra": r,
+                    "meandec": d,
+                    "loc": {"type": "Point", "coordinates": [r - 180, d]},
                 }
             )
         return detections, new_objects
@@ -273,3 +428,60 @@ class SortingHatActor(pykka.ThreadingActor):
         aid += dec_f * 100
         # transform to str
         return aid
+
+    def id_generator_batch(self, ra: np.ndarray, dec: np.ndarray) -> np.ndarray:
+        """Vectorized version of :meth:`id_generator` for arrays of coordinates.
+
+        The arithmetic follows :meth:`id_generator` step by step, so each identifier is
+        the same one the scalar method would create for that (ra, dec).
+
+        Parameters
+        ----------
+        ra : np.ndarray
+            Right ascensions in degrees
+        dec : np.ndarray
+            Declinations in degrees
+
+        Returns
+        -------
+        np.ndarray
+            Identifiers of 19 digits as 64 bit integers
+
+        Examples
+        --------
+        >>> id_generator_batch(np.array([0, 10]), np.array([0, -10]))
+        array([1000000001000000000, 1004000000100000000])
+        """
+        ra = np.asarray(ra, dtype=np.float64)
+        dec = np.asarray(dec, dtype=np.float64)
+
+        ra = np.where(ra < 0.0, ra + 360.0, ra)
+        ra = np.where(ra > 360.0, ra - 360.0, ra)
+
+        ra_hh = (ra / 15).astype(np.int64)
+        ra_mm = ((ra / 15 - ra_hh) * 60).astype(np.int64)
+        ra_ss = (((ra / 15 - ra_hh) * 60 - ra_mm) * 60).astype(np.int64)
+        ra_ff = ((((ra / 15 - ra_hh) * 60 - ra_mm) * 60 - ra_ss) * 100).astype(np.int64)
+
+        h = (dec >= 0).astype(np.int64)
+        dec = np.where(dec >= 0, dec, dec * -1)
+
+        dec_deg = dec.astype(np.int64)
+        dec_mm = ((dec - dec_deg) * 60).astype(np.int64)
+        dec_ss = (((dec - dec_deg) * 60 - dec_mm) * 60).astype(np.int64)
+        dec_f = (((((dec - dec_deg) * 60 - dec_mm) * 60) - dec_ss) * 10).astype(
+            np.int64
+        )
+
+        aid = np.full(ra.shape, 1000000000000000000, dtype=np.int64)
+        aid += ra_hh * 10000000000000000
+        aid += ra_mm * 100000000000000
+        aid += ra_ss * 1000000000000
+        aid += ra_ff * 10000000000
+
+        aid += h * 1000000000
+        aid += dec_deg * 10000000
+        aid += dec_mm * 100000
+        aid += dec_ss * 1000
+        aid += dec_f * 100
+        return aid
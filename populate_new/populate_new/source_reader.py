@@ -0,0 +1,354 @@
+import logging
+import time
+from typing import Any, Callable, Iterator, List, Tuple, Union
+import bson
+import pykka
+from pymongo.collection import Collection
+from populate_new.checkpoint import CheckpointTracker
+from populate_new.metrics import MetricsRegistry, stage_metrics
+from populate_new.raw_bson import read_fields
+
+
+def get_detections_cursor(
+    session, collection: Collection, batch_size, lower, upper, after=None, key="_id"
+):
+    """Returns a cursor over a range of the collection sorted by ``key``.
+
+    Ranges of ``_id`` are resumed after their checkpoint. An ``oid`` checkpoint is a
+    position where documents of that ``oid`` may still be unread, so it is included and the
+    documents already written are skipped by the writer as duplicates. Reading by ``oid``
+    requires an index on ``oid`` in the source collection.
+    """
+    query = {}
+    if after is not None:
+        query["$gt" if key == "_id" else "$gte"] = after
+    elif lower is not None:
+        query["$gte"] = lower
+    if upper is not None:
+        query["$lt"] = upper
+    cursor = collection.find(
+        {key: query} if query else {},
+        batch_size=batch_size,
+        session=session,
+        no_cursor_timeout=True,
+        sort=[(key, 1)],
+    ).hint([(key, 1)])
+    return cursor
+
+
+def get_batch_from_db(
+    cursor, batch_size: Union[int, Callable[[], int]], decode=True
+) -> Iterator[list]:
+    """Groups the documents of a cursor in batches of ``batch_size`` documents.
+
+    ``batch_size`` can be a function, called before each batch to get its size.
+    """
+    batch = []
+    size = batch_size() if callable(batch_size) else batch_size
+    for document in cursor:
+        if decode:
+            batch.append(bson.decode(document.raw))
+        else:
+            batch.append(document.raw)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+            size = batch_size() if callable(batch_size) else batch_size
+    if len(batch) > 0:
+        yield batch
+
+
+def compute_split_points(
+    collection: Collection,
+    partitions: int,
+    samples_per_partition: int = 100,
+    key: str = "_id",
+) -> List[Any]:
+    """Samples the ``key`` of the collection to split it in ranges of similar size.
+
+    Parameters
+    ----------
+    collection : Collection
+        The source collection
+    partitions : int
+        Number of ranges to create
+    samples_per_partition : int
+        Number of documents sampled for each range
+    key : str
+        Field the collection is split by
+
+    Returns
+    -------
+    List[Any]
+        Sorted ``key`` values where each range starts. It has at most ``partitions - 1``
+        elements, fewer if the collection is too small to be split
+    """
+    if partitions <= 1:
+        return []
+    sample = collection.aggregate(
+        [
+            {"$sample": {"size": partitions * samples_per_partition}},
+            {"$project": {key: 1}},
+        ]
+    )
+    ids = sorted({document[key] for document in sample})
+    split_points = []
+    for i in range(1, partitions):
+        split = ids[len(ids) * i // partitions] if ids else None
+        if split is not None and split not in split_points:
+            split_points.append(split)
+    return split_points
+
+
+def partition_ranges(split_points: List[Any]) -> List[Tuple[Any, Any]]:
+    """Creates the (lower, upper) bounds of each range from the split points.
+
+    The first range has no lower bound and the last range has no upper bound.
+
+    Examples
+    --------
+    >>> partition_ranges(["b", "d"])
+    [(None, "b"), ("b", "d"), ("d", None)]
+    """
+    bounds = [None] + list(split_points) + [None]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+class PartitionReaderActor(pykka.ThreadingActor):
+    """Actor that reads one ``_id`` or ``oid`` range of the source collection.
+
+    Each reader opens its own session and cursor over its range and sends batches of encoded
+    documents to the next actor of the pipeline, which decodes them, logging its read rate
+    as it goes. When a checkpoint tracker is given, every batch is registered before it is
+    sent and the range is read starting after its last checkpoint. When ``send_complete`` is
+    True, a ``{"type": "complete", "partition": partition}`` message is sent after the last
+    batch.
+
+    A range of ``oid`` is read in ``oid`` order and each batch is followed by a
+    ``{"type": "watermark", "partition": partition, "oid": oid}`` message with the last
+    ``oid`` of the batch, since every document with a lower ``oid`` in the range was sent.
+
+    Parameters
+    ----------
+    partition : int
+        Number of the range, used in logs
+    collection : Collection
+        The source collection
+    lower : Any
+        Inclusive lower bound of the range, None if the range has no lower bound
+    upper : Any
+        Exclusive upper bound of the range, None if the range has no upper bound
+    next_actor : pykka.ActorRef
+        Actor that receives the batches
+    read_batch_size : int
+        Cursor batch size and number of documents of each batch sent
+    log_every : int
+        Number of batches between read rate logs
+    checkpoint : CheckpointTracker, optional
+        Tracker of the written documents
+    limiter : InflightLimiter, optional
+        Credits acquired for each batch before sending it, so the reader blocks while the
+        pipeline is full
+    metrics : MetricsRegistry, optional
+        Registry where the "read" stage is recorded, shared by all the readers
+    send_complete : bool
+        If True, tell the next actor when the range is exhausted
+    key : str
+        Field the range is defined on and read by, ``_id`` or ``oid``
+    autotuner : Autotuner, optional
+        Tuner of the cursor and pipeline batch sizes, both ``read_batch_size`` when not
+        given
+    """
+
+    def __init__(
+        self,
+        partition: int,
+        collection: Collection,
+        lower: Any,
+        upper: Any,
+        next_actor: pykka.ActorRef,
+        read_batch_size: int,
+        log_every: int = 10,
+        checkpoint=None,
+        limiter=None,
+        metrics: MetricsRegistry = None,
+        send_complete: bool = False,
+        key: str = "_id",
+        autotuner=None,
+    ):
+        super().__init__()
+        self.partition = partition
+        self.collection = collection
+        self.lower = lower
+        self.upper = upper
+        self.next_actor = next_actor
+        self.read_batch_size = read_batch_size
+        self.log_every = log_every
+        self.checkpoint = checkpoint
+        self.limiter = limiter
+        self.metrics = stage_metrics(metrics, "read")
+        self.send_complete = send_complete
+        self.key = key
+        self.autotuner = autotuner
+        self.logger = logging.getLogger(f"PartitionReaderActor-{partition}")
+
+    def on_receive(self, message: dict) -> int:
+        if message["type"] != "read":
+            raise ValueError(f"Unknown message {message}")
+        return self.read()
+
+    def read(self) -> int:
+        """Sends every document of the range to the next actor and returns the count"""
+        after = None
+        if self.checkpoint is not None:
+            after = self.checkpoint.checkpoint(self.partition)
+        if after is not None:
+            self.logger.info(
+                f"Resuming range [{self.lower}, {self.upper}) after {after}"
+            )
+        else:
+            self.logger.info(f"Reading range [{self.lower}, {self.upper})")
+        t0 = time.time()
+        counter = 0
+        with self.collection.database.client.start_session() as session:
+            for i, (batch, wait) in enumerate(self.batches(session, after), start=1):
+                # only the time spent waiting for the cursor, not for the pipeline
+                self.metrics.record(len(batch), wait)
+                if self.autotuner is not None:
+                    self.autotuner.cursor.observe(len(batch), wait)
+                watermark = None
+                if self.key == "oid":
+                    watermark = read_fields(batch[-1], ["oid"])["oid"]
+                if self.checkpoint is not None:
+                    self.checkpoint.register_batch(
+                        self.partition,
+                        i,
+                        [read_fields(raw, ["_id"])["_id"] for raw in batch],
+                        watermark,
+                    )
+                if self.limiter is not None:
+                    self.limiter.acquire(len(batch))
+                self.next_actor.tell(batch)
+                if watermark is not None:
+                    self.next_actor.tell(
+                        {
+                            "type": "watermark",
+                            "partition": self.partition,
+                            "oid": watermark,
+                        }
+                    )
+                counter += len(batch)
+                if i % self.log_every == 0:
+                    self.log_rate(counter, time.time() - t0)
+        self.log_rate(counter, time.time() - t0)
+        if self.send_complete:
+            self.next_actor.tell({"type": "complete", "partition": self.partition})
+        self.logger.info(f"Finished range [{self.lower}, {self.upper})")
+        return counter
+
+    def batches(self, session, after: Any) -> Iterator[Tuple[List[bytes], float]]:
+        """Yields the batches of the range with the seconds spent waiting for each one.
+
+        Cursors keep their batch size once they are iterated, so when the tuned cursor batch
+        size changes the cursor of an ``_id`` range is reopened after the last ``_id`` read.
+        """
+        while True:
+            cursor_batch_size = self.cursor_batch_size()
+            cursor = get_detections_cursor(
+                session,
+                self.collection,
+                cursor_batch_size,
+                self.lower,
+                self.upper,
+                after,
+                self.key,
+            )
+            t_batch = time.time()
+            for batch in get_batch_from_db(cursor, self.pipeline_batch_size, False):
+                yield batch, time.time() - t_batch
+                if self.key == "_id" and self.cursor_batch_size() != cursor_batch_size:
+                    after = read_fields(batch[-1], ["_id"])["_id"]
+                    cursor.close()
+                    break
+                t_batch = time.time()
+            else:
+                return
+
+    def cursor_batch_size(self) -> int:
+        if self.autotuner is None:
+            return self.read_batch_size
+        return self.autotuner.cursor.value
+
+    def pipeline_batch_size(self) -> int:
+        if self.autotuner is None:
+            return self.read_batch_size
+        return self.autotuner.pipeline.value
+
+    def log_rate(self, counter: int, elapsed: float):
+        rate = counter / elapsed if elapsed > 0 else 0
+        self.logger.info(
+            f"Partition {self.partition}: read {counter} documents ({rate:.1f} documents/s)"
+        )
+
+
+def create_checkpoint(
+    collection: Collection,
+    partitions: int,
+    checkpoint_file: str,
+    resume: bool,
+    key: str = "_id",
+) -> CheckpointTracker:
+    """Creates the checkpoint tracker of a run, splitting the collection in ranges of
+    ``key``.
+
+    When resuming, the ranges and checkpoints are loaded from the state file instead, which
+    must have been split by the same key.
+    """
+    if resume:
+        checkpoint = CheckpointTracker.load(checkpoint_file)
+        if checkpoint.key != key:
+            raise ValueError(
+                f"{checkpoint_file} has ranges of {checkpoint.key}, can not resume "
+                f"reading by {key}"
+            )
+        if len(checkpoint.split_points) + 1 != partitions:
+            logging.warning(
+                f"Resuming with the {len(checkpoint.split_points) + 1} partitions "
+                f"stored in {checkpoint_file}"
+            )
+        return checkpoint
+    split_points = compute_split_points(collection, partitions, key=key)
+    return CheckpointTracker(checkpoint_file, split_points, key=key)
+
+
+def start_readers(
+    collection: Collection,
+    next_actor: pykka.ActorRef,
+    read_batch_size: int,
+    split_points: List[Any],
+    checkpoint,
+    limiter,
+    metrics: MetricsRegistry = None,
+    send_complete: bool = False,
+    key: str = "_id",
+    autotuner=None,
+) -> List[pykka.ActorRef]:
+    """Starts one reader for each range of the collection"""
+    ranges = partition_ranges(split_points)
+    return [
+        PartitionReaderActor.start(
+            i,
+            collection,
+            lower,
+            upper,
+            next_actor,
+            read_batch_size,
+            checkpoint=checkpoint,
+            limiter=limiter,
+            metrics=metrics,
+            send_complete=send_complete,
+            key=key,
+            autotuner=autotuner,
+        )
+        for i, (lower, upper) in enumerate(ranges)
+    ]
@@ -0,0 +1,161 @@
+import logging
+import math
+import threading
+from typing import Iterable, List, Tuple, Union
+from pymongo.collection import Collection
+
+
+class ConeSearchIndex:
+    """In-memory spatial index used to match coordinates with existing aids.
+
+    The index can be shared by several sorting hat shards, which hold ``lock`` while they
+    search and add objects.
+
+    The sky is split in declination zones of ``cell_size`` degrees and each zone is split in
+    right ascension cells of the same width. A cone search only checks the cells that overlap
+    the search radius and returns the aid of the nearest object within the radius, the same
+    result a ``$nearSphere`` query on the object collection would return.
+
+    Parameters
+    ----------
+    cell_size : float
+        Size of each cell in degrees. It should be larger than the usual search radius
+    """
+
+    def __init__(self, cell_size: float = 1 / 60):
+        self.cell_size = cell_size
+        self.n_ra_cells = math.ceil(360 / cell_size)
+        self.cells = {}
+        self.size = 0
+        self.lock = threading.RLock()
+        self.logger = logging.getLogger("ConeSearchIndex")
+
+    @classmethod
+    def from_collection(
+        cls, collection: Collection, cell_size: float = 1 / 60, batch_size: int = 10000
+    ) -> "ConeSearchIndex":
+        """Builds the index with a projected scan of the object collection.
+
+        Parameters
+        ----------
+        collection : Collection
+            Object collection, where each object has its aid as ``_id`` and a ``loc`` point
+        cell_size : float
+            Size of each cell in degrees
+        batch_size : int
+            Cursor batch size used for the scan
+        """
+        index = cls(cell_size)
+        index.logger.info(f"Building cone search index from {collection.name}")
+        cursor = collection.find({}, {"loc": 1}, batch_size=batch_size).hint(
+            [("_id", 1)]
+        )
+        for obj in cursor:
+            index.add_object(obj)
+        index.logger.info(f"Indexed {index.size} objects")
+        return index
+
+    def add_object(self, obj: dict) -> None:
+        """Adds an object document with a ``loc`` GeoJSON point to the index"""
+        if "loc" not in obj:
+            return
+        lon, dec = obj["loc"]["coordinates"]
+        self.add(lon + 180, dec, obj["_id"])
+
+    def add(self, ra: float, dec: float, aid: Union[int, str]) -> None:
+        """Adds a position with its aid to the index
+
+        Parameters
+        ----------
+        ra : float
+            Right ascension in degrees
+        dec : float
+            Declination in degrees
+        aid : Union[int, str]
+            The alerce id of the object at that position
+        """
+        ra = ra % 360
+        key = (self._zone(dec), self._ra_cell(ra))
+        with self.lock:
+            self.cells.setdefault(key, []).append((ra, dec, aid))
+            self.size += 1
+
+    def query(self, ra: float, dec: float, radius: float) -> Union[int, str, None]:
+        """Returns the aid of the nearest object within the search radius
+
+        Parameters
+        ----------
+        ra : float
+            Right ascension in degrees
+        dec : float
+            Declination in degrees
+        radius : float
+            Search radius in arcseconds
+
+        Returns
+        -------
+        Union[int, str, None]
+            The alerce id if found, None otherwise
+        """
+        ra = ra % 360
+        radius = radius / 3600
+        nearest, min_distance = None, radius
+        for cell in self._cells_around(ra, dec, radius):
+            for obj_ra, obj_dec, aid in self.cells.get(cell, ()):
+                distance = self._distance(ra, dec, obj_ra, obj_dec)
+                if distance <= min_distance:
+                    nearest, min_distance = aid, distance
+        return nearest
+
+    def query_many(
+        self, coordinates: Iterable[Tuple[float, float]], radius: float
+    ) -> List[Union[int, str, None]]:
+        """Runs a cone search for each (ra, dec) pair
+
+        Parameters
+        ----------
+        coordinates : Iterable[Tuple[float, float]]
+            Right ascension and declination pairs in degrees
+        radius : float
+            Search radius in arcseconds
+
+        Returns
+        -------
+        List[Union[int, str, None]]
+            The alerce id found for each pair, or None
+        """
+        with self.lock:
+            return [self.query(ra, dec, radius) for ra, dec in coordinates]
+
+    def __len__(self):
+        return self.size
+
+    def _zone(self, dec: float) -> int:
+        return math.floor((dec + 90) / self.cell_size)
+
+    def _ra_cell(self, ra: float) -> int:
+        return math.floor(ra / self.cell_size) % self.n_ra_cells
+
+    def _cells_around(self, ra: float, dec: float, radius: float):
+        min_dec, max_dec = max(dec - radius, -90), min(dec + radius, 90)
+        max_abs_dec = max(abs(min_dec), abs(max_dec))
+        if max_abs_dec >= 90 or radius / math.cos(math.radians(max_abs_dec)) >= 180:
+            ra_cells = range(self.n_ra_cells)
+        else:
+            half_width = radius / math.cos(math.radians(max_abs_dec))
+            first = math.floor((ra - half_width) / self.cell_size)
+            last = math.floor((ra + half_width) / self.cell_size)
+            ra_cells = {cell % self.n_ra_cells for cell in range(first, last + 1)}
+        for zone in range(self._zone(min_dec), self._zone(max_dec) + 1):
+            for ra_cell in ra_cells:
+                yield zone, ra_cell
+
+    @staticmethod
+    def _distance(ra1: float, dec1: float, ra2: float, dec2: float) -> float:
+        """Angular distance in degrees using the haversine formula"""
+        ra1, dec1, ra2, dec2 = map(math.radians, (ra1, dec1, ra2, dec2))
+        hav = (
+            math.sin((dec2 - dec1) / 2) ** 2
+            + math.cos(dec1) * math.cos(dec2) * math.sin((ra2 - ra1) / 2) ** 2
+        )
+        return math.degrees(2 * math.asin(min(1.0, math.sqrt(hav))))
@@ -0,0 +1,165 @@
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+from typing import Callable, List, Union
+import time
+import bson
+import pykka
+from bson.raw_bson import RawBSONDocument
+from populate_new.metrics import MetricsRegistry, stage_metrics
+
+
+def transform_batch(
+    transform: Callable[[dict], dict], batch: List[Union[bytes, dict]]
+) -> bytes:
+    """Transforms a batch of documents, decoding the ones that are still encoded.
+
+    This function runs in the worker processes of :class:`TransformActor` and returns the
+    transformed documents encoded one after the other.
+    """
+    return b"".join(
+        bson.encode(
+            transform(
+                bson.decode(document) if isinstance(document, bytes) else document
+            )
+        )
+        for document in batch
+    )
+
+
+class TransformActor(pykka.ThreadingActor):
+    """Actor that transforms batches of documents in a pool of worker processes.
+
+    Each message is transformed as a whole by one of the worker processes, so the
+    transformation is not limited by the GIL. Up to ``max_pending`` messages are transformed
+    at the same time and the actor waits for one of them to finish when the window is full.
+    Messages may contain encoded documents, which are decoded in the workers, or already
+    decoded documents.
+
+    The workers return the transformed documents of a message encoded as a single BSON
+    buffer, which is cheap to send back between processes, and ``decode`` turns it into the
+    message for the next actor. Results and control messages are sent to the next actor in
+    the order the messages arrived.
+
+    A message that fails to transform is logged and sent on as an empty message, so the
+    messages after it are not held back. Its credits are released to the ``limiter``. Its
+    documents are never acknowledged to the checkpoint, so a resumed run reads them again.
+
+    Parameters
+    ----------
+    next_actor : pykka.ActorRef
+        Actor that receives the transformed documents
+    num_transformers : int
+        Number of worker processes
+    transform : Callable[[dict], dict]
+        Module level function that transforms a document in a worker
+    metrics : MetricsRegistry, optional
+        Registry where the "transform" stage is recorded, including the decoding of the source
+        documents done in the workers, and the "decode" stage of the results
+    autotuner : Autotuner, optional
+        Tuner whose pipeline batch size is adjusted by the latency of each message
+    max_pending : int, optional
+        Number of messages transformed at the same time, twice the number of workers if not
+        given
+    limiter : InflightLimiter, optional
+        Limiter whose credits are released for the documents of failed messages
+    decode : Callable[[bytes], list]
+        Builds the message for the next actor from the result of a worker
+    """
+
+    def __init__(
+        self,
+        next_actor: pykka.ActorRef,
+        num_transformers: int,
+        transform: Callable[[dict], dict],
+        metrics: MetricsRegistry = None,
+        autotuner=None,
+        max_pending: int = None,
+        limiter=None,
+        decode: Callable[[bytes], list] = bson.decode_all,
+    ):
+        super().__init__()
+        self.next_actor = next_actor
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.num_transformers = num_transformers
+        self.transform = transform
+        self.decode = decode
+        self.metrics = stage_metrics(metrics, "transform")
+        self.decode_metrics = stage_metrics(metrics, "decode")
+        self.autotuner = autotuner
+        self.pool = ProcessPoolExecutor(
+            max_workers=num_transformers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        self.window = threading.Semaphore(max_pending or 2 * num_transformers)
+        # results wait here until every message received before them was sent
+        self.ready = {}
+        self.received = 0
+        self.sent = 0
+        self.lock = threading.Lock()
+        self.limiter = limiter
+        self.failed = 0
+
+    def on_receive(self, message: Union[List[Union[bytes, dict]], dict]) -> None:
+        seq = self.received
+        self.received += 1
+        if isinstance(message, dict):
+            self.forward(seq, message)
+            return
+        self.logger.debug(f"Transforming {len(message)} documents")
+        message = [
+            document.raw if isinstance(document, RawBSONDocument) else document
+            for document in message
+        ]
+        self.window.acquire()
+        future = self.pool.submit(transform_batch, self.transform, message)
+        future.add_done_callback(partial(self.done, seq, len(message), time.time()))
+
+    def done(self, seq: int, documents: int, started: float, future: Future) -> None:
+        self.window.release()
+        try:
+            encoded = future.result()
+        except Exception as e:
+            self.metrics.error()
+            self.fail(seq, documents, e)
+            return
+        decoding = time.time()
+        elapsed = decoding - started
+        self.metrics.record(documents, elapsed)
+        if self.autotuner is not None:
+            self.autotuner.pipeline.observe(documents, elapsed)
+        try:
+            result = self.decode(encoded)
+        except Exception as e:
+            self.decode_metrics.error()
+            self.fail(seq, documents, e)
+            return
+        self.decode_metrics.record(documents, time.time() - decoding)
+        self.forward(seq, result)
+
+    def fail(self, seq: int, documents: int, error: Exception) -> None:
+        """Sends an empty message in place of a failed one, releasing its credits"""
+        self.logger.error(f"Failed to transform {documents} documents: {error}")
+        with self.lock:
+            self.failed += documents
+        if self.limiter is not None:
+            self.limiter.release(documents)
+        self.forward(seq, [])
+
+    def forward(self, seq: int, message) -> None:
+        with self.lock:
+            self.ready[seq] = message
+            while self.sent in self.ready:
+                self.next_actor.tell(self.ready.pop(self.sent))
+                self.sent += 1
+
+    def on_stop(self):
+        # waits for the pending messages, which are sent on by their callbacks
+        self.pool.shutdown()
+        if self.failed:
+            self.logger.error(
+                f"{self.failed} documents failed to transform and were not written, "
+                "resume the migration to read them again"
+            )
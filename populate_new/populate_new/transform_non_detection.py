@@ -1,4 +1,5 @@
-from typing import List
+import pykka
+from populate_new.transform_actor import TransformActor
 
 
 def transform_non_detection(document: dict) -> dict:
@@ -24,3 +25,42 @@ def transform_non_detection(document: dict) -> dict:
         "extra_fields": document["extra_fields"],
     }
     return new_non_detection
+
+
+class TransformNonDetectionActor(TransformActor):
+    """Actor to transform non detections before sending them to the operation actor.
+
+    Parameters
+    ----------
+    operation_actor : pykka.ActorRef
+        Actor that receives the transformed non detections
+    num_transformers : int
+        Number of worker processes
+    metrics : MetricsRegistry, optional
+        Registry where the "transform" stage is recorded
+    autotuner : Autotuner, optional
+        Tuner of the pipeline batch size
+    max_pending : int, optional
+        Number of messages transformed at the same time
+    limiter : InflightLimiter, optional
+        Limiter whose credits are released for the documents of failed messages
+    """
+
+    def __init__(
+        self,
+        operation_actor: pykka.ActorRef,
+        num_transformers: int,
+        metrics=None,
+        autotuner=None,
+        max_pending: int = None,
+        limiter=None,
+    ):
+        super().__init__(
+            operation_actor,
+            num_transformers,
+            transform_non_detection,
+            metrics,
+            autotuner,
+            max_pending,
+            limiter,
+        )
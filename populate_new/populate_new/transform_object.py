@@ -1,4 +1,6 @@
 from typing import List
+import pykka
+from populate_new.transform_actor import TransformActor
 
 
 def get_sid(tids: List[str]):
@@ -31,3 +33,42 @@ def transform_object(document: dict):
     }
 
     return transformed_object
+
+
+class TransformObjectActor(TransformActor):
+    """Actor to transform objects before sending them to the operation actor.
+
+    Parameters
+    ----------
+    operation_actor : pykka.ActorRef
+        Actor that receives the transformed objects
+    num_transformers : int
+        Number of worker processes
+    metrics : MetricsRegistry, optional
+        Registry where the "transform" stage is recorded
+    autotuner : Autotuner, optional
+        Tuner of the pipeline batch size
+    max_pending : int, optional
+        Number of messages transformed at the same time
+    limiter : InflightLimiter, optional
+        Limiter whose credits are released for the documents of failed messages
+    """
+
+    def __init__(
+        self,
+        operation_actor: pykka.ActorRef,
+        num_transformers: int,
+        metrics=None,
+        autotuner=None,
+        max_pending: int = None,
+        limiter=None,
+    ):
+        super().__init__(
+            operation_actor,
+            num_transformers,
+            transform_object,
+            metrics,
+            autotuner,
+            max_pending,
+            limiter,
+        )
@@ -0,0 +1,68 @@
+from populate_new.autotune import Autotuner, BatchSizeTuner
+from populate_new.memory_db import MemoryCollection, MemoryDatabase
+from populate_new.source_reader import PartitionReaderActor, get_batch_from_db
+from unittest import mock
+import bson
+
+
+def test_size_grows_while_throughput_improves():
+    tuner = BatchSizeTuner("write", 100, 10, 1000, window=1, factor=2)
+    tuner.observe(100, 1)
+    assert tuner.value == 200
+    tuner.observe(200, 1)
+    assert tuner.value == 400
+    # the throughput dropped, so the search turns around
+    tuner.observe(100, 1)
+    assert tuner.value == 200
+    assert [value for _, value, _ in tuner.history] == [100, 200, 400, 200]
+
+
+def test_size_shrinks_when_batches_are_slow():
+    tuner = BatchSizeTuner("write", 100, 10, 1000, window=2, factor=2, max_latency=1)
+    tuner.observe(100, 2)
+    assert tuner.value == 100
+    tuner.observe(100, 2)
+    assert tuner.value == 50
+
+
+def test_size_stays_within_bounds():
+    tuner = BatchSizeTuner("cursor", 5000, 10, 1000, window=1, factor=2)
+    assert tuner.value == 1000
+    tuner.observe(1000, 1)
+    assert tuner.value == 1000
+    tuner.observe(1000, 1)
+    assert tuner.value == 500
+
+
+def test_default_bounds():
+    autotuner = Autotuner(2000, 500)
+    assert (autotuner.cursor.minimum, autotuner.cursor.maximum) == (200, 20000)
+    autotuner = Autotuner(2000, 500, {"write": (100, 200)})
+    assert autotuner.values() == {"cursor": 2000, "pipeline": 2000, "write": 200}
+
+
+def test_batches_follow_the_batch_size():
+    sizes = iter([2, 3, 10])
+    cursor = [mock.Mock(raw=bytes([i])) for i in range(10)]
+    batches = list(get_batch_from_db(cursor, lambda: next(sizes), decode=False))
+    assert [len(batch) for batch in batches] == [2, 3, 5]
+
+
+def test_reader_reopens_the_cursor_when_its_size_changes():
+    collection = MemoryCollection(MemoryDatabase(), "detection", ("_id",))
+    collection.insert_many([{"_id": i} for i in range(10)])
+    autotuner = Autotuner(3, 3, window=1)
+    next_actor = mock.Mock()
+    reader = PartitionReaderActor.start(
+        0, collection, None, None, next_actor, 3, autotuner=autotuner
+    )
+    with mock.patch.object(collection, "find", wraps=collection.find) as find:
+        assert reader.ask({"type": "read"}) == 10
+    reader.stop()
+    assert find.call_count > 1
+    ids = [
+        bson.decode(raw)["_id"]
+        for call in next_actor.tell.call_args_list
+        for raw in call.args[0]
+    ]
+    assert ids == list(range(10))
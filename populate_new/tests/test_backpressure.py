@@ -0,0 +1,56 @@
+from populate_new.backpressure import InflightLimiter, QueueDepthMonitor
+from unittest import mock
+import threading
+
+
+def test_acquire_blocks_until_release():
+    limiter = InflightLimiter(10)
+    limiter.acquire(8)
+    acquired = threading.Event()
+    thread = threading.Thread(target=lambda: (limiter.acquire(5), acquired.set()))
+    thread.start()
+    assert not acquired.wait(0.2)
+    limiter.release(8)
+    assert acquired.wait(1)
+    thread.join()
+    assert limiter.inflight == 5
+
+
+def test_batch_larger_than_limit_passes_when_empty():
+    limiter = InflightLimiter(10)
+    limiter.acquire(20)
+    assert limiter.inflight == 20
+
+
+def test_queue_depth_monitor_reads_inboxes():
+    actor_ref = mock.Mock()
+    actor_ref.actor_inbox.qsize.return_value = 3
+    monitor = QueueDepthMonitor({"write": actor_ref})
+    assert monitor.depths() == {"write": 3}
+
+
+def test_acquire_keeps_blocking_without_stall_timeout():
+    limiter = InflightLimiter(10)
+    limiter.acquire(8)
+    acquired = threading.Event()
+    thread = threading.Thread(target=lambda: (limiter.acquire(5), acquired.set()))
+    thread.start()
+    assert not acquired.wait(1.5)
+    limiter.release(8)
+    assert acquired.wait(2)
+    thread.join()
+
+
+def test_stall_timeout_restarts_after_each_escape():
+    limiter = InflightLimiter(10, stall_timeout=0.5)
+    limiter.acquire(8)
+    limiter.acquire(5)
+    assert limiter.escapes == 1
+    # the clock restarted with the first escape, so the next batch waits again
+    acquired = threading.Event()
+    thread = threading.Thread(target=lambda: (limiter.acquire(5), acquired.set()))
+    thread.start()
+    assert not acquired.wait(0.3)
+    assert acquired.wait(3)
+    thread.join()
+    assert limiter.escapes == 2
@@ -0,0 +1,14 @@
+from benchmarks.benchmark import STAGES, generate_dataset, run_benchmarks
+
+
+def test_datasets_are_seeded():
+    assert generate_dataset(50, 1) == generate_dataset(50, 1)
+    assert len(generate_dataset(50, 1)) == 50
+
+
+def test_every_stage_processes_the_dataset():
+    results = run_benchmarks([300], transformers=1, trace_memory=False)
+    assert [r["stage"] for r in results["results"]] == STAGES
+    assert all(r["documents"] == 300 for r in results["results"])
+    end_to_end = results["results"][-1]["stage_metrics"]
+    assert end_to_end["write"]["documents"] == 300
@@ -0,0 +1,34 @@
+from populate_new.checkpoint import CheckpointTracker
+
+
+def test_checkpoint_moves_only_after_previous_batches(tmp_path):
+    path = str(tmp_path / "state.json")
+    checkpoint = CheckpointTracker(path, ["c"])
+    checkpoint.register_batch(0, 1, ["a1", "a2"])
+    checkpoint.register_batch(0, 2, ["a3", "a4"])
+    checkpoint.acknowledge(["a3", "a4", "a1"])
+    assert checkpoint.checkpoint(0) is None
+    checkpoint.acknowledge(["a2"])
+    assert checkpoint.checkpoint(0) == "a4"
+    assert checkpoint.checkpoint(1) is None
+
+
+def test_checkpoint_is_saved_and_loaded(tmp_path):
+    path = str(tmp_path / "state.json")
+    checkpoint = CheckpointTracker(path, ["c"])
+    checkpoint.register_batch(1, 1, ["c1", "c2"])
+    checkpoint.acknowledge(["c1", "c2", "unknown"])
+    loaded = CheckpointTracker.load(path)
+    assert loaded.split_points == ["c"]
+    assert loaded.checkpoint(1) == "c2"
+    assert loaded.checkpoint(0) is None
+
+
+def test_oid_checkpoint_is_the_batch_position(tmp_path):
+    path = str(tmp_path / "state.json")
+    checkpoint = CheckpointTracker(path, ["oid5"], key="oid")
+    checkpoint.register_batch(0, 1, ["c9", "c1"], "oid3")
+    checkpoint.acknowledge(["c1", "c9"])
+    loaded = CheckpointTracker.load(path)
+    assert loaded.key == "oid"
+    assert loaded.checkpoint(0) == "oid3"
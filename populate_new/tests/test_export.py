@@ -0,0 +1,98 @@
+from populate_new.export import ExportDatabase, FileStream
+from pymongo import InsertOne, UpdateOne
+import bson
+import gzip
+import hashlib
+import json
+import os
+import threading
+import pytest
+
+
+def read_part(directory, entry):
+    path = os.path.join(directory, entry["path"])
+    with open(path, "rb") as f:
+        data = f.read()
+    assert hashlib.sha256(data).hexdigest() == entry["sha256"]
+    assert len(data) == entry["bytes"]
+    return bson.decode_all(gzip.decompress(data))
+
+
+def test_bson_parts_are_rotated_with_a_manifest(tmp_path):
+    export = ExportDatabase(str(tmp_path), "new_db", max_documents=2)
+    export["detection"].bulk_write(
+        [InsertOne({"candid": i, "oid": "oid1"}) for i in range(5)]
+    )
+    manifest = export.close()
+    assert manifest["collections"] == {"detection": 5}
+    assert [f["path"] for f in manifest["files"]] == [
+        os.path.join(f"part-000-0000{i}", "new_db", "detection.bson.gz")
+        for i in range(1, 4)
+    ]
+    documents = [d for f in manifest["files"] for d in read_part(str(tmp_path), f)]
+    assert [d["candid"] for d in documents] == list(range(5))
+    with open(tmp_path / "manifest.json") as f:
+        assert json.load(f) == manifest
+
+
+def test_each_writer_thread_has_its_own_stream(tmp_path):
+    export = ExportDatabase(str(tmp_path), "new_db")
+
+    def write(start):
+        export["non_detection"].bulk_write(
+            [InsertOne({"_id": i}) for i in range(start, start + 3)]
+        )
+
+    threads = [threading.Thread(target=write, args=(i * 3,)) for i in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    manifest = export.close()
+    assert len(manifest["files"]) == 2
+    assert manifest["collections"] == {"non_detection": 6}
+
+
+def test_exported_objects_are_found_by_oid(tmp_path):
+    export = ExportDatabase(str(tmp_path), "new_db")
+    export["object"].bulk_write(
+        [
+            UpdateOne(
+                {"_id": "aid1"},
+                {"$set": {"oid": ["oid1", "oid2"]}},
+                upsert=True,
+            ),
+            UpdateOne(
+                {"_id": "aid2"},
+                {"$addToSet": {"oid": {"$each": ["oid3"]}}},
+                upsert=True,
+            ),
+        ]
+    )
+    found = export["object"].find(
+        {"oid": {"$in": ["oid2", "oid3", "oid4"]}}, {"oid": 1}
+    )
+    assert list(found) == [
+        {"_id": "aid1", "oid": ["oid2"]},
+        {"_id": "aid2", "oid": ["oid3"]},
+    ]
+    manifest = export.close()
+    documents = read_part(str(tmp_path), manifest["files"][0])
+    assert documents == [
+        {"_id": "aid1", "oid": ["oid1", "oid2"]},
+        {"_id": "aid2", "oid": ["oid3"]},
+    ]
+
+
+def test_parquet_export(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    export = ExportDatabase(str(tmp_path), "new_db", format="parquet")
+    export["detection"].bulk_write([InsertOne({"candid": 1, "extra_fields": {"a": 1}})])
+    manifest = export.close()
+    table = pq.read_table(os.path.join(str(tmp_path), manifest["files"][0]["path"]))
+    assert table.to_pylist() == [{"candid": 1, "extra_fields": '{"a": 1}'}]
+
+
+def test_file_stream_needs_a_file_format(tmp_path):
+    with pytest.raises(TypeError):
+        FileStream(str(tmp_path), "new_db", "object", 0, 10)
@@ -0,0 +1,101 @@
+from populate_new.backpressure import InflightLimiter
+from populate_new.group_detection import GroupDetectionActor
+from populate_new.sorting_hat import shard_of
+from unittest import mock
+import time
+
+
+def make_detections(oids):
+    return [{"oid": oid, "candid": i} for i, oid in enumerate(oids)]
+
+
+def test_groups_are_split_by_shard():
+    shards = [mock.Mock() for _ in range(3)]
+    grouper = GroupDetectionActor.start(shards, 6)
+    grouper.ask(make_detections([f"oid{i}" for i in range(6)]))
+    grouper.stop()
+    for i, shard in enumerate(shards):
+        for call in shard.tell.call_args_list:
+            assert all(shard_of(oid, 3) == i for oid in call.args[0])
+    sent = [oid for s in shards for c in s.tell.call_args_list for oid in c.args[0]]
+    assert sorted(sent) == [f"oid{i}" for i in range(6)]
+
+
+def test_flushes_when_a_message_overshoots_the_size():
+    sorting_hat = mock.Mock()
+    grouper = GroupDetectionActor.start(sorting_hat, 4)
+    grouper.ask(make_detections(["oid1", "oid2", "oid1"]))
+    sorting_hat.tell.assert_not_called()
+    grouper.ask(make_detections(["oid3", "oid3", "oid3"]))
+    sent = sorting_hat.tell.call_args.args[0]
+    assert sum(len(detections) for detections in sent.values()) == 4
+    grouper.stop()
+    assert sorting_hat.tell.call_count == 2
+
+
+def test_flushes_by_time():
+    sorting_hat = mock.Mock()
+    grouper = GroupDetectionActor.start(sorting_hat, 100, flush_interval=0.1)
+    grouper.ask(make_detections(["oid1"]))
+    time.sleep(0.5)
+    sorting_hat.tell.assert_called_once()
+    grouper.stop()
+    sorting_hat.tell.assert_called_once()
+
+
+def test_complete_groups_are_held_until_every_range_is_read():
+    sorting_hat = mock.Mock()
+    grouper = GroupDetectionActor.start(
+        sorting_hat, 2, complete_groups=True, partitions=2
+    )
+    grouper.ask(make_detections(["oid1", "oid2", "oid1"]))
+    grouper.ask({"type": "complete", "partition": 0})
+    grouper.ask(make_detections(["oid2", "oid1"]))
+    sorting_hat.tell.assert_not_called()
+    grouper.ask({"type": "complete", "partition": 1})
+    messages = [call.args[0] for call in sorting_hat.tell.call_args_list]
+    assert [list(message) for message in messages] == [["oid1"], ["oid2"]]
+    assert len(messages[0]["oid1"]) == 3
+    grouper.stop()
+    assert sorting_hat.tell.call_count == 2
+
+
+def test_watermarks_release_the_groups_of_their_range():
+    sorting_hat = mock.Mock()
+    grouper = GroupDetectionActor.start(
+        sorting_hat, 1, complete_groups=True, split_points=["oid5"]
+    )
+    grouper.ask(make_detections(["oid1", "oid1", "oid2", "oid6"]))
+    grouper.ask({"type": "watermark", "partition": 0, "oid": "oid2"})
+    grouper.ask({"type": "watermark", "partition": 1, "oid": "oid6"})
+    messages = [call.args[0] for call in sorting_hat.tell.call_args_list]
+    assert [list(message) for message in messages] == [["oid1"]]
+    assert len(messages[0]["oid1"]) == 2
+    grouper.ask(make_detections(["oid2", "oid3"]))
+    grouper.ask({"type": "complete", "partition": 0})
+    grouper.ask({"type": "complete", "partition": 1})
+    messages = [call.args[0] for call in sorting_hat.tell.call_args_list]
+    assert [list(message) for message in messages] == [
+        ["oid1"],
+        ["oid2"],
+        ["oid3"],
+        ["oid6"],
+    ]
+    assert len(messages[1]["oid2"]) == 2
+    grouper.stop()
+
+
+def test_held_detections_do_not_use_the_credits_of_the_readers():
+    sorting_hat = mock.Mock()
+    limiter = InflightLimiter(2)
+    grouper = GroupDetectionActor.start(
+        sorting_hat, 1, complete_groups=True, split_points=[], limiter=limiter
+    )
+    # more detections of a single oid than the limit
+    for _ in range(3):
+        limiter.acquire(2)
+        grouper.ask(make_detections(["oid1", "oid1"]))
+    assert limiter.inflight == 0
+    grouper.ask({"type": "watermark", "partition": 0, "oid": "oid2"})
+    assert limiter.inflight == 6
+    grouper.stop()
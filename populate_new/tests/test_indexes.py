@@ -0,0 +1,63 @@
+from populate_new.dbconn import create_indexes
+from populate_new.indexes import (
+    build_deferred_indexes,
+    model_indexes,
+    needed_during_load,
+    split_indexes,
+)
+from collections import defaultdict
+from unittest import mock
+
+
+def mock_db():
+    db = mock.MagicMock()
+    collections = defaultdict(mock.MagicMock)
+    db.__getitem__.side_effect = collections.__getitem__
+    db.client.admin.aggregate.return_value = []
+    return db
+
+
+def index_names(models):
+    return sorted(index.document["name"] for index in models)
+
+
+def created_names(db, collection):
+    return sorted(
+        name
+        for call in db[collection].create_indexes.call_args_list
+        for name in index_names(call.args[0])
+    )
+
+
+def test_split_keeps_unique_and_geospatial_indexes_during_load():
+    before, after = split_indexes(model_indexes(), ["object", "detection"])
+    assert index_names(before["object"]) == ["oid", "radec"]
+    assert all(needed_during_load(index) for index in before["detection"])
+    assert len(before["detection"]) == 1
+    assert index_names(after["object"]) == [
+        "aid_sid",
+        "features",
+        "firstmjd",
+        "lastmjd",
+        "probabilities",
+    ]
+    # collections that are not deferred get every index before the load
+    assert before["non_detection"] == model_indexes()["non_detection"]
+    assert "non_detection" not in after
+
+
+def test_create_indexes_leaves_out_deferred_indexes():
+    db = mock_db()
+    create_indexes(db, ("object",))
+    assert created_names(db, "object") == ["oid", "radec"]
+    assert created_names(db, "non_detection") == ["aid_sid", "unique"]
+
+
+def test_build_deferred_indexes_in_one_pass_per_collection():
+    db = mock_db()
+    seconds = build_deferred_indexes(db, ["object", "non_detection"], interval=0.01)
+    assert set(seconds) == {"object", "non_detection"}
+    assert db["object"].create_indexes.call_count == 1
+    assert "radec" not in created_names(db, "object")
+    assert "oid" not in created_names(db, "object")
+    assert created_names(db, "non_detection") == ["aid_sid"]
@@ -0,0 +1,37 @@
+from populate_new.memory_db import UNIQUE_KEYS, MemoryDatabase
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+import pytest
+
+
+def test_bulk_write_reports_duplicates():
+    db = MemoryDatabase(UNIQUE_KEYS)
+    db["detection"].bulk_write([InsertOne({"oid": "oid1", "candid": 1})])
+    with pytest.raises(BulkWriteError) as error:
+        db["detection"].bulk_write(
+            [
+                InsertOne({"oid": "oid1", "candid": 2}),
+                InsertOne({"oid": "oid1", "candid": 1}),
+            ],
+            ordered=False,
+        )
+    assert error.value.details["nInserted"] == 1
+    assert [e["index"] for e in error.value.details["writeErrors"]] == [1]
+    assert db["detection"].count_documents({}) == 2
+
+
+def test_upserts_and_finds():
+    db = MemoryDatabase()
+    db["object"].bulk_write(
+        [UpdateOne({"_id": "aid1"}, {"$setOnInsert": {"ndet": 1}}, upsert=True)]
+    )
+    db["object"].bulk_write(
+        [
+            UpdateOne({"_id": "aid1"}, {"$setOnInsert": {"ndet": 5}}, upsert=True),
+            UpdateOne({"_id": "aid2"}, {"$set": {"ndet": 2}}, upsert=True),
+        ]
+    )
+    found = db["object"].find({"_id": {"$in": ["aid1", "aid2", "aid3"]}})
+    assert {d["_id"]: d["ndet"] for d in found} == {"aid1": 1, "aid2": 2}
+    in_range = db["object"].find({"_id": {"$gt": "aid1"}}, sort=[("_id", 1)])
+    assert [d["_id"] for d in in_range.hint([("_id", 1)])] == ["aid2"]
@@ -0,0 +1,50 @@
+from populate_new.metrics import Histogram, MetricsExporter, MetricsRegistry
+from populate_new.mongo_writer import MongoWriterActor
+from pymongo import InsertOne
+from unittest import mock
+import json
+
+
+def test_histogram_is_cumulative():
+    histogram = Histogram([0.1, 1])
+    for value in [0.05, 0.1, 0.5, 2]:
+        histogram.observe(value)
+    assert histogram.cumulative() == {"0.1": 2, "1": 3, "+Inf": 4}
+    assert histogram.count == 4
+
+
+def test_prometheus_text():
+    metrics = MetricsRegistry()
+    metrics.stage("write").record(10, 0.2)
+    metrics.stage("write").error(2)
+    metrics.set_inbox_depths({"write": 3})
+    text = metrics.to_prometheus()
+    assert 'migration_documents_total{stage="write"} 10' in text
+    assert 'migration_errors_total{stage="write"} 2' in text
+    assert 'migration_batch_latency_seconds_bucket{stage="write",le="+Inf"} 1' in text
+    assert 'migration_inbox_depth{actor="write"} 3' in text
+
+
+def test_exporter_writes_files(tmp_path):
+    metrics = MetricsRegistry()
+    metrics.stage("read").record(5, 0.01)
+    exporter = MetricsExporter(
+        metrics, {}, str(tmp_path / "m.jsonl"), str(tmp_path / "m.prom")
+    )
+    exporter.export()
+    exporter.export()
+    lines = (tmp_path / "m.jsonl").read_text().splitlines()
+    assert len(lines) == 2
+    assert json.loads(lines[0])["stages"]["read"]["documents"] == 5
+    assert "migration_documents_total" in (tmp_path / "m.prom").read_text()
+
+
+def test_dry_run_writer_stops_without_timings():
+    metrics = MetricsRegistry()
+    writer = MongoWriterActor.start(mock.MagicMock(), 10, True, metrics=metrics)
+    writer.stop()
+    assert metrics.snapshot()["stages"]["write"]["average_latency"] == 0
+    writer = MongoWriterActor.start(mock.MagicMock(), 10, True, metrics=metrics)
+    writer.ask({(1, "oid"): InsertOne({"candid": 1})})
+    writer.stop()
+    assert metrics.stage("write").documents == 1
@@ -0,0 +1,97 @@
+from populate_new.mongo_object import (
+    MongoObjectMigrationActor,
+    MongoObjectWriterActor,
+)
+from populate_new.memory_db import MemoryDatabase
+from populate_new.sorting_hat import OidCache, SortingHatActor
+from populate_new.spatial_index import ConeSearchIndex
+from populate_new.transform_actor import transform_batch
+from populate_new.transform_object import transform_object
+from .utils import generate_objects
+from pymongo.errors import BulkWriteError
+from unittest import mock
+import bson
+import time
+
+
+def test_flushes_by_size():
+    db = mock.MagicMock()
+    writer = MongoObjectWriterActor.start(db, 2)
+    writer.ask([{"_id": 1, "oid": ["oid1"], "meanra": 10.0}])
+    db["object"].bulk_write.assert_not_called()
+    writer.ask([{"_id": 2, "oid": ["oid2"], "meanra": 20.0}])
+    operations = db["object"].bulk_write.call_args.args[0]
+    assert [operation._filter for operation in operations] == [{"_id": 1}, {"_id": 2}]
+    assert operations[0]._doc == {
+        "$setOnInsert": {"meanra": 10.0},
+        "$addToSet": {"oid": {"$each": ["oid1"]}},
+    }
+    writer.stop()
+
+
+def test_retries_upserts_that_lost_a_concurrent_insert():
+    db = mock.MagicMock()
+    duplicate = BulkWriteError(
+        {"writeErrors": [{"index": 1, "code": 11000}], "nUpserted": 1}
+    )
+    db["object"].bulk_write.side_effect = [duplicate, None]
+    writer = MongoObjectWriterActor.start(db, 2)
+    writer.ask([{"_id": 1, "oid": ["oid1"]}, {"_id": 2, "oid": ["oid2"]}])
+    writer.stop()
+    first, retry = [c.args[0] for c in db["object"].bulk_write.call_args_list]
+    assert retry == [first[1]]
+
+
+def test_new_objects_are_found_by_position_in_later_runs():
+    db = MemoryDatabase()
+    sorting_hat = SortingHatActor(mock.Mock(), mock.Mock(), db)
+    _, objects = sorting_hat.new_aid({"oid1": [{"ra": 10.0, "dec": -10.0}]})
+    writer = MongoObjectWriterActor.start(db, 1)
+    writer.ask(objects)
+    writer.stop()
+    spatial_index = ConeSearchIndex.from_collection(db["object"])
+    assert spatial_index.query(10.0, -10.0, 1) == objects[0]["_id"]
+
+
+def test_new_objects_with_the_same_aid_are_merged():
+    db = MemoryDatabase()
+    db["object"].insert_many([{"_id": 1, "oid": ["oid1"]}])
+    writer = MongoObjectWriterActor.start(db, 3)
+    writer.ask([{"_id": 1, "oid": ["oid2"]}, {"_id": 3, "oid": ["oid3"]}])
+    writer.ask([{"_id": 3, "oid": ["oid4"]}])
+    writer.stop()
+    found = db["object"].find({"oid": {"$in": ["oid2", "oid4"]}})
+    assert sorted((obj["_id"], obj["oid"]) for obj in found) == [
+        (1, ["oid1", "oid2"]),
+        (3, ["oid3", "oid4"]),
+    ]
+
+
+def test_flushes_by_time():
+    db = mock.MagicMock()
+    writer = MongoObjectWriterActor.start(db, 100, flush_interval=0.1)
+    writer.ask([{"_id": 1, "oid": ["oid1"]}])
+    time.sleep(0.5)
+    db["object"].bulk_write.assert_called_once()
+    writer.stop()
+
+
+def test_migration_warms_cache_and_index():
+    objects = list(generate_objects(3))
+    transformed = bson.decode_all(
+        transform_batch(transform_object, [bson.encode(objects[0])] + objects[1:])
+    )
+    writer = mock.MagicMock()
+    cache = OidCache(100)
+    spatial_index = ConeSearchIndex()
+    actor = MongoObjectMigrationActor.start(writer, 2, cache, spatial_index)
+    actor.ask(transformed)
+    actor.stop()
+    operations = {}
+    for call in writer.tell.call_args_list:
+        operations.update(call.args[0])
+    assert sorted(operations) == [("aid0",), ("aid1",), ("aid2",)]
+    assert "_id" not in operations[("aid0",)]._doc["$set"]
+    assert cache.get(objects[2]["oid"][0]) == "aid2"
+    ra, dec = objects[1]["meanra"], objects[1]["meandec"]
+    assert spatial_index.query(ra, dec, 1) == "aid1"
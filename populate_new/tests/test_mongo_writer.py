@@ -0,0 +1,89 @@
+from populate_new.mongo_writer import MongoWriterActor
+from populate_new.mongo_detection import MongoDetectionWriterActor
+from pymongo import InsertOne
+from pymongo.errors import BulkWriteError
+from unittest import mock
+import threading
+
+
+def make_operations(start, end):
+    return {
+        (candid, "oid"): InsertOne({"candid": candid, "oid": "oid"})
+        for candid in range(start, end)
+    }
+
+
+def test_writes_are_concurrent():
+    db = mock.MagicMock()
+    release = threading.Event()
+    in_flight = threading.Semaphore(0)
+
+    def bulk_write(operations, ordered):
+        in_flight.release()
+        release.wait(5)
+
+    db["detection"].bulk_write.side_effect = bulk_write
+    writer = MongoWriterActor.start(db, 10, max_concurrent_writes=2)
+    writer.tell(make_operations(0, 10))
+    writer.tell(make_operations(10, 20))
+    assert in_flight.acquire(timeout=1)
+    assert in_flight.acquire(timeout=1)
+    release.set()
+    writer.stop()
+    assert db["detection"].bulk_write.call_count == 2
+
+
+def bulk_write_error(codes, n_inserted):
+    return BulkWriteError(
+        {
+            "writeErrors": [
+                {"index": index, "code": code} for index, code in codes.items()
+            ],
+            "nInserted": n_inserted,
+        }
+    )
+
+
+def test_duplicates_are_not_sent_again():
+    db = mock.MagicMock()
+    db["detection"].bulk_write.side_effect = bulk_write_error({0: 11000, 2: 11000}, 1)
+    checkpoint = mock.Mock()
+    writer = MongoWriterActor.start(db, 10, checkpoint=checkpoint)
+    writer.tell(make_operations(0, 3))
+    writer.stop()
+    assert db["detection"].bulk_write.call_count == 1
+    checkpoint.acknowledge.assert_called_once_with([0, 1, 2])
+
+
+def test_transient_errors_are_retried():
+    db = mock.MagicMock()
+    db["detection"].bulk_write.side_effect = [
+        bulk_write_error({1: 91, 2: 121}, 1),
+        None,
+    ]
+    checkpoint = mock.Mock()
+    writer = MongoWriterActor(db, 10, checkpoint=checkpoint, retry_backoff=0)
+    writer.write(make_operations(0, 3))
+    retried = db["detection"].bulk_write.call_args_list[1].args[0]
+    assert [operation._doc["candid"] for operation in retried] == [1]
+    assert writer.write_counts == {
+        "inserted": 2,
+        "duplicates": 0,
+        "retried": 1,
+        "failed": 1,
+    }
+    assert checkpoint.acknowledge.call_args_list == [mock.call([0]), mock.call([1])]
+
+
+def test_operation_buffer_sends_partial_batch_by_age():
+    writer = mock.Mock()
+    sent = threading.Event()
+    writer.tell.side_effect = lambda operations: sent.set()
+    actor = MongoDetectionWriterActor.start(writer, 10, flush_interval=0.1)
+    actor.tell([{"candid": 1, "oid": "oid1"}, {"candid": 2, "oid": "oid1"}])
+    assert sent.wait(2)
+    actor.stop()
+    (operations,), _ = writer.tell.call_args_list[0]
+    assert set(operations) == {(1, "oid1"), (2, "oid1")}
+    # nothing is left to send when the actor stops
+    assert writer.tell.call_count == 1
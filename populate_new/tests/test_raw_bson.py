@@ -0,0 +1,36 @@
+from populate_new.raw_bson import encode_document, iter_elements, read_fields
+from bson import ObjectId, Regex, Binary, Int64
+from datetime import datetime, timezone
+import bson
+
+DOCUMENT = {
+    "_id": ObjectId(),
+    "double": 1.5,
+    "string": "ñandú",
+    "document": {"a": [1, 2]},
+    "binary": Binary(b"\x00\x01"),
+    "bool": True,
+    "date": datetime(2020, 1, 1, tzinfo=timezone.utc),
+    "null": None,
+    "regex": Regex("^a", "i"),
+    "int": 1,
+    "long": Int64(2**40),
+}
+
+
+def test_iter_elements_rebuilds_document():
+    raw = bson.encode(DOCUMENT)
+    elements = [
+        bytes([element_type]) + key.encode() + b"\x00" + value
+        for key, element_type, value in iter_elements(raw)
+    ]
+    assert encode_document(elements) == raw
+
+
+def test_read_fields():
+    raw = bson.encode(DOCUMENT)
+    assert read_fields(raw, ["_id", "long", "regex"]) == {
+        "_id": DOCUMENT["_id"],
+        "long": 2**40,
+        "regex": DOCUMENT["regex"],
+    }
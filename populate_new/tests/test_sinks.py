@@ -0,0 +1,42 @@
+from populate_new.backpressure import InflightLimiter
+from populate_new.memory_db import MemoryCollection, MemoryDatabase
+from populate_new.metrics import MetricsRegistry
+from populate_new.sinks import DiscardActor, start_discard_actors
+from populate_new.source_reader import start_readers
+from unittest import mock
+
+
+def test_discard_releases_credits():
+    limiter = InflightLimiter(10)
+    limiter.acquire(3)
+    discard = DiscardActor.start(limiter)
+    discard.ask([{"_id": 1}, {"_id": 2}, {"_id": 3}])
+    discard.ask({"type": "complete", "partition": 0})
+    assert discard.proxy().documents.get() == 3
+    assert limiter.inflight == 0
+    discard.stop()
+
+
+def test_read_sink_records_read_throughput():
+    collection = MemoryCollection(MemoryDatabase(), "detection", ("_id",))
+    collection.insert_many([{"_id": i} for i in range(5)])
+    metrics = MetricsRegistry()
+    start_transform = mock.Mock()
+    actors, first_actor = start_discard_actors("read", start_transform, None, metrics)
+    start_transform.assert_not_called()
+    assert list(actors) == ["discard"]
+    (reader,) = start_readers(collection, first_actor, 100, [], None, None, metrics)
+    assert reader.ask({"type": "read"}) == 5
+    reader.stop()
+    actors["discard"].stop()
+    stages = metrics.snapshot()["stages"]
+    assert stages["read"]["documents"] == 5
+    assert stages["discard"]["documents"] == 5
+
+
+def test_transform_sink_discards_after_the_transform():
+    start_transform = mock.Mock()
+    actors, first_actor = start_discard_actors("transform", start_transform)
+    start_transform.assert_called_once_with(actors["discard"])
+    assert first_actor is start_transform.return_value
+    actors["discard"].stop()
@@ -0,0 +1,153 @@
+from populate_new.migrate_detection import start_actors
+from populate_new.sorting_hat import OidCache, SortingHatActor, shard_of
+from populate_new.spatial_index import ConeSearchIndex
+from unittest import mock
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def detection_writer_actor():
+    return mock.Mock()
+
+
+@pytest.fixture
+def object_writer_actor():
+    return mock.Mock()
+
+
+@pytest.fixture
+def db():
+    db = mock.MagicMock()
+    collection = db.__getitem__.return_value
+    collection.find.side_effect = lambda query, projection: [
+        {"_id": f"aid_{oid}", "oid": [f"other_{oid}", oid]}
+        for oid in query["oid"]["$in"]
+        if oid.startswith("known")
+    ]
+    collection.find_one.return_value = None
+    return db
+
+
+@pytest.fixture
+def sorting_hat(detection_writer_actor, object_writer_actor, db):
+    sorting_hat = SortingHatActor.start(
+        detection_writer_actor, object_writer_actor, db, query_chunk_size=2
+    )
+    yield sorting_hat
+    sorting_hat.stop()
+
+
+def make_message(oids):
+    return {oid: [{"oid": oid, "ra": 10.0, "dec": -10.0}] for oid in oids}
+
+
+def test_oid_cache_evicts_least_recently_used():
+    cache = OidCache(2)
+    cache.put("oid1", 1)
+    cache.put("oid2", 2)
+    assert cache.get("oid1") == 1
+    cache.put("oid3", 3)
+    assert "oid2" not in cache
+    assert cache.get("oid2") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_oid_cache_without_max_size_keeps_every_oid():
+    cache = OidCache(None)
+    for i in range(1000):
+        cache.put(f"oid{i}", i)
+    assert len(cache) == 1000
+
+
+def test_get_aid_by_oid_queries_in_chunks(sorting_hat, db):
+    message = make_message(["known1", "known2", "known3"])
+    sorting_hat.ask(message)
+    assert db["object"].find.call_count == 2
+
+
+def test_get_aid_by_oid_uses_cache(sorting_hat, db, detection_writer_actor):
+    sorting_hat.ask(make_message(["known1"]))
+    sorting_hat.ask(make_message(["known1"]))
+    assert db["object"].find.call_count == 1
+    detections = detection_writer_actor.tell.call_args.args[0]
+    assert detections[0]["aid"] == "aid_known1"
+    # only the oids of the message are cached
+    assert "other_known1" not in sorting_hat.proxy().cache.get().data
+
+
+def test_assign_aid_creates_only_missing_objects(
+    sorting_hat, detection_writer_actor, object_writer_actor
+):
+    sorting_hat.ask(make_message(["known1", "unknown1"]))
+    detections = detection_writer_actor.tell.call_args.args[0]
+    assert len(detections) == 2
+    objects = object_writer_actor.tell.call_args.args[0]
+    assert [obj["oid"] for obj in objects] == [["unknown1"]]
+    assert objects[0]["_id"] == detections[1]["aid"]
+
+
+def test_conesearch_uses_spatial_index(detection_writer_actor, object_writer_actor, db):
+    spatial_index = ConeSearchIndex()
+    sorting_hat = SortingHatActor.start(
+        detection_writer_actor, object_writer_actor, db, spatial_index
+    )
+    sorting_hat.ask(make_message(["unknown1"]))
+    sorting_hat.ask(make_message(["unknown2"]))
+    sorting_hat.stop()
+    first, second = [c.args[0][0] for c in detection_writer_actor.tell.call_args_list]
+    assert first["aid"] == second["aid"]
+    assert object_writer_actor.tell.call_count == 1
+    db["object"].find_one.assert_not_called()
+
+
+def test_id_generator_batch_matches_scalar():
+    sorting_hat = SortingHatActor(mock.Mock(), mock.Mock(), mock.Mock())
+    rng = np.random.default_rng(42)
+    size = 2_000_000
+    ra = rng.uniform(-360, 720, size)
+    dec = rng.uniform(-90, 90, size)
+    # exact values on the branch boundaries
+    ra[:6] = [0.0, -0.0, 360.0, -360.0, 359.999999, 15.0]
+    dec[:6] = [0.0, -0.0, 90.0, -90.0, -0.000001, 89.999999]
+    aids = sorting_hat.id_generator_batch(ra, dec).tolist()
+    expected = [
+        sorting_hat.id_generator(r, d) for r, d in zip(ra.tolist(), dec.tolist())
+    ]
+    assert aids == expected
+
+
+def test_split_cache_by_shard():
+    cache = OidCache(10)
+    for i in range(6):
+        cache.put(f"oid{i}", i)
+    caches = cache.split(3)
+    for shard, shard_cache in enumerate(caches):
+        assert all(shard_of(oid, 3) == shard for oid in shard_cache.data)
+    assert sum(len(c) for c in caches) == 6
+
+
+def test_shards_share_the_spatial_index(
+    detection_writer_actor, object_writer_actor, db
+):
+    spatial_index = ConeSearchIndex()
+    shards = [
+        SortingHatActor.start(
+            detection_writer_actor, object_writer_actor, db, spatial_index, shard=i
+        )
+        for i in range(2)
+    ]
+    shards[0].ask({"new1": [{"oid": "new1", "ra": 10.0, "dec": -10.0}]})
+    shards[1].ask({"new2": [{"oid": "new2", "ra": 10.0, "dec": -10.0}]})
+    for shard in shards:
+        shard.stop()
+    aids = [
+        call.args[0][0]["aid"] for call in detection_writer_actor.tell.call_args_list
+    ]
+    assert aids[0] == aids[1]
+    object_writer_actor.tell.assert_called_once()
+
+
+def test_shards_require_the_spatial_index(db):
+    with pytest.raises(ValueError):
+        start_actors(db, 10, True, False, None, None, 1, 1, sorting_hat_shards=2)
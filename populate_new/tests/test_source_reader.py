@@ -0,0 +1,74 @@
+from populate_new.source_reader import (
+    PartitionReaderActor,
+    compute_split_points,
+    partition_ranges,
+)
+from populate_new.memory_db import MemoryCollection, MemoryDatabase
+from bson.raw_bson import RawBSONDocument
+from unittest import mock
+import bson
+
+
+def test_compute_split_points_uses_sample_quantiles():
+    collection = mock.Mock()
+    collection.aggregate.return_value = [{"_id": i} for i in reversed(range(100))]
+    assert compute_split_points(collection, 4) == [25, 50, 75]
+
+
+def test_compute_split_points_single_partition():
+    collection = mock.Mock()
+    assert compute_split_points(collection, 1) == []
+    collection.aggregate.assert_not_called()
+
+
+def test_partition_ranges():
+    assert partition_ranges([25, 50]) == [(None, 25), (25, 50), (50, None)]
+    assert partition_ranges([]) == [(None, None)]
+
+
+def test_reader_queries_its_range():
+    collection = mock.MagicMock()
+    documents = [RawBSONDocument(bson.encode({"_id": i})) for i in range(3)]
+    collection.find.return_value.hint.return_value = iter(documents)
+    next_actor = mock.Mock()
+    reader = PartitionReaderActor.start(0, collection, 10, 20, next_actor, 100)
+    assert reader.ask({"type": "read"}) == 3
+    reader.stop()
+    assert collection.find.call_args.args[0] == {"_id": {"$gte": 10, "$lt": 20}}
+    next_actor.tell.assert_called_once_with([document.raw for document in documents])
+
+
+def test_reader_sends_complete_after_its_range():
+    collection = mock.MagicMock()
+    documents = [RawBSONDocument(bson.encode({"_id": i})) for i in range(3)]
+    collection.find.return_value.hint.return_value = iter(documents)
+    next_actor = mock.Mock()
+    reader = PartitionReaderActor.start(
+        1, collection, None, None, next_actor, 100, send_complete=True
+    )
+    reader.ask({"type": "read"})
+    reader.stop()
+    assert next_actor.tell.call_args_list[-1] == mock.call(
+        {"type": "complete", "partition": 1}
+    )
+
+
+def test_reader_sends_oid_watermarks():
+    collection = MemoryCollection(MemoryDatabase(), "detection", ("_id",))
+    collection.insert_many(
+        [{"_id": i, "oid": f"oid{i % 3}"} for i in range(6)]
+        + [{"_id": 6, "oid": "oid9"}]
+    )
+    next_actor = mock.Mock()
+    reader = PartitionReaderActor.start(
+        0, collection, None, "oid9", next_actor, 100, send_complete=True, key="oid"
+    )
+    assert reader.ask({"type": "read"}) == 6
+    reader.stop()
+    batch, watermark, complete = [
+        call.args[0] for call in next_actor.tell.call_args_list
+    ]
+    oids = [bson.decode(raw)["oid"] for raw in batch]
+    assert oids == ["oid0", "oid0", "oid1", "oid1", "oid2", "oid2"]
+    assert watermark == {"type": "watermark", "partition": 0, "oid": "oid2"}
+    assert complete["type"] == "complete"
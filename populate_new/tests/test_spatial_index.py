@@ -0,0 +1,29 @@
+from populate_new.spatial_index import ConeSearchIndex
+
+
+def test_query_finds_nearest_within_radius():
+    index = ConeSearchIndex()
+    index.add(10, 20, "aid1")
+    index.add(10 + 0.5 / 3600, 20, "aid2")
+    assert index.query(10 + 0.4 / 3600, 20, 1) == "aid2"
+    assert index.query(10, 20 + 2 / 3600, 1) is None
+
+
+def test_query_wraps_around_right_ascension():
+    index = ConeSearchIndex()
+    index.add(359.9999, 0, "aid1")
+    assert index.query(0.0001, 0, 1) == "aid1"
+
+
+def test_query_near_the_pole():
+    index = ConeSearchIndex()
+    index.add(0, 89.9999, "aid1")
+    assert index.query(180, 89.9999, 1) == "aid1"
+
+
+def test_add_object_uses_loc():
+    index = ConeSearchIndex()
+    index.add_object(
+        {"_id": "aid1", "oid": ["oid1"], "loc": {"coordinates": [-170, 5]}}
+    )
+    assert index.query_many([(10, 5), (50, 5)], 1) == ["aid1", None]
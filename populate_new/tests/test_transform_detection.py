@@ -1,6 +1,9 @@
+from populate_new.backpressure import InflightLimiter
+from populate_new.metrics import MetricsRegistry
 from populate_new.transform_detection import TransformDetectionActor
 from .utils import generate_detections, generate_objects
 from unittest import mock
+import bson
 import pytest
 
 
@@ -20,4 +23,69 @@ def test_transform_detection_actor(transform_actor, grouper_actor):
     objects = [obj for obj in generate_objects(5)]
     detections = [d for d in generate_detections(objects)]
     transform_actor.ask(detections)
-    assert grouper_actor.tell.call_count == 5
+    transform_actor.stop()
+    # each message is transformed as a whole by one worker
+    assert grouper_actor.tell.call_count == 1
+
+
+def test_transform_detection_actor_keeps_every_detection(
+    transform_actor, grouper_actor
+):
+    objects = [obj for obj in generate_objects(7)]
+    detections = [bson.encode(d) for d in generate_detections(objects)]
+    transform_actor.ask(detections)
+    transform_actor.stop()
+    transformed = [d for c in grouper_actor.tell.call_args_list for d in c.args[0]]
+    assert [d["candid"] for d in transformed] == [
+        bson.decode(d)["_id"] for d in detections
+    ]
+
+
+def test_transform_detection_actor_keeps_message_order(grouper_actor):
+    transform_actor = TransformDetectionActor.start(grouper_actor, 3, max_pending=4)
+    objects = [obj for obj in generate_objects(20)]
+    detections = [bson.encode(d) for d in generate_detections(objects)]
+    batches = [detections[i : i + 7] for i in range(0, len(detections), 7)]
+    for i, batch in enumerate(batches):
+        transform_actor.tell(batch)
+        transform_actor.tell({"type": "watermark", "partition": 0, "oid": i})
+    transform_actor.stop()
+    messages = [c.args[0] for c in grouper_actor.tell.call_args_list]
+    assert len(messages) == 2 * len(batches)
+    for i, batch in enumerate(batches):
+        assert [d["candid"] for d in messages[2 * i]] == [
+            bson.decode(d)["_id"] for d in batch
+        ]
+        assert messages[2 * i + 1]["oid"] == i
+
+
+def test_failed_messages_are_sent_on_empty(grouper_actor):
+    limiter = InflightLimiter(100)
+    transform_actor = TransformDetectionActor.start(grouper_actor, 2, limiter=limiter)
+    objects = [obj for obj in generate_objects(3)]
+    detections = [bson.encode(d) for d in generate_detections(objects)]
+    limiter.acquire(len(detections) + 1)
+    transform_actor.tell(detections)
+    transform_actor.tell([bson.encode({"_id": "broken"})])
+    transform_actor.tell({"type": "watermark", "partition": 0, "oid": "oid1"})
+    transform_actor.stop()
+    messages = [c.args[0] for c in grouper_actor.tell.call_args_list]
+    assert [len(message) for message in messages[:2]] == [len(detections), 0]
+    assert messages[2]["type"] == "watermark"
+    # only the credits of the failed message are released here
+    assert limiter.inflight == len(detections)
+
+
+def test_transform_and_decode_stages_are_recorded(grouper_actor):
+    metrics = MetricsRegistry()
+    transform_actor = TransformDetectionActor.start(grouper_actor, 2, metrics=metrics)
+    objects = [obj for obj in generate_objects(3)]
+    detections = [bson.encode(d) for d in generate_detections(objects)]
+    transform_actor.tell(detections)
+    transform_actor.tell([bson.encode({"_id": "broken"})])
+    transform_actor.stop()
+    stages = metrics.snapshot()["stages"]
+    assert stages["transform"]["documents"] == len(detections)
+    assert stages["transform"]["errors"] == 1
+    assert stages["decode"]["documents"] == len(detections)
+    assert stages["decode"]["batches"] == 1
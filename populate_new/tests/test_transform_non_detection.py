@@ -0,0 +1,26 @@
+from populate_new.transform_non_detection import TransformNonDetectionActor
+from unittest import mock
+import bson
+
+
+def test_transform_non_detection_actor():
+    non_detections = [
+        {
+            "_id": f"id{i}",
+            "aid": "aid1",
+            "oid": "oid1",
+            "tid": "ZTF",
+            "mjd": 1.0,
+            "fid": 1,
+            "diffmaglim": 20.0,
+            "extra_fields": {},
+        }
+        for i in range(5)
+    ]
+    operation_actor = mock.Mock()
+    transform_actor = TransformNonDetectionActor.start(operation_actor, 2)
+    transform_actor.ask([bson.encode(n) for n in non_detections])
+    transform_actor.stop()
+    transformed = [d for c in operation_actor.tell.call_args_list for d in c.args[0]]
+    assert [d["_id"] for d in transformed] == [n["_id"] for n in non_detections]
+    assert all(d["sid"] == "ZTF" for d in transformed)
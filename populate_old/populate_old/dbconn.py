@@ -1,8 +1,7 @@
 from db_plugins.db.mongo import MongoConnection
+from pymongo import MongoClient
 from pymongo.database import Database
 
-# Create a connection to the database
-db_conn = MongoConnection()
 db_settings = {
     "HOST": "localhost",
     "USER": "",
@@ -11,7 +10,25 @@ db_settings = {
     "DATABASE": "old_db",
 }
 
-db_conn.connect(db_settings)
-db_conn.create_db()
 
-db: Database = db_conn.database
+def create_db(settings: dict = db_settings) -> Database:
+    """Creates the collections and indexes of the database and returns it"""
+    db_conn = MongoConnection()
+    db_conn.connect(settings)
+    db_conn.create_db()
+    return db_conn.database
+
+
+def connect(settings: dict = db_settings) -> Database:
+    """Opens a new client to the database.
+
+    Clients can not be shared between processes, so each worker process calls this with
+    the settings instead of receiving a database.
+    """
+    client = MongoClient(
+        host=settings["HOST"],
+        port=settings["PORT"],
+        username=settings["USER"] or None,
+        password=settings["PASSWORD"] or None,
+    )
+    return client[settings["DATABASE"]]
@@ -45,10 +45,9 @@ def append_detection(objects: list, detections: ListProxy):
             detections.append(_generate_single_detection(obj))
 
 
-def generate_detection(objects: List[dict]) -> List[InsertOne]:
+def generate_detection(objects: List[dict], nprocess: int = 8) -> List[InsertOne]:
     detections = Manager().list()
 
-    nprocess = 8
     size = int(len(objects) / nprocess)
 
     with Pool(processes=nprocess) as pool:
@@ -33,10 +33,9 @@ def append_non_detection(objects: list, non_detections: ListProxy):
             non_detections.append(_generate_single_non_detection(obj))
 
 
-def generate_non_detection(objects: List[dict]) -> List[InsertOne]:
+def generate_non_detection(objects: List[dict], nprocess: int = 8) -> List[InsertOne]:
     non_detections = Manager().list()
 
-    nprocess = 8
     size = int(len(objects) / nprocess)
 
     with Pool(processes=nprocess) as pool:
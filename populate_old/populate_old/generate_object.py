@@ -6,48 +6,55 @@ from multiprocessing.managers import ListProxy
 from pymongo import InsertOne
 
 
-def append_object(start, end, objects: ListProxy, commands: ListProxy):
-    def generate_oid() -> List[str]:
-        random_number = randint(1, 10)
-        return [f"oid{i}" for i in range(random_number)]
+def generate_oid() -> List[str]:
+    random_number = randint(1, 10)
+    return [f"oid{i}" for i in range(random_number)]
+
+
+def generate_tid() -> List[str]:
+    tids = []
+    for _ in range(2):
+        random_number = randint(1, 2)
+        tid = "ZTF" if random_number % 2 else "ATLAS"
+        if tid not in tids:
+            tids.append(tid)
+    return tids
 
-    def generate_tid() -> List[str]:
-        tids = []
-        for _ in range(2):
-            random_number = randint(1, 2)
-            tid = "ZTF" if random_number % 2 else "ATLAS"
-            if tid not in tids:
-                tids.append(tid)
-        return tids
 
+def generate_single_object(j: int) -> dict:
+    ra = random()
+    dec = random()
+    return {
+        "_id": f"aid{j}",
+        "aid": f"aid{j}",
+        "oid": generate_oid(),
+        "lastmjd": random(),
+        "firstmjd": random(),
+        "ndet": randint(1, 100),
+        "meanra": ra,
+        "meandec": dec,
+        "loc": {"type": "Point", "coordinates": [ra - 180, dec]},
+        "extra_fields": {
+            "e_ra": random(),
+            "e_dec": random(),
+            "tid": generate_tid(),
+        },
+    }
+
+
+def append_object(start, end, objects: ListProxy, commands: ListProxy):
     for j in range(start, end):
-        ra = random()
-        dec = random()
-        object = {
-            "_id": f"aid{j}",
-            "aid": f"aid{j}",
-            "oid": generate_oid(),
-            "lastmjd": random(),
-            "firstmjd": random(),
-            "ndet": randint(1, 100),
-            "meanra": ra,
-            "meandec": dec,
-            "loc": {"type": "Point", "coordinates": [ra - 180, dec]},
-            "extra_fields": {
-                "e_ra": random(),
-                "e_dec": random(),
-                "tid": generate_tid(),
-            },
-        }
+        object = generate_single_object(j)
         objects.append(object)
         commands.append(InsertOne(object))
 
 
-def generate_object(number: int) -> Tuple[List[dict], List[InsertOne]]:
+def generate_object(
+    number: int, nprocess: int = 8
+) -> Tuple[List[dict], List[InsertOne]]:
     objects = Manager().list()
     commands = Manager().list()
 
-    nprocess = 8
     size = int(number / nprocess)
 
     with Pool(processes=nprocess) as pool:
@@ -0,0 +1,126 @@
+import random
+import time
+from multiprocessing import get_context
+from typing import Dict, List, Tuple
+import numpy as np
+from pymongo import InsertOne
+from pymongo.database import Database
+from dbconn import connect
+from loader import report
+from generate_object import generate_single_object
+from generate_detection import _generate_single_detection
+from generate_non_detection import _generate_single_non_detection
+import generate_vectorized
+
+COLLECTIONS = ["object", "detection", "non_detection"]
+
+
+def chunk_ranges(number: int, nprocess: int) -> List[Tuple[int, int]]:
+    """Splits ``range(number)`` in ``nprocess`` contiguous ranges of similar size"""
+    size, remainder = divmod(number, nprocess)
+    ranges, start = [], 0
+    for i in range(nprocess):
+        end = start + size + (1 if i < remainder else 0)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+class BatchWriter:
+    """Buffers the insert commands of each collection and writes them in fixed size batches"""
+
+    def __init__(self, db: Database, batch_size: int):
+        self.db = db
+        self.batch_size = batch_size
+        self.buffers: Dict[str, List[InsertOne]] = {name: [] for name in COLLECTIONS}
+        self.counts = {name: 0 for name in COLLECTIONS}
+
+    def add(self, collection: str, command: InsertOne):
+        self.buffers[collection].append(command)
+        if len(self.buffers[collection]) >= self.batch_size:
+            self.flush(collection)
+
+    def flush(self, collection: str):
+        commands = self.buffers[collection]
+        if commands:
+            self.db[collection].bulk_write(commands, ordered=False)
+            self.counts[collection] += len(commands)
+            self.buffers[collection] = []
+
+    def flush_all(self):
+        for collection in COLLECTIONS:
+            self.flush(collection)
+
+
+def generate_chunk(
+    start: int,
+    end: int,
+    settings: dict,
+    batch_size: int,
+    vectorized: bool = False,
+    seed: int = None,
+) -> dict:
+    """Generates and inserts the objects ``start`` to ``end`` with their detections and
+    non detections.
+
+    Runs in a worker process with its own client. Only one batch per collection is kept in
+    memory, so memory does not grow with the number of objects. When ``vectorized``, the
+    documents are generated with NumPy for a block of objects at a time. The same seed,
+    number of objects and number of processes generate the same documents.
+    """
+    writer = BatchWriter(connect(settings), batch_size)
+    t0 = time.time()
+    if vectorized:
+        rng = np.random.default_rng(None if seed is None else [seed, start])
+        # objects have about 50 detections, so a block fills about one batch
+        block_size = max(1, batch_size // 50)
+        for block_start in range(start, end, block_size):
+            block_end = min(block_start + block_size, end)
+            objects, documents = generate_vectorized.generate_objects(
+                block_start, block_end, rng, raw=True
+            )
+            for document in documents:
+                writer.add("object", InsertOne(document))
+            for document in generate_vectorized.generate_detections(
+                objects, rng, raw=True
+            ):
+                writer.add("detection", InsertOne(document))
+            for document in generate_vectorized.generate_non_detections(
+                objects, rng, raw=True
+            ):
+                writer.add("non_detection", InsertOne(document))
+    else:
+        if seed is not None:
+            random.seed(f"{seed}-{start}")
+        for j in range(start, end):
+            obj = generate_single_object(j)
+            writer.add("object", InsertOne(obj))
+            for _ in range(obj["ndet"]):
+                writer.add("detection", _generate_single_detection(obj))
+                writer.add("non_detection", _generate_single_non_detection(obj))
+    writer.flush_all()
+    writer.db.client.close()
+    return {"range": (start, end), "counts": writer.counts, "seconds": time.time() - t0}
+
+
+def stream_generate(
+    number: int,
+    nprocess: int,
+    settings: dict,
+    batch_size: int,
+    vectorized: bool = False,
+    seed: int = None,
+) -> Dict[str, int]:
+    """Generates ``number`` objects in ``nprocess`` worker processes that insert their own
+    documents as they generate them, returning the number of documents of each collection
+    """
+    t0 = time.time()
+    with get_context("spawn").Pool(processes=nprocess) as pool:
+        results = pool.starmap(
+            generate_chunk,
+            [
+                (start, end, settings, batch_size, vectorized, seed)
+                for start, end in chunk_ranges(number, nprocess)
+            ],
+        )
+    return report(results, time.time() - t0)
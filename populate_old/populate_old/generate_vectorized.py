@@ -0,0 +1,190 @@
+from typing import List, Tuple
+import numpy as np
+from bson import encode
+from bson.raw_bson import RawBSONDocument
+
+TIDS = np.array(["ATLAS", "ZTF"])
+
+
+def _uuids(rng: np.random.Generator, n: int) -> List[str]:
+    """Random version 4 uuids, formatted like ``str(uuid4())``"""
+    data = rng.integers(0, 256, (n, 16), dtype=np.uint8)
+    data[:, 6] = data[:, 6] & 0x0F | 0x40
+    data[:, 8] = data[:, 8] & 0x3F | 0x80
+    hexes = data.tobytes().hex()
+    return [
+        f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+        for h in (hexes[i : i + 32] for i in range(0, 32 * n, 32))
+    ]
+
+
+def _pick(rng: np.random.Generator, lists: List[list], index: np.ndarray) -> list:
+    """Picks a uniformly random element of the list of each object, once per index"""
+    lengths = np.array([len(values) for values in lists])[index]
+    choice = (rng.random(len(index)) * lengths).astype(np.int64)
+    return [lists[i][c] for i, c in zip(index.tolist(), choice.tolist())]
+
+
+def _as_raw(documents: List[dict], raw: bool) -> list:
+    if raw:
+        return [RawBSONDocument(encode(document)) for document in documents]
+    return documents
+
+
+def generate_objects(
+    start: int, end: int, rng: np.random.Generator, raw: bool = False
+) -> Tuple[List[dict], list]:
+    """Generates the objects ``start`` to ``end`` with the distributions of
+    ``generate_single_object``.
+
+    Returns
+    -------
+    Tuple[List[dict], list]
+        The objects, used to generate their detections, and the documents to insert, encoded
+        when ``raw`` is True
+    """
+    n = end - start
+    ra, dec = rng.random(n), rng.random(n)
+    lastmjd, firstmjd = rng.random(n), rng.random(n)
+    e_ra, e_dec = rng.random(n), rng.random(n)
+    ndet = rng.integers(1, 101, n)
+    noid = rng.integers(1, 11, n)
+    # two draws of ZTF or ATLAS, keeping the first occurrence of each
+    draws = TIDS[rng.integers(0, 2, (n, 2))].tolist()
+    objects = [
+        {
+            "_id": f"aid{j}",
+            "aid": f"aid{j}",
+            "oid": [f"oid{i}" for i in range(k)],
+            "lastmjd": last,
+            "firstmjd": first,
+            "ndet": nd,
+            "meanra": r,
+            "meandec": d,
+            "loc": {"type": "Point", "coordinates": [r - 180, d]},
+            "extra_fields": {
+                "e_ra": er,
+                "e_dec": ed,
+                "tid": list(dict.fromkeys(tid)),
+            },
+        }
+        for j, k, last, first, nd, r, d, er, ed, tid in zip(
+            range(start, end),
+            noid.tolist(),
+            lastmjd.tolist(),
+            firstmjd.tolist(),
+            ndet.tolist(),
+            ra.tolist(),
+            dec.tolist(),
+            e_ra.tolist(),
+            e_dec.tolist(),
+            draws,
+        )
+    ]
+    return objects, _as_raw(objects, raw)
+
+
+def _columns(objects: List[dict], rng: np.random.Generator) -> dict:
+    """Columns shared by the detections and non detections, ``ndet`` rows per object"""
+    index = np.repeat(np.arange(len(objects)), [obj["ndet"] for obj in objects])
+    first = np.array([obj["firstmjd"] for obj in objects])[index]
+    last = np.array([obj["lastmjd"] for obj in objects])[index]
+    return {
+        "index": index,
+        "_id": _uuids(rng, len(index)),
+        "tid": _pick(rng, [obj["extra_fields"]["tid"] for obj in objects], index),
+        "oid": _pick(rng, [obj["oid"] for obj in objects], index),
+        "mjd": (first + rng.random(len(index)) * (last - first)).tolist(),
+        "fid": rng.integers(1, 5, len(index)).tolist(),
+    }
+
+
+def generate_detections(
+    objects: List[dict], rng: np.random.Generator, raw: bool = False
+) -> list:
+    """Generates ``ndet`` detections per object with the distributions of
+    ``_generate_single_detection``"""
+    columns = _columns(objects, rng)
+    index = columns["index"]
+    n = len(index)
+    e_ra = np.array([obj["extra_fields"]["e_ra"] for obj in objects])[index]
+    e_dec = np.array([obj["extra_fields"]["e_dec"] for obj in objects])[index]
+    ra = np.array([obj["meanra"] for obj in objects])[index] + rng.random(n) * e_ra
+    dec = np.array([obj["meandec"] for obj in objects])[index] + rng.random(n) * e_dec
+    mag = 20 + rng.random(n) * 5
+    e_mag = rng.random(n)
+    isdiffpos = rng.integers(0, 2, n)
+    corrected = rng.random(n) > 0.5
+    detections = [
+        {
+            "_id": _id,
+            "tid": tid,
+            "aid": objects[i]["aid"],
+            "oid": oid,
+            "mjd": mjd,
+            "fid": fid,
+            "ra": r,
+            "dec": d,
+            "rb": None,
+            "mag": m,
+            "e_mag": em,
+            "rfid": None,
+            "e_ra": er,
+            "e_dec": ed,
+            "isdiffpos": pos,
+            "corrected": corr,
+            "parent_candid": None,
+            "has_stamp": True,
+            "step_id_corr": None,
+            "rbversion": None,
+            "extra_fields": {},
+        }
+        for i, _id, tid, oid, mjd, fid, r, d, m, em, er, ed, pos, corr in zip(
+            index.tolist(),
+            columns["_id"],
+            columns["tid"],
+            columns["oid"],
+            columns["mjd"],
+            columns["fid"],
+            ra.tolist(),
+            dec.tolist(),
+            mag.tolist(),
+            e_mag.tolist(),
+            e_ra.tolist(),
+            e_dec.tolist(),
+            isdiffpos.tolist(),
+            corrected.tolist(),
+        )
+    ]
+    return _as_raw(detections, raw)
+
+
+def generate_non_detections(
+    objects: List[dict], rng: np.random.Generator, raw: bool = False
+) -> list:
+    """Generates ``ndet`` non detections per object with the distributions of
+    ``_generate_single_non_detection``"""
+    columns = _columns(objects, rng)
+    diffmaglim = 20 + rng.random(len(columns["index"])) * 5
+    non_detections = [
+        {
+            "_id": _id,
+            "aid": objects[i]["aid"],
+            "oid": oid,
+            "tid": tid,
+            "mjd": mjd,
+            "diffmaglim": dml,
+            "fid": fid,
+            "extra_fields": {},
+        }
+        for i, _id, oid, tid, mjd, dml, fid in zip(
+            columns["index"].tolist(),
+            columns["_id"],
+            columns["oid"],
+            columns["tid"],
+            columns["mjd"],
+            diffmaglim.tolist(),
+            columns["fid"],
+        )
+    ]
+    return _as_raw(non_detections, raw)
@@ -0,0 +1,70 @@
+import time
+from multiprocessing import get_context
+from typing import Dict, List
+from pymongo import InsertOne
+from dbconn import connect
+
+
+def report(results: List[dict], elapsed: float) -> Dict[str, int]:
+    """Prints the insert rate of each worker and the aggregate rate, returning the number of
+    documents written to each collection"""
+    counts = {}
+    for i, result in enumerate(results):
+        total = sum(result["counts"].values())
+        rate = total / result["seconds"] if result["seconds"] > 0 else 0
+        print(
+            f"Worker {i} {result['range']}: {result['counts']} "
+            f"in {result['seconds']:.1f} s ({rate:.0f} documents/s)"
+        )
+        for collection, count in result["counts"].items():
+            counts[collection] = counts.get(collection, 0) + count
+    total = sum(counts.values())
+    rate = total / elapsed if elapsed > 0 else 0
+    print(f"Wrote {counts} in {elapsed:.1f} s ({rate:.0f} documents/s)")
+    return counts
+
+
+def write_chunk(
+    settings: dict,
+    collection: str,
+    commands: List[InsertOne],
+    batch_size: int,
+    start: int,
+) -> dict:
+    """Writes a chunk of commands in bulk writes of ``batch_size`` commands.
+
+    Runs in a worker process, which opens its own client from the settings.
+    """
+    db = connect(settings)
+    t0 = time.time()
+    for i in range(0, len(commands), batch_size):
+        db[collection].bulk_write(commands[i : i + batch_size], ordered=False)
+    db.client.close()
+    return {
+        "range": (start, start + len(commands)),
+        "counts": {collection: len(commands)},
+        "seconds": time.time() - t0,
+    }
+
+
+def parallel_bulk_write(
+    settings: dict,
+    collection: str,
+    commands: List[InsertOne],
+    nprocess: int,
+    batch_size: int,
+) -> Dict[str, int]:
+    """Splits the commands in one chunk per worker process and writes them concurrently.
+
+    The workers receive the connection settings instead of a client, since clients can not
+    be shared between processes.
+    """
+    size = -(-len(commands) // nprocess)
+    chunks = [
+        (settings, collection, commands[start : start + size], batch_size, start)
+        for start in range(0, len(commands), max(size, 1))
+    ]
+    t0 = time.time()
+    with get_context("spawn").Pool(processes=nprocess) as pool:
+        results = pool.starmap(write_chunk, chunks)
+    return report(results, time.time() - t0)
@@ -1,62 +1,96 @@
-from multiprocessing.managers import ListProxy
-from typing import List
+import argparse
 
-from pymongo.database import Database
-from dbconn import db
-from pymongo import InsertOne
+from dbconn import create_db, db_settings
 from generate_object import generate_object
 from generate_detection import generate_detection
 from generate_non_detection import generate_non_detection
-from multiprocessing import Manager, Pool
-
-
-def bulk_write_commands(db: Database, collection: str, commands):
-    db[collection].bulk_write(commands, ordered=False)
-
-
-def multi_bulk_write(db: Database, collection: str, commands):
-    nprocess = 8
-    size = int(len(commands) / nprocess)
-    with Pool(processes=nprocess) as pool:
-        pool_args = []
-        for i in range(nprocess):
-            start = i * size
-            end = (i + 1) * size
-            if i == nprocess - 1:
-                end = len(commands)
-            pool_args.append(
-                (
-                    db,
-                    collection,
-                    commands[start:end],
-                )
-            )
-        pool.starmap(bulk_write_commands, pool_args)
-        pool.close()
-        pool.join()
+from generate_stream import stream_generate
+from loader import parallel_bulk_write
 
 
-if __name__ == "__main__":
+def parse_args():
+    parser = argparse.ArgumentParser(description="Populate the database with fake data")
+    parser.add_argument(
+        "--objects", type=int, default=10000, help="Number of objects to generate"
+    )
+    parser.add_argument(
+        "--processes", type=int, default=8, help="Number of worker processes"
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Each worker inserts its documents while generating them, in batches",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1000,
+        help="Documents per bulk write",
+    )
+    parser.add_argument(
+        "--vectorized",
+        action="store_true",
+        help="Generate the documents of each batch of objects with NumPy when streaming",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Seed of the streamed documents, for reproducible datasets",
+    )
+    parser.add_argument("--host", default=db_settings["HOST"])
+    parser.add_argument("--port", type=int, default=db_settings["PORT"])
+    parser.add_argument("--database", default=db_settings["DATABASE"])
+    return parser.parse_args()
+
+
+def populate_in_memory(settings: dict, number: int, nprocess: int, batch_size: int):
+    """Generates every document before writing each collection with ``nprocess`` writer
+    processes"""
     ## Objects
     print("Generating objects")
-    objects, commands = generate_object(10000)
+    objects, commands = generate_object(number, nprocess)
     print(f"Generated {len(objects)} objects")
     print("Writing objects")
-    bulk_write_commands(db, "object", commands)
+    parallel_bulk_write(settings, "object", commands, nprocess, batch_size)
     print(f"Wrote {len(objects)} objects")
 
     ## Detections
     print("Generating detections")
-    detections = generate_detection(objects)
+    detections = generate_detection(objects, nprocess)
     print(f"Generated {len(detections)} detections")
     print("Writing detections")
-    bulk_write_commands(db, "detection", detections)
+    parallel_bulk_write(settings, "detection", detections, nprocess, batch_size)
     print(f"Wrote {len(detections)} detections")
 
     ## Non-detections
     print("Generating non-detections")
-    non_detections = generate_non_detection(objects)
+    non_detections = generate_non_detection(objects, nprocess)
     print(f"Generated {len(non_detections)} non-detections")
     print("Writing non-detections")
-    bulk_write_commands(db, "non_detection", non_detections)
+    parallel_bulk_write(settings, "non_detection", non_detections, nprocess, batch_size)
     print(f"Wrote {len(non_detections)} non-detections")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    settings = {
+        **db_settings,
+        "HOST": args.host,
+        "PORT": args.port,
+        "DATABASE": args.database,
+    }
+    create_db(settings)
+
+    if args.stream:
+        print(f"Generating {args.objects} objects with {args.processes} processes")
+        stream_generate(
+            args.objects,
+            args.processes,
+            settings,
+            args.batch_size,
+            args.vectorized,
+            args.seed,
+        )
+    else:
+        populate_in_memory(settings, args.objects, args.processes, args.batch_size)
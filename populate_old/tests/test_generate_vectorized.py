@@ -0,0 +1,145 @@
+import random
+from uuid import UUID
+import numpy as np
+from bson.raw_bson import RawBSONDocument
+from populate_old.generate_detection import _generate_single_detection
+from populate_old.generate_non_detection import _generate_single_non_detection
+from populate_old.generate_object import generate_single_object
+from populate_old.generate_vectorized import (
+    generate_detections,
+    generate_non_detections,
+    generate_objects,
+)
+
+
+def schema(document: dict) -> dict:
+    """Keys of the document with the type of each value, nested for subdocuments"""
+    return {
+        key: schema(value) if isinstance(value, dict) else type(value)
+        for key, value in document.items()
+    }
+
+
+def scalar_objects(n: int) -> list:
+    random.seed(0)
+    return [generate_single_object(j) for j in range(n)]
+
+
+def vectorized_objects(n: int, seed: int = 0) -> list:
+    objects, _ = generate_objects(0, n, np.random.default_rng(seed))
+    return objects
+
+
+def per_object(objects: list, generate) -> list:
+    """Pairs each document of ``generate`` with its object, ``ndet`` per object"""
+    random.seed(0)
+    return [(obj, generate(obj)._doc) for obj in objects for _ in range(obj["ndet"])]
+
+
+def paired(objects: list, documents: list) -> list:
+    index = [obj for obj in objects for _ in range(obj["ndet"])]
+    assert len(index) == len(documents)
+    return list(zip(index, documents))
+
+
+def assert_object_ranges(obj: dict):
+    assert obj["_id"] == obj["aid"]
+    assert 1 <= len(obj["oid"]) <= 10
+    assert obj["oid"] == [f"oid{i}" for i in range(len(obj["oid"]))]
+    assert 1 <= obj["ndet"] <= 100
+    for key in ["lastmjd", "firstmjd", "meanra", "meandec"]:
+        assert 0 <= obj[key] < 1
+    assert obj["loc"] == {
+        "type": "Point",
+        "coordinates": [obj["meanra"] - 180, obj["meandec"]],
+    }
+    assert 0 <= obj["extra_fields"]["e_ra"] < 1
+    assert 0 <= obj["extra_fields"]["e_dec"] < 1
+    tid = obj["extra_fields"]["tid"]
+    assert 1 <= len(tid) <= 2
+    assert len(set(tid)) == len(tid)
+    assert set(tid) <= {"ZTF", "ATLAS"}
+
+
+def assert_common_ranges(obj: dict, document: dict):
+    assert UUID(document["_id"]).version == 4
+    assert str(UUID(document["_id"])) == document["_id"]
+    assert document["aid"] == obj["aid"]
+    assert document["oid"] in obj["oid"]
+    assert document["tid"] in obj["extra_fields"]["tid"]
+    low, high = sorted([obj["firstmjd"], obj["lastmjd"]])
+    assert low <= document["mjd"] <= high
+    assert 1 <= document["fid"] <= 4
+
+
+def assert_detection_ranges(obj: dict, detection: dict):
+    assert_common_ranges(obj, detection)
+    assert obj["meanra"] <= detection["ra"] <= obj["meanra"] + detection["e_ra"]
+    assert obj["meandec"] <= detection["dec"] <= obj["meandec"] + detection["e_dec"]
+    assert detection["e_ra"] == obj["extra_fields"]["e_ra"]
+    assert detection["e_dec"] == obj["extra_fields"]["e_dec"]
+    assert 20 <= detection["mag"] < 25
+    assert 0 <= detection["e_mag"] < 1
+    assert detection["isdiffpos"] in (0, 1)
+
+
+def assert_non_detection_ranges(obj: dict, non_detection: dict):
+    assert_common_ranges(obj, non_detection)
+    assert 20 <= non_detection["diffmaglim"] < 25
+
+
+def test_objects_match_generate_single_object():
+    scalar, vectorized = scalar_objects(200), vectorized_objects(200)
+    assert [schema(obj) for obj in vectorized] == [schema(obj) for obj in scalar]
+    for obj in scalar + vectorized:
+        assert_object_ranges(obj)
+    # every value of the scalar generator is drawn
+    assert {len(obj["oid"]) for obj in vectorized} == set(range(1, 11))
+    assert {tuple(obj["extra_fields"]["tid"]) for obj in vectorized} == {
+        tuple(obj["extra_fields"]["tid"]) for obj in scalar
+    }
+
+
+def test_detections_match_generate_single_detection():
+    objects = vectorized_objects(50)
+    scalar = per_object(objects, _generate_single_detection)
+    vectorized = paired(objects, generate_detections(objects, np.random.default_rng(0)))
+    expected = schema(scalar[0][1])
+    for obj, detection in scalar + vectorized:
+        assert schema(detection) == expected
+        assert_detection_ranges(obj, detection)
+    assert {d["fid"] for _, d in vectorized} == {1, 2, 3, 4}
+    assert {d["corrected"] for _, d in vectorized} == {True, False}
+
+
+def test_non_detections_match_generate_single_non_detection():
+    objects = vectorized_objects(50)
+    scalar = per_object(objects, _generate_single_non_detection)
+    vectorized = paired(
+        objects, generate_non_detections(objects, np.random.default_rng(0))
+    )
+    expected = schema(scalar[0][1])
+    for obj, non_detection in scalar + vectorized:
+        assert schema(non_detection) == expected
+        assert_non_detection_ranges(obj, non_detection)
+
+
+def test_same_seed_generates_the_same_documents():
+    def generate(seed):
+        rng = np.random.default_rng(seed)
+        objects, raw = generate_objects(10, 40, rng, raw=True)
+        detections = generate_detections(objects, rng, raw=True)
+        non_detections = generate_non_detections(objects, rng, raw=True)
+        return [d.raw for d in raw + detections + non_detections]
+
+    first = generate(7)
+    assert all(isinstance(d, bytes) for d in first)
+    assert generate(7) == first
+    assert generate(8) != first
+
+
+def test_raw_documents_encode_the_generated_ones():
+    rng = np.random.default_rng(0)
+    objects, raw = generate_objects(0, 5, rng, raw=True)
+    assert all(isinstance(document, RawBSONDocument) for document in raw)
+    assert [document["_id"] for document in raw] == [obj["_id"] for obj in objects]